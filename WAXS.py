@@ -1,22 +1,60 @@
 import sys
+import argparse
+import copy
 import cv2
 import os
 import numpy as np
-import tempfile
-from scipy.interpolate import make_interp_spline
 import glob
+import hashlib
+import json
+import importlib
+import re
+import socket
+import threading
+import time
+import cProfile
+import pstats
+from contextlib import contextmanager, nullcontext
+import itertools
+import multiprocessing
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from PyQt5.QtWidgets import QApplication, QMainWindow, QPushButton, QFileDialog, QLabel, \
     QLineEdit, QVBoxLayout, QSizePolicy, QGridLayout, QWidget, QRadioButton, QButtonGroup, \
     QFileSystemModel, QTreeView, QHBoxLayout, QSplitter, QDesktopWidget, QMessageBox, QComboBox, \
-    QFrame, QCheckBox, QProgressBar, QMenu, QMenuBar, QAction, QTextEdit, QDialog, QSplashScreen
-from PyQt5.QtGui import QImage, QPixmap, QPainter, QTransform, QMovie
+    QFrame, QCheckBox, QProgressBar, QMenu, QMenuBar, QAction, QTextEdit, QDialog, QSplashScreen, \
+    QListWidget, QListWidgetItem, QListView, QSlider, QTableWidget, QTableWidgetItem, QHeaderView, \
+    QAbstractItemView, QStackedWidget
+from PyQt5.QtGui import QImage, QPixmap, QPainter, QTransform, QMovie, QIcon
 from PyQt5.QtCore import QSize, Qt, QRect, QPoint, QDir, QTimer, QCoreApplication, QEventLoop,\
-    QSettings, QThread, pyqtSignal, QResource
-from matplotlib import cm
+    QSettings, QThread, pyqtSignal, QResource, QObject
 import math
-import matplotlib.pyplot as plt
-from matplotlib.patches import Wedge
-from matplotlib.lines import Line2D
+
+
+class LazyModule:
+    """
+    首次访问属性时才导入的模块：matplotlib、scipy 导入较慢，推迟到第一次作图或插值时再导入，加快启动
+    """
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+plt = LazyModule('matplotlib.pyplot')
+mpatches = LazyModule('matplotlib.patches')
+mlines = LazyModule('matplotlib.lines')
+mfigure = LazyModule('matplotlib.figure')
+mcollections = LazyModule('matplotlib.collections')
+mcolors = LazyModule('matplotlib.colors')
+backend_qtagg = LazyModule('matplotlib.backends.backend_qt5agg')
+interpolate = LazyModule('scipy.interpolate')
+ndimage = LazyModule('scipy.ndimage')
+signal = LazyModule('scipy.signal')
 
 class MainWindow(QMainWindow):
     def __init__(self):
@@ -86,12 +124,19 @@ class MainWindow(QMainWindow):
         self.setWindowTitle('原位数据处理')
 
         # 创建菜单项
+        import_recipe_action = QAction('导入配方', self)
+        import_recipe_action.triggered.connect(self.import_recipe)
+        export_recipe_action = QAction('导出配方', self)
+        export_recipe_action.triggered.connect(self.export_recipe)
         help_action = QAction('程序说明', self)
         help_action.triggered.connect(self.show_help)
         about_action = QAction('About', self)
         about_action.triggered.connect(self.show_about)
 
         # 创建菜单
+        recipe_menu = QMenu('配方', self)
+        recipe_menu.addAction(import_recipe_action)
+        recipe_menu.addAction(export_recipe_action)
         help_menu = QMenu('Help', self)
         help_menu.addAction(help_action)
         about_menu = QMenu('About', self)
@@ -99,6 +144,7 @@ class MainWindow(QMainWindow):
 
         # 创建菜单栏并添加菜单
         menu_bar = QMenuBar(self)
+        menu_bar.addMenu(recipe_menu)
         menu_bar.addMenu(help_menu)
         menu_bar.addMenu(about_menu)
 
@@ -127,6 +173,7 @@ class MainWindow(QMainWindow):
         
         默认坐标系单位为 pixel
         转化为 Qxy 和 Qz 坐标选择“切图”
+        切图和一维曲线显示在可交互的画布中，可用上方工具栏缩放、平移，导出图片的尺寸与窗口大小无关
         
         1.4 导出二维图片
         
@@ -150,8 +197,9 @@ class MainWindow(QMainWindow):
         
         2.2 确定实验条件
         
-        修改“入射角”（单位：°），“圆心-X”（单位：pixel），“圆心-Y”(单位：pixel)，“距离”(单位：mm)，“像素-X”（单位：um），“像素-Y”（单位：um），“波长”（单位：埃）
-        实验条件的确定可以由 Fit2D 完成
+        修改“入射角”（单位：°），“圆心-X”（单位：pixel），“圆心-Y”(单位：pixel)，“距离”(单位：mm)，“像素-X”（单位：um），“像素-Y”（单位：um），“波长”（单位：埃），探测器不垂直于入射光时还需填写“倾斜角”和“倾斜方位角”（单位：°）
+        实验条件的确定可以由 Fit2D 完成，也可以导入标样（AgBe、LaB6、Si）图片，填好大致的圆心和距离以及准确的像素尺寸和波长后，
+        选择标样并点击“标定”，由衍射环自动拟合圆心、距离和探测器倾斜，确认后填入对应参数；距离初值偏差较大时勾选“标定时搜索距离”，衍射环覆盖的方位不足或倾斜不显著时倾斜记为 0（benchmark.py --calibration-check 可用合成标样检查标定）
         友情链接 Fit2D: http://ftp.esrf.eu/pub/expg/FIT2D/
         
         2.3 积分区域选择
@@ -167,14 +215,16 @@ class MainWindow(QMainWindow):
         2.5 选择坐标轴
         
         默认为 Log 坐标，q 为横坐标，单位埃分之一，降噪平滑
-        可选项：pixel 和 2Theta
-        2Theta 的为铜靶波长 1.54 埃下的角度
+        可选项：pixel、2Theta 和 d（晶面间距，埃）
+        2Theta 为参考波长下的角度，参考波长默认为铜靶 1.54 埃，可在“2theta 参考波长”中修改
+        积分结果会被保留：切换横坐标、平滑方式、参考波长和 Log/Linear 时直接重新作图，不需要重新读图和积分
         也可以选择对应的 unsmoothed 的未经过平滑操作的原始数据
+        平滑方式可选滑动平均（默认 5 点）、Savitzky-Golay、高斯或不平滑，右侧填写窗口宽度（点数，高斯为半高宽）；修改平滑方式后直接重新作图，不需要重新积分
         纵坐标也可以转化为线性坐标
         
         2.6 导出一维结果
         
-        先“选择导出文件夹”，然后点击积分结果导出-txt，导出格式为 txt
+        先“选择导出文件夹”，在“导出格式”中选择 txt、xye（带误差）、Fit2D chi、GSAS fxye、CSV 或 NeXus/HDF5，然后点击积分结果导出，同名文件会被覆盖
         
         3. 原位数据处理
         
@@ -205,11 +255,40 @@ class MainWindow(QMainWindow):
         
         点击批量处理后，导出 output 和 output_subbg 文件
         第一列是横坐标，之后每一列代表对应图片的积分坐标
+        导出格式不是 txt 时，另外在 1D/<格式>/ 中按所选格式导出：xye、chi、fxye 每帧一个文件，CSV 和 NeXus 整组一个文件；文件在后台写入，不影响界面操作
         可以用原位热图预览初步预览本组数据的情况，建议用 origin heatmap 模块进行处理
         
         3.7 导入已处理的原位数据
         
         点击原位文件导入，导入处理过的 output.txt 文件，显示原位热图预览
+        点击“曲线叠加”，在文本框中输入帧号（如 1-100, 200, 300-1000:10）添加或移除曲线，可切换叠加 / 瀑布显示，颜色表示帧序号
+        
+        3.8 处理配方与命令行批量处理
+        
+        菜单“配方”中可以把当前全部处理参数（几何、积分区域、阈值、校正文件、帧合并、扣背底和导出选项）导出为 JSON 配方，或导入配方恢复参数
+        同一配方可以在没有界面的计算节点上处理多个文件夹，--jobs 指定并行进程数：
+        python WAXS.py --recipe recipe.json --jobs 4 --output 导出文件夹 文件夹1 文件夹2 ...
+        
+        3.9 任务队列
+        
+        点击“任务队列”，逐个添加样品文件夹（可为每个任务指定配方文件，留空使用当前参数），设置并行数后点击开始
+        表格中显示每个任务的状态、帧数、跳过的帧和耗时，读取失败的帧重试后跳过，单个任务失败不影响其他任务
+        全部任务的记录保存在导出文件夹下的 jobs.json
+        
+        3.10 多节点分布式批量处理
+        
+        把队列文件夹放在各节点都能访问的共享存储上，先在任意一台机器上切块：
+        python WAXS.py --queue 队列文件夹 submit --recipe recipe.json --chunk 100 数据文件夹
+        再在各节点上启动任意多个 worker（同一台机器上也可以启动多个）：python WAXS.py --queue 队列文件夹 work --stale 600
+        worker 认领一块、积分后把结果写入 shards/，直到没有待处理的块；节点掉线时，超过 --stale 秒没有心跳的块由其他 worker 重新处理
+        全部完成后合并：python WAXS.py --queue 队列文件夹 merge，结果在 队列文件夹/merged 下，与单机批量处理相同；status 查看进度
+        
+        3.11 取向分析
+        
+        批量处理前勾选“取向分析”，填入一个或多个 q 环的范围（如 1.30-1.45; 1.60-1.70）和参考方向χ（默认 90°，即竖直方向）
+        每帧一次性提取所有 q 环的方位角分布，处理结束后计算 Herman 取向因子 f、mosaicity（方位角分布的圆标准差）、方位角半高宽和峰位
+        结果保存在导出文件夹的 orientation/ 下：orientation.txt 每帧一行，chi_profiles_q1.txt 等为各 q 环的方位角分布（第一列为χ，之后每列一帧）
+        取向分析的参数保存在配方中，命令行批量处理和分布式处理同样导出以上文件
         使用以上功能，您可以对二维散射图片进行处理、积分以及批量处理原位数据。如有疑问，请参阅相关文档或联系开发者。
         
         ————————————————————————————————
@@ -228,6 +307,54 @@ class MainWindow(QMainWindow):
         
         1.6 增加了对除tif，jpg外的图片文件的支持。
         
+        1.7 增加了暗场扣除、平场归一化和坏点掩码校正（文件导入或在图像上绘制），校正数组只计算一次，被掩盖的像素不参与积分。
+        
+        1.8 增加了立体角、偏振、洛伦兹和探测器吸收校正，校正因子并入积分权重，不增加逐帧计算量。
+        
+        1.9 增加了 EDF、CBF（需要 fabio）和 HDF5/NeXus（需要 h5py）格式的读取，Eiger master 等多帧文件可直接用于原位批量处理；批量处理时后台多线程预读后续帧。
+        
+        1.10 原位批量处理增加了积分前的帧合并：每 N 帧求和或平均、N 帧滑动平均以及 2×2/4×4 像素合并，圆心、像素尺寸和阈值自动换算。
+        
+        1.11 增加了抽样预览：从原位序列中均匀抽取若干帧快速生成粗略热图，可选在后台逐级补全到全部帧。
+        
+        1.12 批量处理结束后显示读取、积分、作图、导出等各环节的耗时汇总（吞吐量、分位数、主要耗时环节），可勾选性能分析保存 profile 文件。
+        
+        1.13 参数修改后的重绘改为合并调度：连续修改只重绘一次，内容未改变（如 Tab 切换）时不重绘，并只重算受影响的视图。
+        
+        1.14 加快启动：matplotlib 和 scipy 在首次作图或插值时才导入，文件树在窗口显示后再填充；benchmark.py --startup 可测量导入和首个窗口显示耗时。
+        
+        1.15 文件浏览器增加缩略图：选中文件夹后在后台生成各帧的缩略图及最大值、平均值、饱和像素数，按文件修改时间缓存到磁盘；双击缩略图导入图片。
+        
+        1.16 增加逐帧浏览：按文件名匹配模式载入序列后，可用滑块、播放和前后帧按钮浏览；原图模式下后台预读并渲染前后若干帧。
+        
+        1.17 增加标样标定：导入 AgBe、LaB6 或 Si 标样图片后点击“标定”，由衍射环自动拟合圆心、距离和探测器倾斜。
+        
+        1.18 原位批量处理增加圆心漂移校正：勾选后每 N 帧由衍射环对称性或直通光斑重新估计圆心，圆心按 0.25 像素量化以复用积分查找表，每帧所用圆心保存为 center_drift.txt。
+        
+        1.19 几何模型支持探测器倾斜和矩形像素：参数区增加“倾斜角”和“倾斜方位角”，积分按等效半径和实验室坐标系方位角分 bin，标定结果可直接填入，切图同样按倾斜几何换算。
+        
+        1.20 增加处理配方：完整的处理参数可以导出为带版本号的 JSON 并重新导入，命令行模式按配方无界面地并行处理多个文件夹。
+        
+        1.21 增加多文件夹任务队列：按配方在多个进程中并行处理多个样品文件夹，记录每个任务的状态、耗时和导出位置，读取失败的帧重试后跳过。
+        
+        1.22 增加了基于共享文件系统的多节点分布式批量处理：按块切分帧列表，各节点的 worker 原子认领、积分并写入分片，最后按顺序合并。
+        
+        1.23 处理流程默认使用 float32：坐标图、积分查找表权重和校正、合并后的帧均为 float32，只在积分累加和多帧求和时使用 float64，构建查找表的峰值内存约减半；benchmark.py --dtype-check 可检查与 float64 结果的偏差。
+        
+        1.24 原图显示改为写入与 QImage 共享内存的持久缓冲区（Indexed8 + Jet 颜色表），只在窗口内显示的像素上做阈值、掩码和 Colorbar 映射，修改参数和改变窗口大小后的重绘不再分配整帧数组。
+        
+        1.25 批量处理增加取向分析：对多个 q 环一次性提取方位角分布，导出 Herman 取向因子、mosaicity 和方位角半高宽随帧的变化，配方、命令行和分布式处理同样支持。
+        
+        1.26 一维曲线的平滑改为可选：滑动平均、Savitzky-Golay、高斯或不平滑，窗口宽度可调；只平滑需要的曲线，批量处理对整组曲线一次性平滑，修改平滑方式不再重新积分。平滑方式保存在配方中。
+        
+        1.27 积分结果与作图分离：切换横坐标、平滑方式和 Log/Linear 时只重新作图，不再读图和积分；2θ 的参考波长可以设置（默认 1.54 埃），横坐标增加晶面间距 d。
+        
+        1.28 切图和一维曲线改为嵌入窗口的 matplotlib 画布，可缩放、平移；逐帧只更新数据，不再保存临时图片再读回显示。修复新版 matplotlib 下导出原图时 cm.get_cmap 不存在的问题。
+        
+        1.29 批量结果增加曲线叠加 / 瀑布图，可同时显示上千条曲线
+        
+        1.30 一维结果可导出为 xye（带误差）、Fit2D chi、GSAS fxye、CSV 和 NeXus/HDF5，批量结果在后台线程中写入；文本整表一次格式化写出。修复单帧导出以追加方式打开、重复导出内容叠加的问题。
+        
         """
 
     def show_help(self):
@@ -240,7 +367,160 @@ class MainWindow(QMainWindow):
                                          '\nVersion v1.0'
                                          '\nDate 2023-05-03')
 
+    def current_recipe(self):
+        # 从界面控件读取完整的处理配方
+        parameter, layout, batch = self.parameter, self.image_layout, self.batch_processor
+        correction = self.image_widget.correction
+        number = parameter._get_float_or_default
+
+        def optional(text):
+            try:
+                return float(text)
+            except ValueError:
+                return None
+
+        anchors = getattr(batch, 'x_bg', None)
+        smoother = layout.smoother()
+        # 勾选取向分析时 q 范围无法解析或为空抛出 ValueError 交给调用方提示，避免保存出启用但没有 q 环的配方
+        series = batch.orientation_series()
+        if series is not None:
+            bands = [list(band) for band in series.bands]
+        else:
+            try:
+                bands = [list(band) for band in parse_q_bands(batch.orientation_bands.text())]
+            except ValueError:
+                bands = []
+        reference = optional(batch.orientation_reference.text())
+        return Recipe({
+            'geometry': {'x_center': parameter.x_Center_value, 'y_center': parameter.y_Center_value,
+                         'distance': parameter.distance_value, 'pixel_x': parameter.pixel_x_value,
+                         'pixel_y': parameter.pixel_y_value, 'lamda': parameter.lamda_value,
+                         'tilt': parameter.tilt_value, 'rotation': parameter.rotation_value,
+                         'incidence': parameter.Angle_incidence_value},
+            'integration': {'start_angle': number(layout.textbox_startAngle.text()),
+                            'end_angle': number(layout.textbox_endAngle.text()),
+                            'inner_radius': number(layout.textbox_innerRadius.text()),
+                            'outer_radius': number(layout.textbox_outerRadius.text()),
+                            'num_bins': int(parameter.numbin_value),
+                            'radial': layout.radioButtonRadial.isChecked(), 'axis': layout.comboBox.currentIndex(),
+                            'smoothing': smoother.method, 'smoothing_width': smoother.width,
+                            'reference_wavelength': layout.reference_wavelength()},
+            'mask': {'threshold_min': parameter.threshold_min_value, 'threshold_max': parameter.threshold_max_value},
+            'display': {'cb_min': number(layout.textbox_min.text()), 'cb_max': number(layout.textbox_max.text()),
+                        'log': layout.comboBox2.currentIndex() == 0, 'flip': layout.flip.isChecked(),
+                        'qr_min': parameter.Qr_min_value, 'qr_max': parameter.Qr_max_value,
+                        'qz_min': parameter.Qz_min_value, 'qz_max': parameter.Qz_max_value},
+            'correction': {'dark': correction.dark_file or '', 'flat': correction.flat_file or '',
+                           'mask': correction.mask_file or '',
+                           **vars(parameter.intensity_correction())},
+            'reduce': {'mode': FrameReducer.MODES[batch.reduce_mode.currentIndex()],
+                       'group': int(optional(batch.reduce_group.text()) or 1),
+                       'binning': (1, 2, 4)[batch.binning_combo.currentIndex()]},
+            'drift': {'enabled': batch.drift_check.isChecked(),
+                      'method': DriftTracker.METHODS[batch.drift_method.currentIndex()],
+                      'every': int(optional(batch.drift_every.text()) or 1)},
+            'orientation': {'enabled': batch.orientation_check.isChecked(), 'bands': bands,
+                            'reference': 90.0 if reference is None else reference, 'chi_bins': 360},
+            'background': {'enabled': batch.background_removal_check.isChecked(),
+                           'init_image': int(optional(batch.background_init_img.text()) or 1),
+                           'x_min': optional(batch.background_min.text()),
+                           'x_max': optional(batch.background_max.text()),
+                           'anchors': None if anchors is None else [float(x) for x in anchors]},
+            'export': {'pattern': batch.pattern_input.text(), 'curve': batch.export_curve_check.isChecked(),
+                       'image': batch.export_image_check.isChecked(),
+                       'format': ProfileExporter.FORMATS[layout.export_format.currentIndex()]},
+        })
+
+    def apply_recipe(self, recipe):
+        # 把配方写回界面控件，随后整体重绘一次
+        parameter, layout, batch = self.parameter, self.image_layout, self.batch_processor
+        fields = {'Angle_incidence': recipe['geometry']['incidence'], 'x_Center': recipe['geometry']['x_center'],
+                  'y_Center': recipe['geometry']['y_center'], 'distance': recipe['geometry']['distance'],
+                  'pixel_x': recipe['geometry']['pixel_x'], 'pixel_y': recipe['geometry']['pixel_y'],
+                  'lamda': recipe['geometry']['lamda'], 'tilt': recipe['geometry']['tilt'],
+                  'rotation': recipe['geometry']['rotation'], 'Qr_min': recipe['display']['qr_min'],
+                  'Qr_max': recipe['display']['qr_max'], 'Qz_min': recipe['display']['qz_min'],
+                  'Qz_max': recipe['display']['qz_max'], 'threshold_min': recipe['mask']['threshold_min'],
+                  'threshold_max': recipe['mask']['threshold_max'], 'numbin': recipe['integration']['num_bins']}
+        for key, value in fields.items():
+            getattr(parameter, key).setText(str(value))
+            parameter.update_value(key, str(value))
+
+        integration, display = recipe['integration'], recipe['display']
+        for textbox, value in ((layout.textbox_startAngle, integration['start_angle']),
+                               (layout.textbox_endAngle, integration['end_angle']),
+                               (layout.textbox_innerRadius, integration['inner_radius']),
+                               (layout.textbox_outerRadius, integration['outer_radius']),
+                               (layout.textbox_min, display['cb_min']), (layout.textbox_max, display['cb_max'])):
+            textbox.setText(str(value))
+        layout.update_rigionValues()
+        (layout.radioButtonRadial if integration['radial'] else layout.radioButtonAngular).setChecked(True)
+        layout.comboBox.setCurrentIndex(integration['axis'])
+        layout.smooth_method.setCurrentIndex(ProfileSmoother.METHODS.index(integration['smoothing']))
+        layout.smooth_width.setText(f"{integration['smoothing_width']:g}")
+        layout.textbox_reference_wavelength.setText(f"{integration['reference_wavelength']:g}")
+        layout.comboBox2.setCurrentIndex(0 if display['log'] else 1)
+        layout.flip.setChecked(display['flip'])
+
+        section = recipe['correction']
+        parameter.solid_angle_check.setChecked(section['solid_angle'])
+        parameter.polarization_check.setChecked(section['polarization'] is not None)
+        if section['polarization'] is not None:
+            parameter.polarization_factor.setText(str(section['polarization']))
+        parameter.lorentz_check.setChecked(section['lorentz'])
+        parameter.absorption_check.setChecked(section['absorption'] is not None)
+        if section['absorption'] is not None:
+            parameter.absorption_mu_t.setText(str(section['absorption']))
+        recipe.correction(self.image_widget.correction)
+        parameter.update_correction_label()
+
+        batch.reduce_mode.setCurrentIndex(FrameReducer.MODES.index(recipe['reduce']['mode']))
+        batch.reduce_group.setText(str(recipe['reduce']['group']))
+        batch.binning_combo.setCurrentIndex((1, 2, 4).index(recipe['reduce']['binning']))
+        batch.drift_check.setChecked(recipe['drift']['enabled'])
+        batch.drift_method.setCurrentIndex(DriftTracker.METHODS.index(recipe['drift']['method']))
+        batch.drift_every.setText(str(recipe['drift']['every']))
+        orientation = recipe['orientation']
+        batch.orientation_check.setChecked(orientation['enabled'])
+        batch.orientation_bands.setText('; '.join(f'{low:g}-{high:g}' for low, high in orientation['bands']))
+        batch.orientation_reference.setText(f"{orientation['reference']:g}")
+        background = recipe['background']
+        batch.background_removal_check.setChecked(background['enabled'])
+        batch.background_init_img.setText(str(background['init_image']))
+        batch.background_min.setText('' if background['x_min'] is None else str(background['x_min']))
+        batch.background_max.setText('' if background['x_max'] is None else str(background['x_max']))
+        if background['anchors'] is not None:
+            batch.x_bg = np.array(background['anchors'])
+        batch.pattern_input.setText(recipe['export']['pattern'])
+        batch.export_curve_check.setChecked(recipe['export']['curve'])
+        batch.export_image_check.setChecked(recipe['export']['image'])
+        if recipe['export']['format'] in ProfileExporter.FORMATS:
+            layout.export_format.setCurrentIndex(ProfileExporter.FORMATS.index(recipe['export']['format']))
+        self.image_widget.render_scheduler.invalidate(RenderScheduler.ALL, immediate=True)
+
+    def import_recipe(self):
+        file_name, _ = QFileDialog.getOpenFileName(self, '导入配方', '', 'Recipe Files (*.json);;All Files (*)')
+        if not file_name:
+            return
+        try:
+            recipe = Recipe.load(file_name)
+            self.apply_recipe(recipe)
+        except (OSError, ValueError) as e:
+            QMessageBox.warning(self, '警告', f'无法导入配方：{e}')
+
+    def export_recipe(self):
+        file_name, _ = QFileDialog.getSaveFileName(self, '导出配方', 'recipe.json',
+                                                   'Recipe Files (*.json);;All Files (*)')
+        if not file_name:
+            return
+        try:
+            self.current_recipe().save(file_name)
+        except (OSError, ValueError) as e:
+            QMessageBox.warning(self, '警告', f'无法导出配方：{e}')
+
     def closeEvent(self, event):
+        # 后台导出写完再退出
+        self.batch_processor.wait_export()
         # Save current settings
         settings = QSettings('mycompany', 'myapp')
         settings.setValue('Angle_incidence', self.parameter.Angle_incidence.text())
@@ -250,8 +530,12 @@ class MainWindow(QMainWindow):
         settings.setValue('pixel_x', self.parameter.pixel_x.text())
         settings.setValue('pixel_y', self.parameter.pixel_y.text())
         settings.setValue('lamda', self.parameter.lamda.text())
+        settings.setValue('tilt', self.parameter.tilt.text())
+        settings.setValue('rotation', self.parameter.rotation.text())
         settings.setValue('textbox_min',self.image_layout.textbox_min.text())
         settings.setValue('textbox_max', self.image_layout.textbox_max.text())
+        settings.setValue('reference_wavelength', self.image_layout.textbox_reference_wavelength.text())
+        settings.setValue('export_format', ProfileExporter.FORMATS[self.image_layout.export_format.currentIndex()])
         settings.setValue('Qr_min', self.parameter.Qr_min.text())
         settings.setValue('Qr_max', self.parameter.Qr_max.text())
         settings.setValue('Qz_min', self.parameter.Qz_min.text())
@@ -259,6 +543,20 @@ class MainWindow(QMainWindow):
         settings.setValue('threshold_min', self.parameter.threshold_min.text())
         settings.setValue('threshold_max', self.parameter.threshold_max.text())
         settings.setValue('numbin', self.parameter.numbin.text())
+        settings.setValue('solid_angle', self.parameter.solid_angle_check.isChecked())
+        settings.setValue('polarization', self.parameter.polarization_check.isChecked())
+        settings.setValue('polarization_factor', self.parameter.polarization_factor.text())
+        settings.setValue('lorentz', self.parameter.lorentz_check.isChecked())
+        settings.setValue('absorption', self.parameter.absorption_check.isChecked())
+        settings.setValue('absorption_mu_t', self.parameter.absorption_mu_t.text())
+        correction = self.image_widget.correction
+        settings.setValue('dark_file', correction.dark_file or '')
+        settings.setValue('flat_file', correction.flat_file or '')
+        settings.setValue('mask_file', correction.mask_file or '')
+        self.dirtree.thumbnail_loader.shutdown()
+        self.batch_processor.scrubber.shutdown()
+        if self.batch_processor.queue_dialog is not None:
+            self.batch_processor.queue_dialog.queue.shutdown()
 
         super().closeEvent(event)
 
@@ -301,8 +599,13 @@ class ImageWidget(QWidget):
         self.size_label.setMinimumSize(1, 1)
         self.size_label.setSizePolicy(QSizePolicy.Minimum, QSizePolicy.Minimum)
 
+        # 原图显示在 label 中；一维曲线和二维倒易空间图显示在嵌入的绘图画布中，第一次作图时才创建
+        self.view_stack = QStackedWidget(self)
+        self.view_stack.addWidget(self.label)
+        self.plot_canvas = None
+
         self.layout = QVBoxLayout()
-        self.layout.addWidget(self.label)
+        self.layout.addWidget(self.view_stack)
         self.layout.addWidget(self.size_label)
         self.setLayout(self.layout)
 
@@ -316,6 +619,9 @@ class ImageWidget(QWidget):
         self.pixel_x = pixel_x
         self.pixel_y = pixel_y
         self.lamda = lamda
+        # 探测器倾斜角和倾斜方位角（度）
+        self.tilt = 0
+        self.rotation = 0
         self.threshold_min = threshold_min
         self.threshold_max = threshold_max
 
@@ -332,11 +638,6 @@ class ImageWidget(QWidget):
         self.image_offset = QPoint(0, 0)
 
 
-        #初始化定时器，提高改变窗口大小时调用Cut的流畅度
-        self.resize_timer = QTimer()
-        self.resize_timer.setSingleShot(True)
-        self.resize_timer.timeout.connect(self.on_resize_timeout)
-
         # 类变量，用于存储图像窗口的引用
         self.image_fig = None
 
@@ -345,6 +646,25 @@ class ImageWidget(QWidget):
 
         # 设置当前窗口状态
         self.windowstate = 0
+        # 最近一次的积分结果 (IntegrationResult)，以及对应的 (帧, 积分参数)
+        self.integration = None
+        self.integration_source = None
+        # 二维倒易空间图的网格缓存 (几何参数, Qr, Qz, 不显示的像素)
+        self.cut_grid = None
+
+        # 探测器校正（暗场、平场、坏点掩码），加载一次后逐帧复用
+        self.correction = DetectorCorrection()
+        # 最近读取的一帧
+        self.frame_cache = None
+        # 帧合并状态：像素合并倍数，以及合并后像素值相对单张原始帧的倍数
+        self.binning = 1
+        self.value_scale = 1
+        # 批量处理期间的分环节计时，其余时间不记录
+        self.stage_timer = StageTimer(enabled=False)
+        # 参数修改后的合并重绘
+        self.render_scheduler = RenderScheduler(self)
+        # 原图显示的持久缓冲区，重绘时原地写入
+        self.display_buffer = DisplayBuffer()
 
     def dragEnterEvent(self, event):
         if event.mimeData().hasUrls():
@@ -364,32 +684,17 @@ class ImageWidget(QWidget):
     def update_image(self):
         if self.file_name:
             # 读取图像并规范化
-            cb_min = float(self.textbox_min.text())
-            cb_max = float(self.textbox_max.text())
-            im = cv2.imread(self.file_name, cv2.IMREAD_ANYDEPTH)
-
-            mask = (im >= self.threshold_max) | (im < self.threshold_min)
-            img_norm = im.copy()
-            img_norm[img_norm > cb_max] = cb_max
-            img_norm[img_norm < cb_min] = cb_min
-            im_norm = cv2.normalize(img_norm, None, 0, 255, cv2.NORM_MINMAX, cv2.CV_8U)
-            im_norm[mask] = 0
-            if self.image_layout.flip.isChecked():
-                im_norm = cv2.flip(im_norm, 0)
+            im = self.read_image()
 
             # 缩放图像以适应窗口
-            height, width = im_norm.shape
             window_height, window_width = self.label.height(), self.label.width()
             if window_height <= 1 or window_width <= 1:
                 return
-            scale = min(window_height / height, window_width / width)
-            resized = cv2.resize(im_norm, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_NEAREST)
-            # 使用Jet颜色映射
-            color_map = cv2.applyColorMap(resized, cv2.COLORMAP_JET)
+            image = self.render_display(im, self.display_view(), self.display_buffer)
 
             # 显示图像
-            pixmap = self.to_qimage(color_map)
-            self.label.setPixmap(pixmap)
+            self.label.setPixmap(QPixmap.fromImage(image))
+            self.view_stack.setCurrentWidget(self.label)
             # pixmap_offset = self.image_offset - self.label.rect().topLeft()
             # self.label.setPixmap(pixmap)
             # self.label.move(pixmap_offset)
@@ -397,18 +702,99 @@ class ImageWidget(QWidget):
 
             self.windowstate = 1
 
+    def display_view(self):
+        # 当前原图显示参数的快照，后台线程用它渲染，不再访问界面控件
+        return (self.colorbar_range(), self.thresholds(), self.image_layout.flip.isChecked(),
+                (self.label.width(), self.label.height()))
+
+    def render_display(self, im, view, display):
+        # 按显示参数快照把原图渲染到 display（DisplayBuffer）：阈值外和坏点掩码置零，缩放到窗口大小
+        (cb_min, cb_max), thresholds, flip, window_size = view
+        return display.render(im, cb_min, cb_max, thresholds, self.correction.mask_for(im.shape), flip, window_size)
+
+    def show_rendered(self, file_name, shape, pixmap):
+        # 显示后台渲染好的原图
+        self.file_name = file_name
+        self.image_layout.file_name = file_name
+        self.label.setPixmap(pixmap)
+        self.view_stack.setCurrentWidget(self.label)
+        self.size_label.setText(f'pixels：{shape[1]} x {shape[0]} file_name: {os.path.basename(file_name)}')
+        self.windowstate = 1
+
     def to_qimage(self, img): #转化为Qpixmap
-        if len(img.shape) == 2:
+        # BGR 或灰度图像只做一次颜色转换
+        if len(img.shape) == 2 or img.shape[2] == 1:
             img = cv2.cvtColor(img, cv2.COLOR_GRAY2RGB)
-        elif len(img.shape) == 3 and img.shape[2] == 1:
-            img = cv2.cvtColor(img, cv2.COLOR_GRAY2RGB)
-
+        else:
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
         height, width, channels = img.shape
-        bytes_per_line = channels * width
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        qimage = QImage(img.data, width, height, bytes_per_line, QImage.Format_RGB888)
+        qimage = QImage(img.data, width, height, channels * width, QImage.Format_RGB888)
         return QPixmap.fromImage(qimage)
 
+    def read_image(self, file_name=None):
+        # 读取原始图像并应用探测器校正（暗场扣除、平场归一化、坏点置零）
+        # 最近一帧按 (文件, 修改时间, 校正版本) 缓存，批量处理时由预读线程提前填充
+        file_name = file_name or self.file_name
+        key = self._frame_key(file_name)
+        if self.frame_cache is not None and self.frame_cache[0] == key:
+            return self.frame_cache[1]
+        im = self.load_frame(file_name)
+        self.frame_cache = (key, im)
+        return im
+
+    def load_frame(self, file_name):
+        # 只读取和校正，不访问界面控件，可以在预读线程中调用
+        with self.stage_timer.stage('read'):
+            im = read_frame(file_name)
+        with self.stage_timer.stage('correct'):
+            return self.correction.apply(im)
+
+    def colorbar_range(self):
+        return float(self.textbox_min.text()) * self.value_scale, float(self.textbox_max.text()) * self.value_scale
+
+    def thresholds(self):
+        # 合并后的帧相当于 value_scale 张原始帧之和，阈值按同样比例换算
+        return float(self.threshold_min) * self.value_scale, float(self.threshold_max) * self.value_scale
+
+    @contextmanager
+    def reduced_frames(self, binning, value_scale):
+        # 批量处理期间帧经过合并：积分几何、阈值和 Colorbar 按合并方式换算，结束后恢复
+        self.binning, self.value_scale = binning, value_scale
+        try:
+            yield
+        finally:
+            self.binning, self.value_scale = 1, 1
+            self.frame_cache = None
+
+    @contextmanager
+    def tracked_center(self):
+        # 圆心漂移校正期间逐帧改写圆心，结束后恢复为界面参数中的圆心
+        x_center, y_center = self.x_Center, self.y_Center
+        try:
+            yield
+        finally:
+            self.x_Center, self.y_Center = x_center, y_center
+
+    @contextmanager
+    def timed_stages(self, timer):
+        # 批量处理期间把读取、积分、作图等环节的耗时记录到 timer
+        self.stage_timer = timer
+        try:
+            yield timer
+        finally:
+            self.stage_timer = StageTimer(enabled=False)
+
+    def store_frame(self, file_name, im):
+        self.frame_cache = (self._frame_key(file_name), im)
+
+    def _frame_key(self, file_name):
+        path, _ = split_frame_ref(file_name)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            mtime = None
+        return file_name, mtime, self.correction.version
+
     def Cut(self):
         #初始化参数
         if self.file_name:
@@ -419,17 +805,20 @@ class ImageWidget(QWidget):
             pixel_x = float(self.pixel_x)
             pixel_y = float(self.pixel_y)
             lamda = float(self.lamda)
+            if self.binning > 1:
+                # 像素合并后的帧：圆心和像素尺寸换算到合并后的像素
+                x_Center = (x_Center + 0.5) / self.binning - 0.5
+                y_Center = (y_Center + 0.5) / self.binning - 0.5
+                pixel_x *= self.binning
+                pixel_y *= self.binning
 
             # 读取图像并规范化
-            cb_min = float(self.textbox_min.text())
-            cb_max = float(self.textbox_max.text())
+            cb_min, cb_max = self.colorbar_range()
 
-            threshold_min = float(self.threshold_min)
-            threshold_max = float(self.threshold_max)
+            threshold_min, threshold_max = self.thresholds()
 
-            im = cv2.imread(self.file_name, cv2.IMREAD_ANYDEPTH)
-            img_norm = im.copy()
-            img_norm = img_norm.astype(float)
+            im = self.read_image()
+            img_norm = im.astype(WORK_DTYPE)
 
             # Create mask for regions above threshold_max and below threshold_min
             mask_max = np.zeros_like(img_norm, dtype=np.uint8)
@@ -439,6 +828,9 @@ class ImageWidget(QWidget):
             mask_min[img_norm < threshold_min] = 255
 
             mask = cv2.bitwise_or(mask_max, mask_min)
+            bad_pixels = self.correction.mask_for(im.shape)
+            if bad_pixels is not None:
+                mask[bad_pixels] = 255
             img_norm[mask == 255] = 0
 
             img_norm[img_norm > cb_max] = cb_max
@@ -448,114 +840,71 @@ class ImageWidget(QWidget):
 
             im_norm = cv2.flip(im_norm, 0)
 
-            # 读取文件
-            A = im_norm
-
-            # 参数设置
-            sz = np.shape(A)
-            sz_1 = sz[1]
-            sz_2 = sz[0]
-            y_Center = sz_2 - y_Center
-            Qr, Qz = np.meshgrid(np.arange(1, sz_1 + 1), np.arange(1, sz_2 + 1))
-
-            # pixel
-            Qr = Qr - x_Center
-            Qz = (sz_2 - y_Center) - Qz
-            # distance
-            Qr = Qr * pixel_x * 1e-6
-            Qz = Qz * pixel_y * 1e-6
-            # Theta
-            Qxx = Qr
-            Qr = np.arctan(Qr / (distance * 1e-3)) / 2
-            Qz = np.arctan(Qz / np.sqrt((distance * 1e-3) ** 2 + Qxx ** 2))
-            # Theta = np.arctan(np.sqrt(Qr ** 2 * Qz ** 2) / (distance * 1e-3))
-
-            Theta_f = Qr
-            Alpha_f = Qz
-            Alpha_i = Angle_incidence * np.pi / 180  # 入射角度
-
-            Qx = 2 * np.pi / lamda * (np.cos(2 * Theta_f) * np.cos(Alpha_f) - np.cos(Alpha_i))
-            Qy = 2 * np.pi / lamda * (np.sin(2 * Theta_f) * np.cos(Alpha_f))
-            Qz = 2 * np.pi / lamda * (np.sin(Alpha_f) + np.sin(Alpha_i))
-
-            # q 单位：Angstrom
-            Qr = np.sign(Qy) * np.sqrt(Qx ** 2 + Qy ** 2)
-            Qz = Qz
-            # Qr[Qy_temp < 0] = np.nan
-            diff_Qy = np.diff(np.sign(Qy), axis=1)
-            indices = np.where(diff_Qy != 0)
-
-            # 在 diff_Qy 中找到变号的区域，并将对应的 A 数组中的值设置为 NaN
-            A = A.astype(float)
-            A[indices[0], indices[1]] = np.nan
-            A[indices[0], indices[1] + 1] = np.where(Qy[indices[0], indices[1] + 1] > 0, np.nan,
-                                                     A[indices[0], indices[1] + 1])
-            A[indices[0], indices[1] - 1] = np.where((indices[1] > 0) & (Qy[indices[0], indices[1] - 1] < 0), np.nan,
-                                                     A[indices[0], indices[1] - 1])
-
-            # 创建掩码数组
-            A_masked = np.ma.masked_where(np.isnan(A), A)
+            # 设置横纵坐标显示范围，-121 表示自动
+            limits = tuple(None if float(box.text()) == -121 else float(box.text())
+                           for box in (self.parameter.Qr_min, self.parameter.Qr_max, self.parameter.Qz_min,
+                                       self.parameter.Qz_max))
+            flip = self.image_layout.flip.isChecked()
+            # 倒易空间网格和 Qy 变号处的掩码只与几何和帧尺寸有关，不变时直接复用，画布上也只更新颜色数据
+            key = (im_norm.shape, x_Center, y_Center, distance, pixel_x, pixel_y, lamda, self.tilt, self.rotation,
+                   Angle_incidence, flip, limits)
+            if self.cut_grid is None or self.cut_grid[0] != key:
+                A = im_norm
+                # 参数设置
+                sz = np.shape(A)
+                sz_1 = sz[1]
+                sz_2 = sz[0]
+                y_Center = sz_2 - y_Center
+                Qr, Qz = np.meshgrid(np.arange(1, sz_1 + 1, dtype=WORK_DTYPE),
+                                     np.arange(1, sz_2 + 1, dtype=WORK_DTYPE))
+
+                # pixel
+                Qr = Qr - x_Center
+                Qz = (sz_2 - y_Center) - Qz
+                if self.tilt:
+                    # 倾斜探测器：像素换算到实验室坐标后再求出射角，Qz 方向与图像行号相反
+                    geometry = DetectorGeometry(0, 0, distance, pixel_x, pixel_y, lamda, self.tilt, self.rotation)
+                    Qxx, Qyy, Qzz = geometry.lab_positions(Qr, -Qz)
+                    Qr = np.arctan2(Qxx, Qzz) / 2
+                    Qz = np.arctan2(-Qyy, np.hypot(Qxx, Qzz))
+                else:
+                    # distance
+                    Qr = Qr * pixel_x * 1e-6
+                    Qz = Qz * pixel_y * 1e-6
+                    # Theta
+                    Qxx = Qr
+                    Qr = np.arctan(Qr / (distance * 1e-3)) / 2
+                    Qz = np.arctan(Qz / np.sqrt((distance * 1e-3) ** 2 + Qxx ** 2))
+                # Theta = np.arctan(np.sqrt(Qr ** 2 * Qz ** 2) / (distance * 1e-3))
+
+                Theta_f = Qr
+                Alpha_f = Qz
+                Alpha_i = Angle_incidence * np.pi / 180  # 入射角度
+
+                Qx = 2 * np.pi / lamda * (np.cos(2 * Theta_f) * np.cos(Alpha_f) - math.cos(Alpha_i))
+                Qy = 2 * np.pi / lamda * (np.sin(2 * Theta_f) * np.cos(Alpha_f))
+                Qz = 2 * np.pi / lamda * (np.sin(Alpha_f) + math.sin(Alpha_i))
+
+                # q 单位：Angstrom
+                Qr = np.sign(Qy) * np.sqrt(Qx ** 2 + Qy ** 2)
+                Qz = Qz
+                # Qr[Qy_temp < 0] = np.nan
+                diff_Qy = np.diff(np.sign(Qy), axis=1)
+                indices = np.where(diff_Qy != 0)
+
+                # 在 diff_Qy 中找到变号的区域，对应的像素不显示
+                seam = np.zeros(A.shape, dtype=bool)
+                seam[indices[0], indices[1]] = True
+                seam[indices[0], indices[1] + 1] |= Qy[indices[0], indices[1] + 1] > 0
+                seam[indices[0], indices[1] - 1] |= (indices[1] > 0) & (Qy[indices[0], indices[1] - 1] < 0)
+                self.cut_grid = (key, Qr, Qz, seam)
+            _, Qr, Qz, seam = self.cut_grid
 
             # 绘制pcolor图像
-
-
-            self.fig, ax = plt.subplots()
-            pcolor = ax.pcolormesh(Qr, Qz, A_masked, cmap='jet', shading='auto')
-            self.fig.colorbar(pcolor)
-            ax.set_xlabel('Qr')
-            ax.set_ylabel('Qz')
-            ax.set_aspect('equal')
-            if not self.image_layout.flip.isChecked():
-                plt.gca().invert_yaxis()
-            # 设置横纵坐标显示范围
-            if float(self.parameter.Qr_min.text()) == -121:
-                Qr_min = None
-            else:
-                Qr_min = float(self.parameter.Qr_min.text())
-
-            if float(self.parameter.Qr_max.text()) == -121:
-                Qr_max = None
-            else:
-                Qr_max = float(self.parameter.Qr_max.text())
-
-            if float(self.parameter.Qz_min.text()) == -121:
-                Qz_min = None
-            else:
-                Qz_min = float(self.parameter.Qz_min.text())
-
-            if float(self.parameter.Qz_max.text()) == -121:
-                Qz_max = None
-            else:
-                Qz_max = float(self.parameter.Qz_max.text())
-
-            ax.set_xlim(Qr_min, Qr_max)
-            ax.set_ylim(Qz_min, Qz_max)
-
-            # 保存图像为临时文件
-            temp_file = tempfile.NamedTemporaryFile(suffix=".png", delete=False)
-            self.fig.savefig(temp_file.name, dpi=300)
-            plt.close(self.fig)  # 关闭绘图窗口
-
-            # 读取临时文件
-            color_values = cv2.imread(temp_file.name, cv2.IMREAD_COLOR)
-
-            # 缩放图像以适应窗口
-            height, width = color_values.shape[:2]
-            window_height, window_width = self.label.height(), self.label.width()
-            if window_height <= 1 or window_width <= 1:
-                return
-            scale = min(window_height / height, window_width / width)
-            resized = cv2.resize(color_values, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_NEAREST)
-
-            # 显示图像
-            pixmap = self.to_qimage(resized)
-            self.label.setPixmap(pixmap)
+            self.plot_view().plot_map(key, Qr, Qz, np.ma.masked_array(im_norm.astype(WORK_DTYPE), mask=seam), flip,
+                                      limits)
             self.size_label.setText(f'pixels：{im.shape[1]} x {im.shape[0]} file_name: {os.path.basename(self.file_name)}')
 
-            # 删除临时文件
-            temp_file.close()
-            os.unlink(temp_file.name)
-
             self.windowstate = 2
 
     def update_parameters(self, parameter):
@@ -567,19 +916,30 @@ class ImageWidget(QWidget):
         self.pixel_x = parameter.pixel_x_value
         self.pixel_y = parameter.pixel_y_value
         self.lamda = parameter.lamda_value
+        self.tilt = parameter.tilt_value
+        self.rotation = parameter.rotation_value
         self.threshold_min = parameter.threshold_min_value
         self.threshold_max = parameter.threshold_max_value
         self.numbin = parameter.numbin_value
 
     def on_resize(self, event):
-        if self.image_layout.rb1.isChecked():
+        # 绘图画布自行按新尺寸重绘，只有原图需要重新缩放
+        if self.image_layout.rb1.isChecked() and self.windowstate != 3:
             self.update_image()
-        if self.image_layout.rb2.isChecked():
-            self.resize_timer.start(300)  # 设置等待时间，单位为毫秒
         event.accept()
 
-    def on_resize_timeout(self):
-        self.Cut()
+    def plot_view(self):
+        # 切换到嵌入的绘图画布
+        if self.plot_canvas is None:
+            self.plot_canvas = PlotCanvas()
+            self.view_stack.addWidget(self.plot_canvas)
+        self.view_stack.setCurrentWidget(self.plot_canvas)
+        self.fig = self.plot_canvas.figure
+        return self.plot_canvas
+
+    def save_figure(self, file_path):
+        # 导出当前的一维曲线或二维倒易空间图
+        self.plot_canvas.export(file_path)
     # def wheelEvent(self, event):
     #     # 获取当前的鼠标位置
     #     mouse_pos = event.pos()
@@ -640,7 +1000,7 @@ class ImageWidget(QWidget):
     def int_region(self, cb_min, cb_max, x_center, y_center):
 
         # 读取图像并规范化
-        im = cv2.imread(self.file_name, cv2.IMREAD_ANYDEPTH)
+        im = self.read_image()
         img_norm = im.copy()
         img_norm[img_norm > cb_max] = cb_max
         img_norm[img_norm < cb_min] = cb_min
@@ -672,7 +1032,7 @@ class ImageWidget(QWidget):
 
             if i == 0 or i == 1:
                 # 绘制直线
-                axx.add_line(Line2D([x, x_center], [y, y_center], color='red'))
+                axx.add_line(mlines.Line2D([x, x_center], [y, y_center], color='red'))
                 plt.draw()  # 强制刷新图像
             else:
                 # 计算起始和终止角度
@@ -682,7 +1042,7 @@ class ImageWidget(QWidget):
                     # 计算内半径和外半径
                     inner_radius = np.sqrt((points[2][0] - x_center) ** 2 + (points[2][1] - y_center) ** 2)
                     # 绘制扇形区域
-                    wedge = Wedge((x_center, y_center), inner_radius, math.degrees(start_angle),
+                    wedge = mpatches.Wedge((x_center, y_center), inner_radius, math.degrees(start_angle),
                                   math.degrees(end_angle),
                                   width=2)
                     axx.add_patch(wedge)
@@ -690,7 +1050,7 @@ class ImageWidget(QWidget):
                 if i == 3:
                     outer_radius = np.sqrt((points[3][0] - x_center) ** 2 + (points[3][1] - y_center) ** 2)
                     # 绘制扇形区域
-                    wedge = Wedge((x_center, y_center), outer_radius, math.degrees(start_angle),
+                    wedge = mpatches.Wedge((x_center, y_center), outer_radius, math.degrees(start_angle),
                                   math.degrees(end_angle),
                                   width=outer_radius-inner_radius)
                     wedge.set_alpha(0.5)
@@ -707,6 +1067,26 @@ class ImageWidget(QWidget):
         # ret = msg_box.exec_()
         return im_norm, start_angle, end_angle, inner_radius, outer_radius
 
+    def draw_mask_region(self, cb_min, cb_max):
+        # 在原始方向的图像上依次点击多边形顶点，回车或右键结束，返回多边形内部的布尔掩码
+        im = self.read_image()
+        img_norm = im.copy()
+        img_norm[img_norm > cb_max] = cb_max
+        img_norm[img_norm < cb_min] = cb_min
+        im_norm = cv2.normalize(img_norm, None, 0, 255, cv2.NORM_MINMAX, cv2.CV_8U)
+
+        fig, ax = plt.subplots()
+        ax.imshow(im_norm, cmap='jet')
+        ax.set_title('左键添加顶点，右键或回车结束')
+        points = plt.ginput(-1, timeout=0)
+        plt.close(fig)
+
+        region = np.zeros(im.shape[:2], dtype=np.uint8)
+        if len(points) >= 3:
+            polygon = np.round(np.array(points)).astype(np.int32)
+            cv2.fillPoly(region, [polygon], 1)
+        return region.astype(bool)
+
     # 将笛卡尔坐标系下的图像转换为极坐标系下的图像
     def cart2pol(self, image, center):
         # 计算图像中每个像素点的极坐标值
@@ -721,7 +1101,7 @@ class ImageWidget(QWidget):
         return polar_image
 
     # 点击积分按钮调用此函数
-    def radial_integral(self, image, center, start_angle, end_angle, inner_radius, outer_radius, num_bins):
+    def radial_integral(self, image, center, start_angle, end_angle, inner_radius, outer_radius, num_bins, raw=None):
         """
         计算选定的扇形区域的径向积分和角向积分
         :param image: 待处理的图像
@@ -731,239 +1111,101 @@ class ImageWidget(QWidget):
         :param inner_radius: 扇形区域的内径
         :param outer_radius: 扇形区域的外径
         :param num_bins: 径向积分的点数
+        :param raw: 用于 Mask_min/Mask_max 判断的原始图像（已翻转），为 None 时重新读取
         :return: (radial_profile, angular_profile)，径向积分和角向积分
         """
 
-        num_bins = int(num_bins)
-        # 将角度转换为弧度
-        start_angle = math.radians(start_angle)
-        end_angle = math.radians(end_angle)
-
-        # 构造一个极坐标网格
-        height, width = image.shape[:2]
-        y, x = np.ogrid[:height, :width]
-        x = x.astype(np.float64) - float(center[0])
-        y = y.astype(np.float64) - float(center[1])
-        r = np.hypot(x, y)
-        theta = np.arctan2(y, x)
-
+        if raw is None:
+            raw = cv2.flip(self.read_image(), 0)
 
-        #
-        im = cv2.imread(self.file_name, cv2.IMREAD_ANYDEPTH)
-        im = cv2.flip(im, 0)
-        # 确定扇形区域的布尔掩码
-        mask = (r >= inner_radius) & (r <= outer_radius) & (theta >= start_angle) & (theta <= end_angle)
+        # center、inner_radius、outer_radius 均为当前帧（可能经过像素合并）的像素单位
+        geometry = DetectorGeometry(center[0], center[1], self.distance, self.pixel_x, self.pixel_y, self.lamda,
+                                    self.tilt, self.rotation)
+        with self.stage_timer.stage('integrate'):
+            self.integration = integrate_sector(
+                image, raw, geometry, start_angle, end_angle, inner_radius, outer_radius, num_bins,
+                self.thresholds(), self.correction, self.parameter.intensity_correction(), self.binning)
+        return self.plot_profile()
 
-        if start_angle >= end_angle:
-            mask = (r >= inner_radius) & (r <= outer_radius) & ((theta >= start_angle) | (theta <= end_angle))
-            end_angle = end_angle + 2 * np.pi
-        mask = mask & (im >= self.threshold_min)
-        mask = mask & (im <= self.threshold_max)
-        # print(im)
-
-        # plt.imshow(mask.astype(np.float64), cmap='gray')
-        # plt.show()
-        # 计算径向积分
-        rbin_edges = np.linspace(inner_radius, outer_radius, num_bins + 1)
-        rbin_centers = 0.5 * (rbin_edges[1:] + rbin_edges[:-1])
-        radial_profile, _ = np.histogram(r[mask], bins=rbin_edges, weights=image[mask].astype(np.float64))
-        radial_profile = radial_profile.astype(np.float64) / np.diff(rbin_edges)
-
-        # 计算角向积分
-        thetabin_edges = np.linspace(start_angle, end_angle, num_bins + 1)
-        thetabin_centers_radians = 0.5 * (thetabin_edges[1:] + thetabin_edges[:-1])
-        thetabin_centers_degrees = np.degrees(thetabin_centers_radians)
-        angular_profile, _ = np.histogram(theta[mask], bins=thetabin_edges, weights=image[mask].astype(np.float64))
-        angular_profile = angular_profile.astype(np.float64) / np.diff(thetabin_edges)
-
-        # 定义滑动窗口的大小
-        window_size = 5
-        # 定义滑动窗口的权重
-        window = np.ones(window_size) / window_size
-        # 对angular_profile进行滑动平均
-        smoothed_angular_profile = np.convolve(angular_profile, window, mode='same')
-        smoothed_radial_profile = np.convolve(radial_profile, window, mode='same')
-
-        # 绘制图像
-        self.fig, ax = plt.subplots()
+    def plot_profile(self):
+        """
+        按当前的横坐标、平滑方式和纵坐标绘制最近一次的积分结果，平滑只作用于选中的这一条曲线
+        :return: (x, y)，与 calculate_integral 的返回值相同
+        """
+        result = self.integration
         index = self.image_layout.comboBox.currentIndex()
-        distance = float(self.distance) * 1e-3
-        pixel_x = float(self.pixel_x) * 1e-6
-        pixel_y = float(self.pixel_y) * 1e-6
-        lamda = float(self.lamda)
-
-        pixel = (pixel_x + pixel_y)/2
-        theta = np.arctan(rbin_centers * pixel / distance) / 2
-        q = 4 * np.pi * np.sin(theta) / lamda
-        twoTheta = np.arcsin(q * 1.54 / 4 / np.pi) * 180 / np.pi * 2
-
-        if self.image_layout.comboBox2.currentIndex() == 0:
-            if self.image_layout.radioButtonRadial.isChecked():
-                if index == 0 :
-                    ax.semilogy(q, smoothed_radial_profile)
-                    ax.set_xlabel('q')
-                    ax.set_ylabel('Intensity (Log Scale)')
-                    ax.set_title('Radial Profile')
-                    # return q, smoothed_radial_profile
-                if index == 1:
-                    ax.semilogy(twoTheta, smoothed_radial_profile)
-                    ax.set_xlabel('2Theta')
-                    ax.set_ylabel('Intensity (Log Scale)')
-                    ax.set_title('Radial Profile')
-                    # return twoTheta, smoothed_radial_profile
-                if index == 2:
-                    ax.semilogy(rbin_centers, smoothed_radial_profile)
-                    ax.set_xlabel('Pixel')
-                    ax.set_ylabel('Intensity (Log Scale)')
-                    ax.set_title('Radial Profile')
-                    # return rbin_centers, smoothed_radial_profile
-                if index == 3:
-                    ax.semilogy(q, radial_profile)
-                    ax.set_xlabel('q')
-                    ax.set_ylabel('Intensity (Log Scale)')
-                    ax.set_title('Radial Profile')
-                    # return q, radial_profile
-                if index == 4:
-                    ax.semilogy(twoTheta, radial_profile)
-                    ax.set_xlabel('2Theta')
-                    ax.set_ylabel('Intensity (Log Scale)')
-                    ax.set_title('Radial Profile')
-                    # return twoTheta, radial_profile
-                if index == 5:
-                    ax.semilogy(rbin_centers, radial_profile)
-                    ax.set_xlabel('Pixel')
-                    ax.set_ylabel('Intensity (Log Scale)')
-                    ax.set_title('Radial Profile')
-                    # return rbin_centers, radial_profile
-            if self.image_layout.radioButtonAngular.isChecked():
-                if index == 0:
-                    ax.semilogy(thetabin_centers_degrees, smoothed_angular_profile)
-                    ax.set_xlabel('Theta')
-                    ax.set_ylabel('Intensity (Log Scale)')
-                    ax.set_title('Azimuth Profile')
-                    # return thetabin_centers_degrees, smoothed_angular_profile
-        if self.image_layout.comboBox2.currentIndex() == 1:
-            if self.image_layout.radioButtonRadial.isChecked():
-                if index == 0 :
-                    ax.plot(q, smoothed_radial_profile)
-                    ax.set_xlabel('q')
-                    ax.set_ylabel('Intensity')
-                    ax.set_title('Radial Profile')
-                    # return q, smoothed_radial_profile
-                if index == 1:
-                    ax.plot(twoTheta, smoothed_radial_profile)
-                    ax.set_xlabel('2Theta')
-                    ax.set_ylabel('Intensity')
-                    ax.set_title('Radial Profile')
-                    # return twoTheta, smoothed_radial_profile
-                if index == 2:
-                    ax.plot(rbin_centers, smoothed_radial_profile)
-                    ax.set_xlabel('Pixel')
-                    ax.set_ylabel('Intensity')
-                    ax.set_title('Radial Profile')
-                    # return rbin_centers, smoothed_radial_profile
-                if index == 3:
-                    ax.plot(q, radial_profile)
-                    ax.set_xlabel('q')
-                    ax.set_ylabel('Intensity')
-                    ax.set_title('Radial Profile')
-                    # return q, radial_profile
-                if index == 4:
-                    ax.plot(twoTheta, radial_profile)
-                    ax.set_xlabel('2Theta')
-                    ax.set_ylabel('Intensity')
-                    ax.set_title('Radial Profile')
-                    # return twoTheta, radial_profile
-                if index == 5:
-                    ax.plot(rbin_centers, radial_profile)
-                    ax.set_xlabel('Pixel')
-                    ax.set_ylabel('Intensity')
-                    ax.set_title('Radial Profile')
-                    # return rbin_centers, radial_profile
-            if self.image_layout.radioButtonAngular.isChecked():
-                if index == 0:
-                    ax.plot(thetabin_centers_degrees, smoothed_angular_profile)
-                    ax.set_xlabel('Theta')
-                    ax.set_ylabel('Intensity')
-                    ax.set_title('Azimuth Profile')
-                    # return thetabin_centers_degrees, smoothed_angular_profile
-
-        # 保存图像为临时文件
-        temp_file = tempfile.NamedTemporaryFile(suffix=".png", delete=False)
-        self.fig.savefig(temp_file.name, dpi=300)
-        plt.close(self.fig)  # 关闭绘图窗口
-
-        # 读取临时文件
-        color_values = cv2.imread(temp_file.name, cv2.IMREAD_COLOR)
-
-        # 缩放图像以适应窗口
-        height, width = color_values.shape[:2]
-        window_height, window_width = self.label.height(), self.label.width()
-        if window_height <= 1 or window_width <= 1:
-            return
-        scale = min(window_height / height, window_width / width)
-        resized = cv2.resize(color_values, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_NEAREST)
-
-        # 显示图像
-        pixmap = self.to_qimage(resized)
-        self.label.setPixmap(pixmap)
+        radial = self.image_layout.radioButtonRadial.isChecked()
+        result.set_reference_wavelength(self.image_layout.reference_wavelength())
+        x, y = result.select(index, radial)
+        if smoothed_option(index, radial):
+            with self.stage_timer.stage('smooth'):
+                y = self.image_layout.smoother()(y)
+
+        # 绘制图像：在嵌入的画布上原地更新曲线
+        log = self.image_layout.comboBox2.currentIndex() == 0
+        if radial:
+            axis = PROFILE_AXES[index][1]
+            xlabel = {'q': 'q', 'pixel': 'Pixel', 'd': 'd (A)'}.get(axis) \
+                or f'2Theta (lambda = {result.reference_wavelength:g} A)'
+        else:
+            xlabel = 'Theta'
+        self.plot_view().plot_profile(x, y, log, xlabel, 'Intensity (Log Scale)' if log else 'Intensity',
+                                      'Radial Profile' if radial else 'Azimuth Profile')
         self.size_label.setText(f'一维图片——file_name: {os.path.basename(self.file_name)}')
 
-        # 删除临时文件
-        temp_file.close()
-        os.unlink(temp_file.name)
-
         self.windowstate = 3
 
-        if self.image_layout.comboBox2.currentIndex() == 0:
-            if self.image_layout.radioButtonRadial.isChecked():
-                if index == 0 :
-                    return q, smoothed_radial_profile
-                if index == 1:
-                    return twoTheta, smoothed_radial_profile
-                if index == 2:
-                    return rbin_centers, smoothed_radial_profile
-                if index == 3:
-                    return q, radial_profile
-                if index == 4:
-                    return twoTheta, radial_profile
-                if index == 5:
-                    return rbin_centers, radial_profile
-            if self.image_layout.radioButtonAngular.isChecked():
-                if index == 0:
-                    return thetabin_centers_degrees, smoothed_angular_profile
-        if self.image_layout.comboBox2.currentIndex() == 1:
-            if self.image_layout.radioButtonRadial.isChecked():
-                if index == 0 :
-                    return q, smoothed_radial_profile
-                if index == 1:
-                    return twoTheta, smoothed_radial_profile
-                if index == 2:
-                    return rbin_centers, smoothed_radial_profile
-                if index == 3:
-                    return q, radial_profile
-                if index == 4:
-                    return twoTheta, radial_profile
-                if index == 5:
-                    return rbin_centers, radial_profile
-            if self.image_layout.radioButtonAngular.isChecked():
-                if index == 0:
-                    return thetabin_centers_degrees, smoothed_angular_profile
+        return x, y
+
+    def raw_profile(self):
+        # 最近一次积分按当前横坐标选项的未平滑结果 (x, y, 计数统计误差)，批量处理收集后对整个堆栈一次平滑
+        index = self.image_layout.comboBox.currentIndex()
+        radial = self.image_layout.radioButtonRadial.isChecked()
+        x, y = self.integration.select(index, radial)
+        return x, y, self.integration.errors(radial)
+
+    def smooth_profiles(self, profiles):
+        # 按当前横坐标选项平滑单条曲线或 (帧数, 点数) 的曲线堆栈，unsmoothed 选项原样返回
+        if smoothed_option(self.image_layout.comboBox.currentIndex(), self.image_layout.radioButtonRadial.isChecked()):
+            return self.image_layout.smoother()(profiles)
+        return profiles
+
+    def profile_errors(self):
+        # 当前曲线的计数统计误差，曲线经过平滑时误差用同样的方式平滑，避免空 bin 处误差为 0
+        return self.smooth_profiles(self.raw_profile()[2])
+
+    def replot_profile(self):
+        # 横坐标、平滑方式或纵坐标改变时，若当前显示的是一维曲线则用已有的积分结果重新作图，不再读图和积分
+        if self.windowstate == 3 and self.integration is not None and self.image_layout.comboBox.currentIndex() >= 0:
+            self.plot_profile()
+
+    def integration_key(self, center, start_angle, end_angle, inner_radius, outer_radius, num_bins):
+        # 决定积分结果的全部参数，与帧本身一起判断能否直接复用上一次的积分
+        return (tuple(center), start_angle, end_angle, inner_radius, outer_radius, int(num_bins), self.thresholds(),
+                self.colorbar_range(), self.distance, self.pixel_x, self.pixel_y, self.lamda, self.tilt,
+                self.rotation, self.correction.version, self.parameter.intensity_correction().key(), self.binning)
+
+    def pipeline_settings(self):
+        # 读取当前界面参数，生成可在后台线程中使用的积分参数快照
+        return PipelineSettings(
+            DetectorGeometry(self.x_Center, self.y_Center, self.distance, self.pixel_x, self.pixel_y, self.lamda,
+                             self.tilt, self.rotation),
+            float(self.image_layout.textbox_startAngle.text()), float(self.image_layout.textbox_endAngle.text()),
+            float(self.image_layout.textbox_innerRadius.text()), float(self.image_layout.textbox_outerRadius.text()),
+            self.numbin, self.threshold_min, self.threshold_max,
+            float(self.textbox_min.text()), float(self.textbox_max.text()),
+            radial=self.image_layout.radioButtonRadial.isChecked(),
+            axis_index=self.image_layout.comboBox.currentIndex(),
+            correction=self.correction, intensity_correction=self.parameter.intensity_correction(),
+            smoother=self.image_layout.smoother(), reference_wavelength=self.image_layout.reference_wavelength())
 
     # 点击积分按钮调用此函数
     def calculate_integral(self):
         try:
             if self.file_name:
-                cb_min = float(self.textbox_min.text())
-                cb_max = float(self.textbox_max.text())
+                cb_min, cb_max = self.colorbar_range()
                 # 获取image
-                im = cv2.imread(self.file_name, cv2.IMREAD_ANYDEPTH)
-                img_norm = im.copy()
-                img_norm[img_norm > cb_max] = cb_max
-                img_norm[img_norm < cb_min] = cb_min
-                # im_norm = cv2.normalize(img_norm, None, 0, 255, cv2.NORM_MINMAX, cv2.CV_8U)
-                image = cv2.flip(img_norm, 0)
-
+                im = self.read_image()
                 # 获取所有参数值
                 center = [float(self.x_Center), float(self.y_Center)]
                 start_angle = float(self.image_layout.textbox_startAngle.text())
@@ -971,9 +1213,31 @@ class ImageWidget(QWidget):
                 inner_radius = float(self.image_layout.textbox_innerRadius.text())
                 outer_radius = float(self.image_layout.textbox_outerRadius.text())
                 num_bins = self.numbin
-                # 调用 radial_integral() 函数计算径向积分和角向积分
-                x, y = self.radial_integral(image, center, start_angle, end_angle, inner_radius,
-                                                                  outer_radius, num_bins)
+                # 同一帧、同样参数的积分结果直接复用，只重新作图
+                key = self.integration_key(center, start_angle, end_angle, inner_radius, outer_radius, num_bins)
+                if self.integration_source is not None and self.integration_source[0] is im \
+                        and self.integration_source[1] == key:
+                    with self.stage_timer.stage('plot_1d'):
+                        return self.plot_profile()
+                with self.stage_timer.stage('prepare'):
+                    img_norm = im.copy()
+                    img_norm[img_norm > cb_max] = cb_max
+                    img_norm[img_norm < cb_min] = cb_min
+                    # im_norm = cv2.normalize(img_norm, None, 0, 255, cv2.NORM_MINMAX, cv2.CV_8U)
+                    image = cv2.flip(img_norm, 0)
+                    raw = cv2.flip(im, 0)
+
+                if self.binning > 1:
+                    # 像素合并后的帧：圆心和积分半径换算到合并后的像素
+                    center = [(c + 0.5) / self.binning - 0.5 for c in center]
+                    inner_radius /= self.binning
+                    outer_radius /= self.binning
+                # 调用 radial_integral() 函数计算径向积分和角向积分；积分本身单独计时，其余为作图和显示
+                with self.stage_timer.stage('plot_1d'):
+                    self.integration_source = None
+                    x, y = self.radial_integral(image, center, start_angle, end_angle, inner_radius,
+                                                outer_radius, num_bins, raw)
+                    self.integration_source = (im, key)
                 # mask = (x >= float(self.batch_processor.background_min.text())) & (x <= float(self.batch_processor.background_max.text()))
                 # x_selected = x[mask]
                 # y_selected = y[mask]
@@ -1049,14 +1313,30 @@ class ImageLayout(QWidget):
         self.textbox_outerRadius.setFixedWidth(100)
         self.textbox_outerRadius.setFixedHeight(20)
         self.textbox_outerRadius.setPlaceholderText('outer radius')
-        self.export_1D = QPushButton("积分结果导出-txt", self)
+        self.export_1D = QPushButton("积分结果导出", self)
+        # 单帧导出和批量处理的额外导出格式
+        self.export_format = QComboBox()
+        self.export_format.addItems(ProfileExporter.LABELS)
+        export_format = settings.value('export_format', 'txt')
+        if export_format in ProfileExporter.FORMATS:
+            self.export_format.setCurrentIndex(ProfileExporter.FORMATS.index(export_format))
 
         # 创建下拉菜单和按钮
         self.comboBox = QComboBox()
-        self.comboBox.addItems(['q', '2theta', '像素', 'q(unsmoothed)', '2theta(unsmoothed)', '像素(unsmoothed)'])
+        self.comboBox.addItems([label for label, _, _ in PROFILE_AXES])
         self.comboBox2 = QComboBox()
         self.comboBox2.addItems(['Log', 'Linear'])
         self.comboBox2.setCurrentIndex(1) #默认Linear
+        # 平滑方式和窗口宽度（点数），只作用于非 unsmoothed 的横坐标选项
+        self.smooth_method = QComboBox()
+        self.smooth_method.addItems(ProfileSmoother.LABELS)
+        self.smooth_method.setCurrentIndex(ProfileSmoother.METHODS.index('boxcar'))
+        self.smooth_width = QLineEdit('5')
+        self.smooth_width.setFixedWidth(40)
+        self.smooth_width.setToolTip('窗口宽度（点数），高斯平滑为半高宽')
+        # 2theta 横坐标的参考波长（埃），与实验波长无关，便于和实验室铜靶数据对比
+        self.textbox_reference_wavelength = QLineEdit(settings.value('reference_wavelength', str(REFERENCE_WAVELENGTH)))
+        self.textbox_reference_wavelength.setFixedWidth(100)
         self.radioButtonRadial = QRadioButton('径向积分')
         self.radioButtonAngular = QRadioButton('角向积分')
         self.radioButtonRadial.setChecked(True)  # 默认选中径向积分
@@ -1090,27 +1370,35 @@ class ImageLayout(QWidget):
         self.image_widget.pixel_x=parameter.pixel_x_value
         self.image_widget.pixel_y=parameter.pixel_y_value
         self.image_widget.lamda=parameter.lamda_value
+        self.image_widget.tilt = parameter.tilt_value
+        self.image_widget.rotation = parameter.rotation_value
         self.image_widget.threshold_min = parameter.threshold_min_value
         self.image_widget.threshold_max = parameter.threshold_max_value
         self.image_widget.numbin = parameter.numbin_value
 
 
         # 连接colorbar
-        self.textbox_min.editingFinished.connect(self.update_image_finished)
-        self.textbox_max.editingFinished.connect(self.update_image_finished)
+        # 一维积分前的图像按 Colorbar 范围截断，因此 Colorbar 同时影响积分
+        scheduler = self.image_widget.render_scheduler
+        scheduler.watch(self.textbox_min, RenderScheduler.COLORMAP | RenderScheduler.INTEGRATION)
+        scheduler.watch(self.textbox_max, RenderScheduler.COLORMAP | RenderScheduler.INTEGRATION)
         self.button_output.clicked.connect(self.export_image)
         self.button_outputdir.clicked.connect(self.select_outputdir)
         self.textbox_outputdir.editingFinished.connect(self.update_output_folder)
         self.button_intRegion.clicked.connect(self.on_intRegion_button_clicked)
-        self.textbox_startAngle.editingFinished.connect(self.update_rigionValues)
-        self.textbox_endAngle.editingFinished.connect(self.update_rigionValues)
-        self.textbox_innerRadius.editingFinished.connect(self.update_rigionValues)
-        self.textbox_outerRadius.editingFinished.connect(self.update_rigionValues)
+        for textbox in (self.textbox_startAngle, self.textbox_endAngle, self.textbox_innerRadius,
+                        self.textbox_outerRadius):
+            scheduler.watch(textbox, RenderScheduler.INTEGRATION, self.update_rigionValues)
         self.button_integer.clicked.connect(self.image_widget.calculate_integral)
         self.radioButtonRadial.toggled.connect(self.on_radio_button_toggled)
         self.radioButtonAngular.toggled.connect(self.on_radio_button_toggled)
         self.export_1D.clicked.connect(self.export_integral_data)
-        self.flip.toggled.connect(self.update_image_finished)
+        # 以下只影响一维曲线的显示：直接用已有的积分结果重新作图
+        for combo in (self.comboBox, self.comboBox2, self.smooth_method):
+            combo.currentIndexChanged.connect(self.image_widget.replot_profile)
+        for textbox in (self.smooth_width, self.textbox_reference_wavelength):
+            textbox.editingFinished.connect(self.image_widget.replot_profile)
+        scheduler.watch(self.flip, RenderScheduler.COLORMAP)
 
         self.image_widget.setStyleSheet("border: 2px solid #808080; border-radius: 5px;")
         # 创建布局
@@ -1145,24 +1433,49 @@ class ImageLayout(QWidget):
         layout.addWidget(self.export_1D, 3, 1)
         layout.addWidget(self.button_outputdir, 11, 0)
         layout.addWidget(self.textbox_outputdir, 11, 1, 1, 2)
+        smooth_layout = QHBoxLayout()
+        smooth_layout.addWidget(self.smooth_method)
+        smooth_layout.addWidget(self.smooth_width)
+        layout.addWidget(QLabel('平滑:'), 12, 0)
+        layout.addLayout(smooth_layout, 12, 1)
+        layout.addWidget(QLabel('2theta 参考波长(A):'), 13, 0)
+        layout.addWidget(self.textbox_reference_wavelength, 13, 1)
+        layout.addWidget(QLabel('导出格式:'), 14, 0)
+        layout.addWidget(self.export_format, 14, 1)
 
         # 设置原位数据处理窗台码
         self.insitustate = 0
 
+    def reference_wavelength(self):
+        # 无法解析或不为正时取铜靶 1.54 埃
+        try:
+            wavelength = float(self.textbox_reference_wavelength.text())
+        except ValueError:
+            return REFERENCE_WAVELENGTH
+        return wavelength if wavelength > 0 else REFERENCE_WAVELENGTH
+
+    def profile_exporter(self):
+        # 按当前导出格式、横坐标和参考波长导出
+        return ProfileExporter(ProfileExporter.FORMATS[self.export_format.currentIndex()],
+                               profile_axis(self.comboBox.currentIndex(), self.radioButtonRadial.isChecked()),
+                               self.reference_wavelength())
+
+    def smoother(self):
+        # 宽度无法解析时取默认的 5 点
+        try:
+            width = float(self.smooth_width.text())
+        except ValueError:
+            width = 5
+        return ProfileSmoother(ProfileSmoother.METHODS[self.smooth_method.currentIndex()], width)
+
     def on_radio_button_toggled(self):
         if self.radioButtonRadial.isChecked():
             self.comboBox.clear()
-            self.comboBox.addItems(['q', '2theta', '像素', 'q(unsmoothed)', '2theta(unsmoothed)', '像素(unsmoothed)'])
+            self.comboBox.addItems([label for label, _, _ in PROFILE_AXES])
         elif self.radioButtonAngular.isChecked():
             self.comboBox.clear()
             self.comboBox.addItems(['Theta'])
 
-    def update_image_finished(self):
-        if self.rb1.isChecked():
-            self.image_widget.update_image()
-        if self.rb2.isChecked():
-            self.image_widget.Cut()
-
     def on_radiobutton_toggled(self, button, func):
         if button.isChecked():
             func()
@@ -1171,7 +1484,7 @@ class ImageLayout(QWidget):
         # 打开文件选择器对话框
         options = QFileDialog.Options()
         options |= QFileDialog.DontUseNativeDialog
-        file_name, _ = QFileDialog.getOpenFileName(self, '选择文件', '', 'TIFF Files (*.tif *.tiff);;All Files (*)', options=options)
+        file_name, _ = QFileDialog.getOpenFileName(self, '选择文件', '', FRAME_FILE_FILTER, options=options)
         if file_name:
             try:
                 self.file_name = file_name
@@ -1269,24 +1582,24 @@ class ImageLayout(QWidget):
 
         # 获取用户选择的文件名并拼接文件路径
         if self.insitustate == 0:
-            file_path = os.path.join(self.output_folder, os.path.splitext(os.path.basename(self.file_name))[0] + '.jpg')
+            file_path = os.path.join(self.output_folder, frame_stem(self.file_name) + '.jpg')
         if self.insitustate == 1:
             # 创建 image 文件夹
-            folder_name = os.path.splitext(os.path.basename(file_name))[0]
+            folder_name = frame_stem(file_name)
             image_folder_path = os.path.join(self.output_folder, 'image')
             os.makedirs(image_folder_path, exist_ok=True)
             file_path = os.path.join(image_folder_path, folder_name + '.jpg')
             print(file_path)
         if self.image_widget.windowstate == 3: #判断当前图窗是否为一维图像
             # file_path = os.path.join(self.output_folder, os.path.splitext(os.path.basename(self.file_name))[0] + '.jpg')
-            self.image_widget.fig.savefig(file_path, dpi=300)
+            self.image_widget.save_figure(file_path)
             return
         if self.rb1.isChecked():
 
             # 读取图像并规范化
             cb_min = float(self.textbox_min.text())
             cb_max = float(self.textbox_max.text())
-            im = cv2.imread(file_name, cv2.IMREAD_ANYDEPTH)
+            im = self.image_widget.read_image(file_name)
             img_norm = im.copy()
             img_norm[img_norm > cb_max] = cb_max
             img_norm[img_norm < cb_min] = cb_min
@@ -1296,7 +1609,7 @@ class ImageLayout(QWidget):
                 im_norm = cv2.flip(im_norm, 0)
 
             # 创建 jet colormap 并将规范化后的图像映射到 colormap 上
-            cmap = cm.get_cmap('jet')
+            cmap = plt.get_cmap('jet')
             rgba_img = cmap(im_norm / 255.0)
 
             # 将 RGBA 图像转换为 BGR 图像，便于用 OpenCV 保存为 jpg 格式
@@ -1312,19 +1625,20 @@ class ImageLayout(QWidget):
         if self.rb2.isChecked():
 
             # file_path = os.path.join(self.output_folder, os.path.splitext(os.path.basename(self.file_name))[0] + '.jpg')
-            self.image_widget.fig.savefig(file_path, dpi=300)
+            self.image_widget.save_figure(file_path)
 
     def export_integral_data(self):
         try:
             x, y = self.image_widget.calculate_integral()
             if x is not None and y is not None:
-                file_name = os.path.join(self.output_folder,
-                                         os.path.splitext(os.path.basename(self.file_name))[0] + '.txt')
-                print(file_name)
-                with open(file_name, 'a') as f:
-                    for i in range(len(x)):
-                        f.write(f"{x[i]}\t{y[i]}\n")
+                # 重复导出覆盖同名文件；误差由本帧每个 bin 的计数得到
+                files = self.profile_exporter().write(os.path.join(self.output_folder, frame_stem(self.file_name)),
+                                                      x, y, self.image_widget.profile_errors(),
+                                                      frame_stem(self.file_name))
+                print(files[0])
                 QMessageBox.information(self, "Export Success", "Integral data has been exported successfully!")
+        except (OSError, ValueError) as e:
+            QMessageBox.warning(self, "Warning", f"未能导出数据：{e}", QMessageBox.Ok)
         except:
             QMessageBox.warning(self, "Warning", "未能导出数据", QMessageBox.Ok)
 
@@ -1347,6 +1661,8 @@ class Parameter(QWidget):
         super().__init__(parent)
         self.init_ui()
         self.image_widget = image_widget
+        self.connect_render()
+        self.restore_correction()
 
     def init_ui(self):
         # 创建文本框并初始化
@@ -1394,6 +1710,10 @@ class Parameter(QWidget):
         self.threshold_max.setText(self.checkFloatValue(settings.value('threshold_max', '1000000')))
         self.numbin = QLineEdit(self)
         self.numbin.setText(self.checkFloatValue(settings.value('numbin', '500')))
+        self.tilt = QLineEdit(self)
+        self.tilt.setText(self.checkFloatValue(settings.value('tilt', '0')))
+        self.rotation = QLineEdit(self)
+        self.rotation.setText(self.checkFloatValue(settings.value('rotation', '0')))
 
         # 将各个参数设为类属性
         self.Angle_incidence_value = float(self.Angle_incidence.text())
@@ -1410,65 +1730,9 @@ class Parameter(QWidget):
         self.threshold_min_value = float(self.threshold_min.text())
         self.threshold_max_value = float(self.threshold_max.text())
         self.numbin_value = float(self.numbin.text())
+        self.tilt_value = float(self.tilt.text())
+        self.rotation_value = float(self.rotation.text())
 
-        # 绑定文本框的输入与类属性
-        self.Angle_incidence.editingFinished.connect(
-            lambda: self.update_value('Angle_incidence', self.Angle_incidence.text())
-        )
-        self.x_Center.editingFinished.connect(
-            lambda: self.update_value('x_Center', self.x_Center.text())
-        )
-        self.y_Center.editingFinished.connect(
-            lambda: self.update_value('y_Center', self.y_Center.text())
-        )
-        self.distance.editingFinished.connect(
-            lambda: self.update_value('distance', self.distance.text())
-        )
-        self.pixel_x.editingFinished.connect(
-            lambda: self.update_value('pixel_x', self.pixel_x.text())
-        )
-        self.pixel_y.editingFinished.connect(
-            lambda: self.update_value('pixel_y', self.pixel_y.text())
-        )
-        self.lamda.editingFinished.connect(
-            lambda: self.update_value('lamda', self.lamda.text())
-        )
-        self.Qr_min.editingFinished.connect(
-            lambda: self.update_value('Qr_min', self.Qr_min.text())
-        )
-        self.Qr_max.editingFinished.connect(
-            lambda: self.update_value('Qr_max', self.Qr_max.text())
-        )
-        self.Qz_min.editingFinished.connect(
-            lambda: self.update_value('Qz_min', self.Qz_min.text())
-        )
-        self.Qz_max.editingFinished.connect(
-            lambda: self.update_value('Qz_max', self.Qz_max.text())
-        )
-        self.threshold_min.editingFinished.connect(
-            lambda: self.update_value('threshold_min', self.threshold_min.text())
-        )
-        self.threshold_max.editingFinished.connect(
-            lambda: self.update_value('threshold_max', self.threshold_max.text())
-        )
-        self.numbin.editingFinished.connect(
-            lambda: self.update_value('numbin', self.numbin.text())
-        )
-
-        self.Angle_incidence.editingFinished.connect(self.update_image_widget_finished)
-        self.x_Center.editingFinished.connect(self.update_image_widget_finished)
-        self.y_Center.editingFinished.connect(self.update_image_widget_finished)
-        self.distance.editingFinished.connect(self.update_image_widget_finished)
-        self.pixel_x.editingFinished.connect(self.update_image_widget_finished)
-        self.pixel_y.editingFinished.connect(self.update_image_widget_finished)
-        self.lamda.editingFinished.connect(self.update_image_widget_finished)
-        self.Qr_min.editingFinished.connect(self.update_image_widget_finished)
-        self.Qr_max.editingFinished.connect(self.update_image_widget_finished)
-        self.Qz_min.editingFinished.connect(self.update_image_widget_finished)
-        self.Qz_max.editingFinished.connect(self.update_image_widget_finished)
-        self.threshold_min.editingFinished.connect(self.update_image_widget_finished)
-        self.threshold_max.editingFinished.connect(self.update_image_widget_finished)
-        # self.numbin.editingFinished.connect(self.update_image_widget)
 
         # 创建布局
         layout = QGridLayout(self)
@@ -1502,6 +1766,65 @@ class Parameter(QWidget):
         layout.addWidget(QLabel('一维精度：'), 3, 4)
         layout.addWidget(self.numbin, 3, 5)
 
+        # 标样标定：以当前圆心和距离为初值，由标样衍射环拟合圆心、距离和探测器倾斜
+        self.calibrant_combo = QComboBox(self)
+        self.calibrant_combo.addItems(list(CALIBRANTS))
+        self.button_calibrate = QPushButton('标定', self)
+        self.button_calibrate.clicked.connect(self.calibrate)
+        layout.addWidget(self.calibrant_combo, 1, 6)
+        layout.addWidget(self.button_calibrate, 1, 7)
+
+        # 探测器校正：暗场、平场、坏点掩码
+        self.button_dark = QPushButton('暗场', self)
+        self.button_flat = QPushButton('平场', self)
+        self.button_mask = QPushButton('掩码文件', self)
+        self.button_draw_mask = QPushButton('绘制掩码', self)
+        self.button_clear_correction = QPushButton('清除校正', self)
+        self.correction_label = QLabel('未加载校正')
+        self.button_dark.clicked.connect(lambda: self.load_correction_file('dark'))
+        self.button_flat.clicked.connect(lambda: self.load_correction_file('flat'))
+        self.button_mask.clicked.connect(lambda: self.load_correction_file('mask'))
+        self.button_draw_mask.clicked.connect(self.draw_mask)
+        self.button_clear_correction.clicked.connect(self.clear_correction)
+
+        layout.addWidget(self.button_dark, 4, 0)
+        layout.addWidget(self.button_flat, 4, 1)
+        layout.addWidget(self.button_mask, 4, 2)
+        layout.addWidget(self.button_draw_mask, 4, 3)
+        layout.addWidget(self.button_clear_correction, 4, 4)
+        layout.addWidget(self.correction_label, 4, 5, 1, 3)
+
+        # 强度校正：立体角、偏振、洛伦兹、探测器吸收，并入积分权重
+        self.solid_angle_check = QCheckBox('立体角校正')
+        self.solid_angle_check.setChecked(settings.value('solid_angle', 'false') == 'true')
+        self.polarization_check = QCheckBox('偏振校正')
+        self.polarization_check.setChecked(settings.value('polarization', 'false') == 'true')
+        self.polarization_factor = QLineEdit(self)
+        self.polarization_factor.setText(self.checkFloatValue(settings.value('polarization_factor', '0.99')))
+        self.lorentz_check = QCheckBox('洛伦兹校正')
+        self.lorentz_check.setChecked(settings.value('lorentz', 'false') == 'true')
+        self.absorption_check = QCheckBox('吸收校正 μt')
+        self.absorption_check.setChecked(settings.value('absorption', 'false') == 'true')
+        self.absorption_mu_t = QLineEdit(self)
+        self.absorption_mu_t.setText(self.checkFloatValue(settings.value('absorption_mu_t', '0.3')))
+
+        layout.addWidget(self.solid_angle_check, 5, 0)
+        layout.addWidget(self.polarization_check, 5, 1)
+        layout.addWidget(self.polarization_factor, 5, 2)
+        layout.addWidget(self.lorentz_check, 5, 3)
+        layout.addWidget(self.absorption_check, 5, 4)
+        layout.addWidget(self.absorption_mu_t, 5, 5)
+
+        # 探测器倾斜：倾斜角和倾斜轴的方位角（度），0 表示探测器垂直于入射光
+        layout.addWidget(QLabel('倾斜角：'), 6, 0)
+        layout.addWidget(self.tilt, 6, 1)
+        layout.addWidget(QLabel('倾斜方位角：'), 6, 2)
+        layout.addWidget(self.rotation, 6, 3)
+        # 距离初值偏差较大（10% 以上）时标定需要先搜索距离；初值准确时取消勾选，保持输入的距离作为初值
+        self.calibrate_search_check = QCheckBox('标定时搜索距离', self)
+        self.calibrate_search_check.setChecked(True)
+        layout.addWidget(self.calibrate_search_check, 6, 4, 1, 2)
+
     def checkFloatValue(self, value):
         try:
             float_value = float(value)
@@ -1519,17 +1842,38 @@ class Parameter(QWidget):
         settings.setValue('pixel_x', self.pixel_x.text())
         settings.setValue('pixel_y', self.pixel_y.text())
         settings.setValue('lamda', self.lamda.text())
+        settings.setValue('tilt', self.tilt.text())
+        settings.setValue('rotation', self.rotation.text())
 
         event.accept()
 
-    def update_image_widget_finished(self):
-        if self.image_widget.windowstate == 3:
-            self.image_widget.calculate_integral()
-            return
-        if self.image_layout.rb1.isChecked():
-            self.image_widget.update_image()
-        elif self.image_layout.rb2.isChecked():
-            self.image_widget.Cut()
+    def connect_render(self):
+        # 绑定文本框的输入与类属性，并按参数影响的环节接入重绘调度
+        scheduler = self.image_widget.render_scheduler
+        stages = {
+            'Angle_incidence': RenderScheduler.GEOMETRY,
+            'x_Center': RenderScheduler.GEOMETRY,
+            'y_Center': RenderScheduler.GEOMETRY,
+            'distance': RenderScheduler.GEOMETRY,
+            'pixel_x': RenderScheduler.GEOMETRY,
+            'pixel_y': RenderScheduler.GEOMETRY,
+            'lamda': RenderScheduler.GEOMETRY,
+            'tilt': RenderScheduler.GEOMETRY,
+            'rotation': RenderScheduler.GEOMETRY,
+            'Qr_min': RenderScheduler.GEOMETRY,
+            'Qr_max': RenderScheduler.GEOMETRY,
+            'Qz_min': RenderScheduler.GEOMETRY,
+            'Qz_max': RenderScheduler.GEOMETRY,
+            # 阈值既决定显示的掩码，也决定参与积分的像素
+            'threshold_min': RenderScheduler.COLORMAP | RenderScheduler.INTEGRATION,
+            'threshold_max': RenderScheduler.COLORMAP | RenderScheduler.INTEGRATION,
+            'numbin': RenderScheduler.INTEGRATION,
+        }
+        for key, stage in stages.items():
+            scheduler.watch(getattr(self, key), stage, lambda key=key: self.update_value(key, getattr(self, key).text()))
+        for widget in (self.solid_angle_check, self.polarization_check, self.lorentz_check, self.absorption_check,
+                       self.polarization_factor, self.absorption_mu_t):
+            scheduler.watch(widget, RenderScheduler.INTEGRATION)
 
     def update_image_widget(self):
         try:
@@ -1547,6 +1891,8 @@ class Parameter(QWidget):
             self.threshold_min_value = float(self.threshold_min.text())
             self.threshold_max_value = float(self.threshold_max.text())
             self.numbin_value = float(self.numbin.text())
+            self.tilt_value = float(self.tilt.text())
+            self.rotation_value = float(self.rotation.text())
 
             self.image_widget.update_parameters(self)
         except:
@@ -1571,6 +1917,122 @@ class Parameter(QWidget):
         setattr(self, key + '_value', value)
         self.update_image_widget()
 
+    def intensity_correction(self):
+        # 根据勾选状态生成积分权重校正参数
+        return IntensityCorrection(
+            solid_angle=self.solid_angle_check.isChecked(),
+            polarization=float(self.checkFloatValue(self.polarization_factor.text()))
+            if self.polarization_check.isChecked() else None,
+            lorentz=self.lorentz_check.isChecked(),
+            absorption=float(self.checkFloatValue(self.absorption_mu_t.text()))
+            if self.absorption_check.isChecked() else None)
+
+    def restore_correction(self):
+        # 启动时重新加载上次使用的校正文件
+        settings = QSettings('mycompany', 'myapp')
+        correction = self.image_widget.correction
+        loaders = {'dark_file': correction.load_dark, 'flat_file': correction.load_flat,
+                   'mask_file': correction.load_mask}
+        errors = []
+        for key, loader in loaders.items():
+            file_name = settings.value(key, '')
+            if file_name and os.path.isfile(file_name):
+                try:
+                    loader(file_name)
+                except ValueError as e:
+                    errors.append(str(e))
+        self.update_correction_label()
+        if errors:
+            QMessageBox.warning(self, "错误", "上次使用的校正文件未能加载：\n" + "\n".join(errors))
+
+    def load_correction_file(self, kind):
+        options = QFileDialog.Options()
+        options |= QFileDialog.DontUseNativeDialog
+        file_name, _ = QFileDialog.getOpenFileName(self, '选择校正文件', '', 'Image Files (*.tif *.tiff *.edf *.png);;All Files (*)', options=options)
+        if not file_name:
+            return
+        correction = self.image_widget.correction
+        loader = {'dark': correction.load_dark, 'flat': correction.load_flat, 'mask': correction.load_mask}[kind]
+        try:
+            loader(file_name)
+        except ValueError as e:
+            QMessageBox.warning(self, "错误", str(e))
+            return
+        self.update_correction_label()
+        self.image_widget.render_scheduler.invalidate(RenderScheduler.ALL, immediate=True)
+
+    def draw_mask(self):
+        if not self.image_widget.file_name:
+            QMessageBox.warning(self, "提示", "请先导入图片！")
+            return
+        try:
+            cb_min = float(self.image_layout.textbox_min.text())
+            cb_max = float(self.image_layout.textbox_max.text())
+            region = self.image_widget.draw_mask_region(cb_min, cb_max)
+            if region.any():
+                self.image_widget.correction.add_mask_region(region)
+        except ValueError as e:
+            QMessageBox.warning(self, "错误", str(e))
+            return
+        self.update_correction_label()
+        self.image_widget.render_scheduler.invalidate(RenderScheduler.ALL, immediate=True)
+
+    def calibrate(self):
+        widget = self.image_widget
+        if not widget.file_name:
+            QMessageBox.warning(self, "提示", "请先导入标样图片！")
+            return
+        # 与积分相同：在翻转后的图像上标定，坏点和阈值外的像素不参与找峰
+        raw = cv2.flip(widget.read_image(), 0)
+        threshold_min, threshold_max = widget.thresholds()
+        valid = (raw >= threshold_min) & (raw <= threshold_max)
+        bad_pixels = widget.correction.mask_for(raw.shape)
+        if bad_pixels is not None:
+            valid &= ~np.flipud(bad_pixels)
+        geometry = DetectorGeometry(self.x_Center_value, self.y_Center_value, self.distance_value,
+                                    self.pixel_x_value, self.pixel_y_value, self.lamda_value,
+                                    self.tilt_value, self.rotation_value)
+        calibrant = self.calibrant_combo.currentText()
+        QApplication.setOverrideCursor(Qt.WaitCursor)
+        try:
+            fitted, info = calibrate_geometry(raw, geometry, CALIBRANTS[calibrant], valid,
+                                              search=self.calibrate_search_check.isChecked())
+        except ValueError as e:
+            QMessageBox.warning(self, "标定失败", str(e))
+            return
+        finally:
+            QApplication.restoreOverrideCursor()
+
+        reply = QMessageBox.question(
+            self, '标定结果',
+            f'标样：{calibrant}\n圆心-X：{fitted.x_center:.2f}\n圆心-Y：{fitted.y_center:.2f}\n'
+            f'距离：{fitted.distance:.3f} mm\n倾斜：{fitted.tilt:.3f}°，倾斜方位：{fitted.rotation:.1f}°\n'
+            f'{info["points"]} 个峰点，{info["rings"]} 个衍射环，2θ 残差 RMS {info["rms_deg"]:.4f}°\n\n是否应用？',
+            QMessageBox.Yes | QMessageBox.No)
+        if reply != QMessageBox.Yes:
+            return
+        for key, value in (('x_Center', fitted.x_center), ('y_Center', fitted.y_center),
+                           ('distance', fitted.distance), ('tilt', fitted.tilt), ('rotation', fitted.rotation)):
+            getattr(self, key).setText(f'{value:.3f}')
+            self.update_value(key, getattr(self, key).text())
+        widget.render_scheduler.invalidate(RenderScheduler.ALL, immediate=True)
+
+    def clear_correction(self):
+        self.image_widget.correction.clear()
+        self.update_correction_label()
+        self.image_widget.render_scheduler.invalidate(RenderScheduler.ALL, immediate=True)
+
+    def update_correction_label(self):
+        correction = self.image_widget.correction
+        items = []
+        if correction.dark is not None:
+            items.append('暗场')
+        if correction.flat is not None:
+            items.append('平场')
+        if correction.bad_pixels is not None:
+            items.append(f'掩码 {int(correction.bad_pixels.sum())} 像素')
+        self.correction_label.setText('，'.join(items) if items else '未加载校正')
+
 class BatchProcessor(QWidget):
     def __init__(self, image_widget, image_layout):
         super().__init__()
@@ -1588,6 +2050,7 @@ class BatchProcessor(QWidget):
         self.pattern_input.setText('*.tif')
         self.process_button = QPushButton("批量处理")
         self.hotmap_button = QPushButton("原位热图预览")
+        self.overlay_button = QPushButton("曲线叠加")
 
         self.export_image_check = QCheckBox("导出图片")
         self.export_curve_check = QCheckBox("导出一维曲线")
@@ -1603,6 +2066,34 @@ class BatchProcessor(QWidget):
         self.background_max.setPlaceholderText('1D_max')
         self.background_max.setFixedWidth(100)
 
+        # 积分前的帧合并：每 N 帧求和/平均、滑动平均以及像素合并
+        self.reduce_mode = QComboBox()
+        self.reduce_mode.addItems(['不合并', '每N帧求和', '每N帧平均', 'N帧滑动平均'])
+        self.reduce_group = QLineEdit()
+        self.reduce_group.setPlaceholderText('N')
+        self.reduce_group.setText('1')
+        self.reduce_group.setFixedWidth(60)
+        self.binning_combo = QComboBox()
+        self.binning_combo.addItems(['1×1', '2×2', '4×4'])
+
+        # 圆心漂移校正：每 N 帧由衍射环对称性或直通光斑重新估计圆心，积分圆心随之移动
+        self.drift_check = QCheckBox('圆心漂移校正')
+        self.drift_method = QComboBox()
+        self.drift_method.addItems(['衍射环对称', '直通光斑'])
+        self.drift_every = QLineEdit()
+        self.drift_every.setPlaceholderText('N')
+        self.drift_every.setText('1')
+        self.drift_every.setFixedWidth(60)
+
+        # 取向分析：逐帧提取若干 q 环的方位角分布，结束后计算 Herman 取向因子、mosaicity 和峰宽随帧的变化
+        self.orientation_check = QCheckBox('取向分析')
+        self.orientation_bands = QLineEdit()
+        self.orientation_bands.setPlaceholderText('q 范围，如 1.30-1.45; 1.60-1.70')
+        self.orientation_reference = QLineEdit()
+        self.orientation_reference.setPlaceholderText('参考χ')
+        self.orientation_reference.setText('90')
+        self.orientation_reference.setFixedWidth(60)
+
         self.progress_bar = QProgressBar()
         self.progress_bar.setMinimum(0)
         self.progress_bar.setMaximum(100)
@@ -1615,6 +2106,39 @@ class BatchProcessor(QWidget):
 
         self.stop_button = QPushButton('停止')
 
+        # 抽样预览：在完整批量处理之前，用少量均匀抽取的帧快速检查扇形和扣背底设置
+        self.preview_button = QPushButton('抽样预览')
+        self.preview_count = QLineEdit()
+        self.preview_count.setPlaceholderText('预览帧数')
+        self.preview_count.setText('50')
+        self.preview_count.setFixedWidth(60)
+        self.preview_refine_check = QCheckBox('后台细化')
+        self.preview_refiner = None
+
+        # 多文件夹任务队列：按配方在进程池中处理多个文件夹
+        self.queue_button = QPushButton('任务队列')
+        self.queue_dialog = None
+
+        # 每次批量处理结束后显示各环节耗时汇总；勾选性能分析时同时保存 profile 文件到导出文件夹
+        self.profile_check = QCheckBox('性能分析')
+        self.timing_label = QLabel()
+
+        # 逐帧浏览：按文件名匹配模式载入序列，用滑块、播放和前后帧按钮在原图窗口中浏览
+        self.scrub_load_button = QPushButton('载入序列')
+        self.scrub_prev_button = QPushButton('<')
+        self.scrub_play_button = QPushButton('播放')
+        self.scrub_play_button.setCheckable(True)
+        self.scrub_next_button = QPushButton('>')
+        for button in (self.scrub_prev_button, self.scrub_next_button):
+            button.setFixedWidth(40)
+        self.scrub_slider = QSlider(Qt.Horizontal)
+        self.scrub_slider.setEnabled(False)
+        self.scrub_label = QLabel('0/0')
+        self.scrubber = FrameScrubber(self.image_widget)
+        # 播放时每 50 ms 前进一帧，下一帧尚未渲染好时等待
+        self.play_timer = QTimer(self)
+        self.play_timer.setInterval(50)
+
         # 设置布局
         folder_layout = QHBoxLayout()
         folder_layout.addWidget(self.folder_label)
@@ -1635,36 +2159,89 @@ class BatchProcessor(QWidget):
         check_layout.addWidget(self.background_min)
         check_layout.addWidget(self.background_max)
 
+        reduce_layout = QHBoxLayout()
+        reduce_layout.addWidget(QLabel("帧合并:"))
+        reduce_layout.addWidget(self.reduce_mode)
+        reduce_layout.addWidget(QLabel("N:"))
+        reduce_layout.addWidget(self.reduce_group)
+        reduce_layout.addWidget(QLabel("像素合并:"))
+        reduce_layout.addWidget(self.binning_combo)
+        reduce_layout.addWidget(self.drift_check)
+        reduce_layout.addWidget(self.drift_method)
+        reduce_layout.addWidget(QLabel("每N帧估计:"))
+        reduce_layout.addWidget(self.drift_every)
+        reduce_layout.addStretch()
+
+        orientation_layout = QHBoxLayout()
+        orientation_layout.addWidget(self.orientation_check)
+        orientation_layout.addWidget(QLabel("q 环(1/A):"))
+        orientation_layout.addWidget(self.orientation_bands)
+        orientation_layout.addWidget(QLabel("参考方向χ(°):"))
+        orientation_layout.addWidget(self.orientation_reference)
+
         button_layout = QHBoxLayout()
         button_layout.addWidget(self.process_button)
         button_layout.addWidget(self.stop_button)
         button_layout.addWidget(self.hotmap_button)
+        button_layout.addWidget(self.overlay_button)
+        button_layout.addWidget(self.preview_button)
+        button_layout.addWidget(self.preview_count)
+        button_layout.addWidget(self.preview_refine_check)
+        button_layout.addWidget(self.queue_button)
         button_layout.addWidget(self.progress_bar)
 
         input_layout = QHBoxLayout()
         input_layout.addWidget(self.insitu_txt_button)
         input_layout.addWidget(self.insitu_txt_label)
 
+        scrub_layout = QHBoxLayout()
+        scrub_layout.addWidget(self.scrub_load_button)
+        scrub_layout.addWidget(self.scrub_prev_button)
+        scrub_layout.addWidget(self.scrub_play_button)
+        scrub_layout.addWidget(self.scrub_next_button)
+        scrub_layout.addWidget(self.scrub_slider)
+        scrub_layout.addWidget(self.scrub_label)
+
+        timing_layout = QHBoxLayout()
+        timing_layout.addWidget(self.profile_check)
+        timing_layout.addWidget(self.timing_label)
+        timing_layout.addStretch()
+
         main_layout = QVBoxLayout()
         main_layout.addLayout(folder_layout)
         main_layout.addLayout(pattern_layout)
         main_layout.addSpacing(20)
         main_layout.addLayout(check_layout)
+        main_layout.addLayout(reduce_layout)
+        main_layout.addLayout(orientation_layout)
         main_layout.addLayout(button_layout)
         main_layout.addLayout(input_layout)
+        main_layout.addLayout(scrub_layout)
+        main_layout.addLayout(timing_layout)
 
 
 
 
         self.setLayout(main_layout)
         self.output_matrix = None
+        self.export_thread = None
+        self.skipped = []
         # 连接信号槽
         self.folder_select_button.clicked.connect(self.select_folder)
         self.process_button.clicked.connect(self.batch_process)
         self.hotmap_button.clicked.connect(self.hotmap_plot)
+        self.overlay_button.clicked.connect(self.overlay_plot)
         self.insitu_txt_button.clicked.connect(self.insitu_input)
         self.stop_button.clicked.connect(self.stop_loop)
+        self.preview_button.clicked.connect(self.preview)
+        self.queue_button.clicked.connect(self.open_job_queue)
         self.background_init_img.textChanged.connect(self.update_bg_init_param)
+        self.scrub_load_button.clicked.connect(self.load_sequence)
+        self.scrub_slider.valueChanged.connect(self.on_scrub)
+        self.scrub_prev_button.clicked.connect(lambda: self.scrub_slider.setValue(self.scrub_slider.value() - 1))
+        self.scrub_next_button.clicked.connect(lambda: self.scrub_slider.setValue(self.scrub_slider.value() + 1))
+        self.scrub_play_button.toggled.connect(self.on_play_toggled)
+        self.play_timer.timeout.connect(self.play_step)
 
     def update_bg_init_param(self, text):
         try:
@@ -1672,6 +2249,43 @@ class BatchProcessor(QWidget):
         except ValueError:
             self.background_init_img_value = 1
 
+    def frame_reducer(self):
+        try:
+            group = int(self.reduce_group.text())
+        except ValueError:
+            group = 1
+        mode = FrameReducer.MODES[self.reduce_mode.currentIndex()]
+        binning = (1, 2, 4)[self.binning_combo.currentIndex()]
+        return FrameReducer(mode, group, binning)
+
+    def drift_tracker(self, reducer):
+        # 未勾选圆心漂移校正时返回 None；阈值与积分一致，按帧合并方式换算
+        if not self.drift_check.isChecked():
+            return None
+        try:
+            every = int(self.drift_every.text())
+        except ValueError:
+            every = 1
+        widget = self.image_widget
+        scale = reducer.value_scale
+        return DriftTracker((float(widget.x_Center), float(widget.y_Center)),
+                            DriftTracker.METHODS[self.drift_method.currentIndex()], every,
+                            thresholds=(widget.threshold_min * scale, widget.threshold_max * scale),
+                            correction=widget.correction)
+
+    def orientation_series(self):
+        # 未勾选取向分析时返回 None；q 范围为空或无法解析时抛出 ValueError
+        if not self.orientation_check.isChecked():
+            return None
+        bands = parse_q_bands(self.orientation_bands.text())
+        if not bands:
+            raise ValueError("请输入取向分析的 q 范围！")
+        try:
+            reference = float(self.orientation_reference.text())
+        except ValueError:
+            reference = 90.0
+        return OrientationSeries(bands, reference)
+
     def insitu_input(self):
         # 显示文件对话框，以选择输入文件
         options = QFileDialog.Options()
@@ -1691,11 +2305,8 @@ class BatchProcessor(QWidget):
         if folder_path:
             self.folder_path_label.setText(folder_path)
 
-    def batch_process(self):
-
-        # Reset the stop flag
-        self.reset_stop_flag()
-
+    def collect_frames(self):
+        # 按文件夹和匹配模式列出所有帧，多帧容器展开为逐帧引用；出错时提示并返回 None
         folder_path = self.folder_path_label.text()
         if not os.path.isdir(folder_path):
             QMessageBox.warning(self, "警告", "请选择有效的文件夹！")
@@ -1707,12 +2318,72 @@ class BatchProcessor(QWidget):
             return
 
         # 寻找符合通配符模式的文件
-        file_list = sorted(glob.glob(folder_path + "/*" + pattern_str))
+        file_list = match_files(folder_path, pattern_str)
         if not file_list:
             QMessageBox.warning(self, "警告", "没有找到符合条件的文件！")
             return
 
-        total_files = len(file_list)
+        # 多帧容器（HDF5/NeXus、多帧 EDF 等）展开为逐帧引用
+        try:
+            return expand_frame_refs(file_list)
+        except (OSError, ValueError) as e:
+            QMessageBox.warning(self, "警告", f"无法读取文件：{e}")
+            return
+
+    def load_sequence(self):
+        file_list = self.collect_frames()
+        if not file_list:
+            return
+        self.scrubber.set_refs(file_list)
+        self.scrub_slider.blockSignals(True)
+        self.scrub_slider.setRange(0, len(file_list) - 1)
+        self.scrub_slider.setValue(0)
+        self.scrub_slider.blockSignals(False)
+        self.scrub_slider.setEnabled(True)
+        self.on_scrub(0)
+
+    def on_scrub(self, index):
+        self.scrub_label.setText(f'{index + 1}/{len(self.scrubber.refs)}')
+        self.scrubber.seek(index)
+
+    def on_play_toggled(self, checked):
+        if checked and self.scrubber.refs:
+            self.scrub_play_button.setText('暂停')
+            self.play_timer.start()
+        else:
+            self.scrub_play_button.setText('播放')
+            self.scrub_play_button.setChecked(False)
+            self.play_timer.stop()
+
+    def play_step(self):
+        index = self.scrub_slider.value() + 1
+        if index > self.scrub_slider.maximum():
+            self.on_play_toggled(False)
+            return
+        # 原图模式下等待下一帧渲染完成，避免播放时卡在同步读取上
+        if self.image_layout.rb1.isChecked() and not self.scrubber.ready(index):
+            return
+        self.scrub_slider.setValue(index)
+
+    def batch_process(self):
+
+        # Reset the stop flag
+        self.reset_stop_flag()
+
+        file_list = self.collect_frames()
+        if not file_list:
+            return
+
+        reducer = self.frame_reducer()
+        total_files = reducer.output_count(len(file_list))
+        if total_files == 0:
+            QMessageBox.warning(self, "警告", "文件数少于帧合并的 N！")
+            return
+        try:
+            orientation = self.orientation_series()
+        except ValueError as e:
+            QMessageBox.warning(self, "警告", str(e))
+            return
         # 开启原位处理状态码
         self.image_layout.insitustate = 1
 
@@ -1750,109 +2421,162 @@ class BatchProcessor(QWidget):
 
         output = []
         output_bk = []
+        # 未平滑的曲线和误差，以及额外导出格式所需的每帧文件名
+        profiles, errors, names = [], [], []
+        background = self.background_removal_check.isChecked() and self.x_bg is not None
+        exporter = self.image_layout.profile_exporter()
+        self.wait_export()
+        # 分环节计时；勾选性能分析时额外采集 profile
+        timer = StageTimer()
+        profile_folder = getattr(self.image_layout, 'output_folder', None) or self.folder_path_label.text()
+        profile = profiling(os.path.join(profile_folder, 'profile')) if self.profile_check.isChecked() \
+            else nullcontext()
         # 遍历符合条件的文件并进行处理
-        for i, filepath in enumerate(file_list):
-
-            if self.stop_flag:
-                self.progress_bar.setValue(0)
-                QMessageBox.warning(self, 'Warning', 'The process was stopped by the user.')
-                return
-
-            filename = os.path.basename(filepath)
-
-            # 设置image_widget的filename并调用Cut()、update_image()和export_image()
-            self.filename = filepath
-            self.image_widget.update_batch_processor_filename()
-            self.image_layout.update_batch_processor_filename()
-
-            # 如果一维被勾选上
-            if self.export_curve_check.isChecked():
-                try:
-                    x, y = self.export_integral_data()
-                    if i == 0:
-                        output.append(x)
-                    output.append(y)
-
-                except:
-                    QMessageBox.warning(self, "Warning", "积分中止！", QMessageBox.Ok)
-                    self.image_layout.insitustate = 0
+        # 后台线程预读后续帧，解码与当前帧的积分、导出重叠进行；帧合并在积分之前流式完成
+        tracker = self.drift_tracker(reducer)
+        self.skipped = []
+        with profile, self.image_widget.timed_stages(timer), \
+                FramePrefetcher(file_list, self.load_batch_frame) as frames, \
+                self.image_widget.reduced_frames(reducer.binning, reducer.value_scale), \
+                self.image_widget.tracked_center():
+            if orientation is not None:
+                settings = self.image_widget.pipeline_settings()
+                settings.binning, settings.value_scale = reducer.binning, reducer.value_scale
+            # 读取失败的帧已在预读线程中跳过
+            frames = ((ref, frame) for ref, frame in frames if frame is not None)
+            for i, (filepath, frame) in enumerate(timer.timed('wait', reducer.reduce(frames))):
+
+                if self.stop_flag:
+                    self.progress_bar.setValue(0)
+                    QMessageBox.warning(self, 'Warning', 'The process was stopped by the user.')
                     return
 
-            # 如果二维导出被勾选上
-            if self.export_image_check.isChecked():
-                if self.image_layout.rb2.isChecked():
-                    self.image_widget.Cut()
-                if self.image_layout.rb1.isChecked():
-                    self.image_widget.update_image()
-                self.image_layout.export_image()
-
-
-            # 更新进度条
-            progress = (i + 1) / total_files * 100
-            self.progress_bar.setValue(int(round(progress)))
-            # 强制处理未处理的事件，以便更新界面
-            QCoreApplication.processEvents()
-
-            plt.close('all')
-            fig, ax = plt.subplots()
-            # 扣背底循环
-            if self.background_removal_check.isChecked() and self.x_bg is not None:
-                x, y = self.export_integral_data()
-                # 搜索self.x_bg在x中对应的索引
-                idx = [np.abs(x - xi).argmin() for xi in self.x_bg]
-                # 获取对应的y值
-                y_bg = y[idx]
-                # 使用样条插值
-                interp_spline = make_interp_spline(self.x_bg, y_bg, k=2)
-                y_bg_interp = interp_spline(x)
-                # 扣除背景曲线，得到扣除背景后的曲线
-                y_corrected = y - y_bg_interp
-                # 导出数据
-                if i == 0:
-                    output_bk.append(x)
-                output_bk.append(y_corrected)
-
-                # 清空Axes并绘制新的数据
-                ax.clear()
-                ax.plot(x, y_corrected)
-                ax.set_title('Iteration %d' % (i + 1))
-                # 刷新画布
-                fig.canvas.draw()
-                # 保证窗口能够响应事件
-                plt.pause(0.001)
+                filename = os.path.basename(filepath)
+                timer.count('frames')
+
+                # 设置image_widget的filename并调用Cut()、update_image()和export_image()
+                self.filename = filepath
+                self.image_widget.store_frame(filepath, frame)
+                if tracker is not None:
+                    with timer.stage('drift'):
+                        self.image_widget.x_Center, self.image_widget.y_Center = \
+                            tracker.update(i, frame, reducer.binning)
+                if orientation is not None:
+                    with timer.stage('orientation'):
+                        if tracker is not None:
+                            settings.geometry = settings.geometry.copy(x_center=float(self.image_widget.x_Center),
+                                                                       y_center=float(self.image_widget.y_Center))
+                        orientation.update(i, settings, frame)
+                self.image_widget.update_batch_processor_filename()
+                self.image_layout.update_batch_processor_filename()
+
+                # 如果一维被勾选上（或需要扣背底）：界面照常显示本帧曲线，导出用的未平滑曲线收集起来，结束后整体平滑
+                if self.export_curve_check.isChecked() or background:
+                    try:
+                        x_display, y_display = self.export_integral_data()
+                        x, y, e = self.image_widget.raw_profile()
+                        profiles.append(y)
+                        errors.append(e)
+                        names.append(frame_stem(filepath))
+
+                    except:
+                        QMessageBox.warning(self, "Warning", "积分中止！", QMessageBox.Ok)
+                        self.image_layout.insitustate = 0
+                        return
+
+                # 如果二维导出被勾选上
+                if self.export_image_check.isChecked():
+                    with timer.stage('export_2d'):
+                        if self.image_layout.rb2.isChecked():
+                            self.image_widget.Cut()
+                        if self.image_layout.rb1.isChecked():
+                            self.image_widget.update_image()
+                        self.image_layout.export_image()
+
+
+                with timer.stage('ui'):
+                    # 更新进度条
+                    progress = (i + 1) / total_files * 100
+                    self.progress_bar.setValue(int(round(progress)))
+                    # 强制处理未处理的事件，以便更新界面
+                    QCoreApplication.processEvents()
+
+                    plt.close('all')
+                    fig, ax = plt.subplots()
+                # 扣背底循环：这里只显示本帧扣除背景后的曲线，导出的结果在全部帧平滑后一次计算
+                if background:
+                    with timer.stage('background'):
+                        # 扣除背景曲线，得到扣除背景后的曲线
+                        y_corrected = subtract_background(x_display, y_display, self.x_bg)
+
+                        # 清空Axes并绘制新的数据
+                        ax.clear()
+                        ax.plot(x_display, y_corrected)
+                        ax.set_title('Iteration %d' % (i + 1))
+                        # 刷新画布
+                        fig.canvas.draw()
+                        # 保证窗口能够响应事件
+                        plt.pause(0.001)
 
 
         # 显示窗口
         plt.show()
 
+        # 整个曲线堆栈一次平滑（误差同样平滑），再一次扣除背景
+        if profiles:
+            with timer.stage('smooth'):
+                profiles = self.image_widget.smooth_profiles(np.array(profiles))
+                errors = self.image_widget.smooth_profiles(np.array(errors))
+            output = [x] + list(profiles)
+            if background:
+                with timer.stage('background'):
+                    output_bk = [x] + list(subtract_background(x, profiles, self.x_bg))
+        # 导出文件在后台线程中写入，这里只准备数据
+        jobs = []
         # 如果一维被勾选上，导出txt数据
-        if self.export_curve_check.isChecked():
+        if self.export_curve_check.isChecked() and len(profiles):
             # 定义 1D 文件夹
             image_folder_path = os.path.join(self.image_layout.output_folder, '1D')
             file_path = os.path.join(image_folder_path, 'output.txt')
 
             # 转换output为numpy矩阵
             output_matrix = np.column_stack(output)
-            # 保存矩阵为txt文件
-            np.savetxt(file_path, output_matrix, fmt='%.6f', delimiter=' ')
+            jobs.append(lambda: write_table(file_path, output_matrix))
+            if exporter.fmt != 'txt':
+                # 按所选格式另外导出：每帧一个文件，或整个堆栈一个文件
+                jobs.append(lambda: exporter.write_stack(os.path.join(image_folder_path, exporter.fmt),
+                                                         output_matrix[:, 0], output_matrix[:, 1:].T,
+                                                         errors, names))
             self.output_matrix = output_matrix
             self.insitu_txt_label.setText(file_path)
         self.image_layout.insitustate = 0
         # QMessageBox.information(None, "完成", "已完成！")
         # 如果一维被勾选上，导出txt数据
-        if self.background_removal_check.isChecked():
+        if background and output_bk:
             # 定义 1D 文件夹
             image_folder_path = os.path.join(self.image_layout.output_folder, '1D')
-            file_path = os.path.join(image_folder_path, 'output_subBk.txt')
+            bk_path = os.path.join(image_folder_path, 'output_subBk.txt')
 
             # 转换output为numpy矩阵
             output_bk_matrix = np.column_stack(output_bk)
-            # 保存矩阵为txt文件
-            np.savetxt(file_path, output_bk_matrix, fmt='%.6f', delimiter=' ')
+            jobs.append(lambda: write_table(bk_path, output_bk_matrix))
             self.output_matrix_bk = output_bk_matrix
             # self.insitu_txt_label.setText(file_path)
+        if jobs:
+            self.export_thread = ExportThread(jobs)
+            self.export_thread.exported.connect(self.show_exported)
+            self.export_thread.failed.connect(
+                lambda message: QMessageBox.warning(self, "Warning", f"未能导出数据：{message}", QMessageBox.Ok))
+            self.export_thread.start()
 
         self.image_layout.insitustate = 0
+        self.show_timing(timer)
+        if self.skipped:
+            self.save_skipped(profile_folder)
+        if tracker is not None:
+            self.save_drift(tracker, profile_folder)
+        if orientation is not None:
+            self.save_orientation(orientation, profile_folder)
 
         plt.close()
 
@@ -1943,18 +2667,61 @@ class BatchProcessor(QWidget):
         except:
             QMessageBox.warning(self, "Warning", "请先进行一维曲线的批量处理或导入原位数据文件！", QMessageBox.Ok)
 
+    def preview(self):
+        # 均匀抽取若干帧积分并显示粗略热图；勾选后台细化时，剩余帧在后台逐级加密补全
+        file_list = self.collect_frames()
+        if not file_list:
+            return
+        try:
+            count = max(int(self.preview_count.text()), 2)
+            settings = self.image_widget.pipeline_settings()
+        except ValueError:
+            QMessageBox.warning(self, "警告", "请检查预览帧数和积分区域参数！")
+            return
+        if self.preview_refiner is not None:
+            self.preview_refiner.requestInterruption()
+            self.preview_refiner.wait()
+
+        self.reset_stop_flag()
+        indices = preview_order(len(file_list), count)
+        heatmap = PreviewHeatmap(len(file_list))
+        sample = [file_list[i] for i in indices[:count]]
+        with FramePrefetcher(sample, self.load_preview_frame) as frames:
+            for i, (index, (_, frame)) in enumerate(zip(indices, frames)):
+                if self.stop_flag:
+                    return
+                if frame is not None:
+                    try:
+                        heatmap.add(index, *settings.integrate(frame))
+                    except ValueError as e:
+                        # 例如帧尺寸与暗场/平场/掩码不一致，提示后放弃本次预览
+                        QMessageBox.warning(self, "警告", f"预览积分失败：{e}")
+                        return
+                self.progress_bar.setValue(int(round((i + 1) / len(sample) * 100)))
+                QCoreApplication.processEvents()
+        heatmap.draw()
+        self.preview_heatmap = heatmap
+
+        if self.preview_refine_check.isChecked() and len(indices) > count:
+            refs = [(i, file_list[i]) for i in indices[count:]]
+            self.preview_refiner = PreviewRefiner(refs, settings, self.load_preview_frame)
+            self.preview_refiner.results.connect(heatmap.add_rows)
+            self.preview_refiner.finished.connect(heatmap.draw)
+            self.preview_refiner.start()
+
     def export_integral_data(self):
         try:
             # 创建 1D 文件夹
             self.image_layout.file_name = self.filename
             self.image_widget.file_name = self.filename
-            folder_name = os.path.splitext(os.path.basename(self.image_layout.file_name))[0]
+            folder_name = frame_stem(self.image_layout.file_name)
             image_folder_path = os.path.join(self.image_layout.output_folder, '1D')
             os.makedirs(image_folder_path, exist_ok=True)
             file_path = os.path.join(image_folder_path, folder_name + '.jpg')
 
             x, y = self.image_widget.calculate_integral()
-            self.image_widget.fig.savefig(file_path, dpi=300) #导出一维图片的jpg格式
+            with self.image_widget.stage_timer.stage('export_1d'):
+                self.image_widget.save_figure(file_path) #导出一维图片的jpg格式
 
             # mask = (x >= float(self.batch_processor.background_min.text())) & (
             #             x <= float(self.batch_processor.background_max.text()))
@@ -1965,8 +2732,94 @@ class BatchProcessor(QWidget):
         except:
             return None, None
 
+    def show_timing(self, timer):
+        # 批量处理结束后汇总各环节耗时：界面显示吞吐量和最耗时的环节，完整表格打印到日志并作为提示文字
+        summary = timer.summary()
+        if not summary['frames']:
+            return
+        report = timer.report()
+        print(report)
+        dominant = summary['stages'][summary['dominant']]
+        self.timing_label.setText(f"{summary['frames']} 帧，{summary['fps']:.2f} 帧/秒，"
+                                  f"主要耗时：{summary['dominant']} ({dominant['share']:.0%})")
+        self.timing_label.setToolTip(report)
+
+    def load_preview_frame(self, ref):
+        # 预览只是粗略浏览：读取失败的帧不重试也不记录，直接留空；后台细化线程同样使用，任何异常都不能抛出
+        try:
+            return self.image_widget.load_frame(ref)
+        except Exception:
+            return None
+
+    def load_batch_frame(self, ref, retries=2):
+        # 与 RecipeRunner.load 相同：读取失败的帧（例如仍在写入的文件）重试 retries 次后跳过，返回 None
+        for attempt in range(retries + 1):
+            try:
+                return self.image_widget.load_frame(ref)
+            except (OSError, ValueError) as e:
+                error = e
+                if attempt < retries:
+                    time.sleep(0.2 * (attempt + 1))
+        self.skipped.append((ref, str(error)))
+        return None
+
+    def save_skipped(self, folder):
+        # 跳过的帧与命令行批量处理一样记录在 skipped.txt，数量附加在耗时汇总之后
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, 'skipped.txt'), 'w', encoding='utf-8') as f:
+            f.writelines(f'{ref}\t{error}\n' for ref, error in self.skipped)
+        self.timing_label.setText(f"{self.timing_label.text()}，跳过 {len(self.skipped)} 帧无法读取的文件")
+
+    def save_drift(self, tracker, folder):
+        # 每帧积分所用的圆心保存为 center_drift.txt，最大漂移附加在耗时汇总之后
+        np.savetxt(os.path.join(folder, 'center_drift.txt'), np.array(tracker.history),
+                   fmt=['%d', '%.3f', '%.3f'], header='frame x_Center y_Center')
+        text = f"圆心最大漂移 {tracker.max_drift():.2f} px"
+        if tracker.rejected:
+            text += f"（{tracker.rejected} 次估计失败，沿用上一圆心）"
+        self.timing_label.setText('，'.join(t for t in (self.timing_label.text(), text) if t))
+
+    def save_orientation(self, series, folder):
+        # 取向参数的时间序列和各 q 环的方位角分布保存到 orientation/，首末帧的取向因子附加在耗时汇总之后
+        if not series.frames:
+            return
+        series.save(os.path.join(folder, 'orientation'))
+        self.timing_label.setText('，'.join(t for t in (self.timing_label.text(), series.summary()) if t))
+
+    def show_exported(self, files):
+        # 后台导出完成后附加在耗时汇总之后
+        text = self.timing_label.text()
+        self.timing_label.setText(f"{text}，已导出 {len(files)} 个文件" if text else f"已导出 {len(files)} 个文件")
+
+    def wait_export(self):
+        # 下一次批量处理前等上一次的后台导出写完，避免两次写同一文件
+        if self.export_thread is not None:
+            self.export_thread.wait()
+
+    def overlay_plot(self):
+        # 批量处理或导入的结果矩阵中任选若干帧叠加显示，默认选中均匀分布的至多 100 帧
+        if self.output_matrix is None or self.output_matrix.ndim != 2 or self.output_matrix.shape[1] < 2:
+            QMessageBox.warning(self, "Warning", "请先进行一维曲线的批量处理或导入原位数据文件！", QMessageBox.Ok)
+            return
+        frames = self.output_matrix.shape[1] - 1
+        self.overlay_view = OverlayView(self.output_matrix, self.insitu_txt_label.text(), self)
+        step = max(frames // 100, 1)
+        self.overlay_view.selection.setText(f'1-{frames}:{step}')
+        self.overlay_view.set_frames(np.arange(0, frames, step))
+        self.overlay_view.show()
+
+    def open_job_queue(self):
+        # 队列窗口只创建一次，关闭后再打开仍保留任务和状态
+        if self.queue_dialog is None:
+            output = getattr(self.image_layout, 'output_folder', None) or self.folder_path_label.text()
+            self.queue_dialog = JobQueueDialog(self.window().current_recipe, output, self.pattern_input.text(), self)
+        self.queue_dialog.show()
+        self.queue_dialog.raise_()
+
     def stop_loop(self):
         self.stop_flag = True
+        if self.preview_refiner is not None:
+            self.preview_refiner.requestInterruption()
 
     def reset_stop_flag(self):
         self.stop_flag = False
@@ -1976,13 +2829,157 @@ class BatchProcessor(QWidget):
         QTimer.singleShot(0, loop.quit)
         loop.exec_()
 
+class JobQueueDialog(QDialog):
+    """
+    多文件夹任务队列：添加 (文件夹, 匹配模式, 配方) 任务，按设定的并发数在进程池中运行，
+    表格中显示每个任务的状态、帧数、跳过的帧、耗时和导出位置
+    """
+    COLUMNS = ['文件夹', '匹配模式', '配方', '状态', '帧数', '跳过', '耗时 (s)', '导出']
+
+    def __init__(self, recipe_source, output_folder, pattern='', parent=None):
+        """
+        :param recipe_source: 返回当前界面参数配方的函数，未指定配方文件的任务使用它
+        """
+        super().__init__(parent)
+        self.setWindowTitle('任务队列')
+        self.resize(900, 400)
+        self.recipe_source = recipe_source
+        self.queue = JobQueue(self)
+
+        self.table = QTableWidget(0, len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.Interactive)
+        self.table.horizontalHeader().setStretchLastSection(True)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+
+        self.pattern_input = QLineEdit(pattern)
+        self.pattern_input.setPlaceholderText('匹配模式')
+        self.recipe_input = QLineEdit()
+        self.recipe_input.setPlaceholderText('配方文件，留空使用当前参数')
+        self.recipe_button = QPushButton('选择配方')
+        self.output_input = QLineEdit(output_folder)
+        self.output_input.setPlaceholderText('导出根文件夹')
+        self.add_button = QPushButton('添加文件夹')
+        self.remove_button = QPushButton('移除')
+        self.concurrency_input = QLineEdit(str(max((os.cpu_count() or 2) // 2, 1)))
+        self.concurrency_input.setFixedWidth(60)
+        self.retries_input = QLineEdit('2')
+        self.retries_input.setFixedWidth(60)
+        self.start_button = QPushButton('开始')
+        self.cancel_button = QPushButton('取消')
+
+        job_layout = QHBoxLayout()
+        job_layout.addWidget(QLabel('匹配模式:'))
+        job_layout.addWidget(self.pattern_input)
+        job_layout.addWidget(self.recipe_input)
+        job_layout.addWidget(self.recipe_button)
+        job_layout.addWidget(self.add_button)
+        job_layout.addWidget(self.remove_button)
+
+        run_layout = QHBoxLayout()
+        run_layout.addWidget(QLabel('导出:'))
+        run_layout.addWidget(self.output_input)
+        run_layout.addWidget(QLabel('并行数:'))
+        run_layout.addWidget(self.concurrency_input)
+        run_layout.addWidget(QLabel('读取重试:'))
+        run_layout.addWidget(self.retries_input)
+        run_layout.addWidget(self.start_button)
+        run_layout.addWidget(self.cancel_button)
+
+        layout = QVBoxLayout()
+        layout.addLayout(job_layout)
+        layout.addWidget(self.table)
+        layout.addLayout(run_layout)
+        self.setLayout(layout)
+
+        self.recipe_button.clicked.connect(self.select_recipe)
+        self.add_button.clicked.connect(self.add_folder)
+        self.remove_button.clicked.connect(self.remove_selected)
+        self.start_button.clicked.connect(self.start)
+        self.cancel_button.clicked.connect(self.queue.cancel)
+        self.queue.changed.connect(self.update_row)
+        self.queue.finished.connect(lambda: self.start_button.setEnabled(True))
+
+    def select_recipe(self):
+        file_name, _ = QFileDialog.getOpenFileName(self, '选择配方', '', 'Recipe Files (*.json);;All Files (*)')
+        if file_name:
+            self.recipe_input.setText(file_name)
+
+    def add_folder(self):
+        folder = QFileDialog.getExistingDirectory(self, '选择数据文件夹')
+        if folder:
+            self.add_job(folder)
+
+    def add_job(self, folder):
+        recipe_file = self.recipe_input.text()
+        try:
+            recipe = Recipe.load(recipe_file) if recipe_file else self.recipe_source()
+        except (OSError, ValueError) as e:
+            QMessageBox.warning(self, '警告', f'无法读取配方：{e}')
+            return
+        # 各任务导出到 <导出根文件夹>/<文件夹名>，重名时加序号
+        name = os.path.basename(os.path.normpath(folder))
+        outputs = {job.output for job in self.queue.jobs}
+        output = os.path.join(self.output_input.text(), name)
+        suffix = 1
+        while output in outputs:
+            suffix += 1
+            output = os.path.join(self.output_input.text(), f'{name}_{suffix}')
+        job = BatchJob(folder, self.pattern_input.text(), recipe, output,
+                       os.path.basename(recipe_file) if recipe_file else '当前参数')
+        index = self.queue.add(job)
+        self.table.insertRow(index)
+        self.update_row(index)
+
+    def remove_selected(self):
+        for index in sorted({item.row() for item in self.table.selectedItems()}, reverse=True):
+            if self.queue.jobs[index].status != BatchJob.RUNNING:
+                self.queue.remove(index)
+                self.table.removeRow(index)
+
+    def start(self):
+        try:
+            concurrency = int(self.concurrency_input.text())
+            self.queue.retries = int(self.retries_input.text())
+        except ValueError:
+            QMessageBox.warning(self, '警告', '请检查并行数和重试次数！')
+            return
+        self.start_button.setEnabled(False)
+        self.queue.start(concurrency, os.path.join(self.output_input.text(), 'jobs.json'))
+        if not self.queue.running:
+            self.start_button.setEnabled(True)
+
+    def update_row(self, index):
+        job = self.queue.jobs[index]
+        values = [job.folder, job.pattern, job.recipe_name, job.status, str(job.frames) if job.frames else '',
+                  str(len(job.skipped)) if job.skipped else '',
+                  f'{job.seconds:.1f}' if job.seconds is not None else '', job.output]
+        for column, value in enumerate(values):
+            item = QTableWidgetItem(value)
+            if column == 3 and job.error:
+                item.setToolTip(job.error)
+            if column == 5 and job.skipped:
+                item.setToolTip('\n'.join(job.skipped))
+            self.table.setItem(index, column, item)
+
+    def closeEvent(self, event):
+        # 关闭窗口不中断正在运行的任务，只取消尚未开始的任务
+        if self.queue.running:
+            reply = QMessageBox.question(self, '确认', '队列仍在运行，是否取消尚未开始的任务？',
+                                         QMessageBox.Yes | QMessageBox.No)
+            if reply != QMessageBox.Yes:
+                event.ignore()
+                return
+            self.queue.cancel()
+        super().closeEvent(event)
+
 class FileExplorer(QWidget):
     def __init__(self, image_layout, parent=None):
         super().__init__(parent)
 
         # 创建QFileSystemModel和QTreeView对象
         self.model = QFileSystemModel()
-        self.model.setRootPath('')
         self.tree = QTreeView()
         self.tree.setModel(self.model)
         # self.tree.setRootIndex(self.model.index(QDir.currentPath()))
@@ -1994,24 +2991,33 @@ class FileExplorer(QWidget):
         self.tree.setHeaderHidden(True)
         self.tree.setSortingEnabled(False)
 
-        # 获取当前目录的QModelIndex对象
-        root_index = self.model.index(QDir.currentPath())
-
-        # 设置树视图的根项为当前目录
-        # self.tree.setRootIndex(root_index)
-
-        # 遍历从根目录到当前目录的所有路径并展开
-        index = root_index
-        while index.isValid():
-            self.tree.expand(index)
-            index = index.parent()
+        # 窗口显示之后再填充文件树，网络目录较慢时不阻塞启动
+        QTimer.singleShot(0, self.populate)
 
         # 创建一个QLabel对象显示文件路径
         self.file_path = QLabel()
+        self.file_path.setWordWrap(True)
+
+        # 当前文件夹的缩略图和头部统计信息，在后台线程池中生成并缓存到磁盘
+        self.thumbnail_check = QCheckBox('显示缩略图')
+        self.thumbnail_check.setChecked(True)
+        self.thumbnails = QListWidget()
+        self.thumbnails.setViewMode(QListView.IconMode)
+        self.thumbnails.setIconSize(QSize(96, 96))
+        self.thumbnails.setResizeMode(QListView.Adjust)
+        self.thumbnails.setMovement(QListView.Static)
+        self.thumbnails.setUniformItemSizes(True)
+        self.thumbnail_loader = ThumbnailLoader(parent=self)
+        self.thumbnail_items = {}
+        self.thumbnail_folder = None
 
         # 将QTreeView和QLabel添加到QWidget上
+        splitter = QSplitter(Qt.Vertical)
+        splitter.addWidget(self.tree)
+        splitter.addWidget(self.thumbnails)
         layout = QVBoxLayout()
-        layout.addWidget(self.tree)
+        layout.addWidget(splitter)
+        layout.addWidget(self.thumbnail_check)
         layout.addWidget(self.file_path)
         self.setLayout(layout)
 
@@ -2022,23 +3028,95 @@ class FileExplorer(QWidget):
         self.tree.selectionModel().selectionChanged.connect(self.on_selection_changed)
         # 连接QTreeView的双击信号和选择文件的槽函数
         self.tree.doubleClicked.connect(self.on_tree_double_clicked)
+        self.thumbnail_loader.ready.connect(self.on_thumbnail_ready)
+        self.thumbnails.itemClicked.connect(self.on_thumbnail_clicked)
+        self.thumbnails.itemDoubleClicked.connect(
+            lambda item: self.on_tree_double_clicked(self.model.index(item.data(Qt.UserRole))))
+        self.thumbnail_check.toggled.connect(self.on_thumbnail_toggled)
+
+    def populate(self):
+        # 只监视当前目录（不再以 '' 为根监视所有驱动器），目录内容由 QFileSystemModel 在后台线程读取
+        self.model.setRootPath(QDir.currentPath())
+        # 获取当前目录的QModelIndex对象
+        root_index = self.model.index(QDir.currentPath())
+
+        # 设置树视图的根项为当前目录
+        # self.tree.setRootIndex(root_index)
+
+        # 遍历从根目录到当前目录的所有路径并展开
+        index = root_index
+        while index.isValid():
+            self.tree.expand(index)
+            index = index.parent()
 
     def on_selection_changed(self):
         # 获取当前选中的文件路径并设置到QLabel上
         index = self.tree.currentIndex()
         file_path = self.model.filePath(index)
         self.file_path.setText(file_path)
+        if self.thumbnail_check.isChecked() and file_path:
+            self.show_thumbnails(file_path if self.model.isDir(index) else os.path.dirname(file_path))
         # 检查是否选中了一个文件并且文件的扩展名为.tif或.jpg
         # if not self.model.isDir(index) and file_path.lower().endswith(('.tif', '.jpg')):
         #     # 实例化 ImageLayout 类并调用 update_image() 方法
         #     image_layout = ImageLayout(file_name = file_path)
         #     image_layout.update_image()
 
+    def show_thumbnails(self, folder):
+        # 列出文件夹中所有可读取的帧文件，缩略图生成后逐个填入
+        if folder == self.thumbnail_folder:
+            return
+        self.thumbnail_loader.cancel()
+        self.thumbnails.clear()
+        self.thumbnail_items = {}
+        self.thumbnail_folder = folder
+        try:
+            names = sorted(entry.name for entry in os.scandir(folder)
+                           if entry.is_file() and entry.name.lower().endswith(tuple(FRAME_READERS)))
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(folder, name)
+            item = QListWidgetItem(name)
+            item.setData(Qt.UserRole, path)
+            self.thumbnails.addItem(item)
+            self.thumbnail_items[path] = item
+        self.thumbnail_loader.request(self.thumbnail_items)
+
+    def on_thumbnail_ready(self, ref, thumbnail, stats):
+        item = self.thumbnail_items.get(ref)
+        if item is None:
+            return
+        height, width = thumbnail.shape[:2]
+        rgb = np.ascontiguousarray(thumbnail[..., ::-1])
+        item.setIcon(QIcon(QPixmap.fromImage(QImage(rgb.data, width, height, 3 * width, QImage.Format_RGB888))))
+        item.setData(Qt.UserRole + 1, stats)
+        item.setToolTip(self.thumbnail_text(ref, stats))
+
+    def on_thumbnail_clicked(self, item):
+        self.file_path.setText(self.thumbnail_text(item.data(Qt.UserRole), item.data(Qt.UserRole + 1)))
+
+    @staticmethod
+    def thumbnail_text(path, stats):
+        if not stats:
+            return path
+        return f"{path}\nmax {stats['max']:.6g}  mean {stats['mean']:.6g}  饱和像素 {stats['saturated']}"
+
+    def on_thumbnail_toggled(self, checked):
+        self.thumbnails.setVisible(checked)
+        if checked:
+            self.on_selection_changed()
+        else:
+            self.thumbnail_loader.cancel()
+            self.thumbnails.clear()
+            self.thumbnail_items = {}
+            self.thumbnail_folder = None
+
     def on_tree_double_clicked(self, index):
         # 获取当前双击的文件路径
         file_path = self.model.filePath(index)
         # 检查是否选中了一个文件并且文件的扩展名为.tif或.jpg
-        if not self.model.isDir(index) and file_path.lower().endswith(('.tif', '.jpg' ,)):
+        if not self.model.isDir(index) and file_path.lower().endswith(tuple(FRAME_READERS)):
             self.image_layout.set_file_name(file_path)
             self.image_layout.update_image(file_path)
 
@@ -2220,7 +3298,7 @@ class BackgroundRemover:
             print("Duplicate x coordinates are not allowed.")
             return
 
-        interp_spline = make_interp_spline(x_bg, y_bg, k=2)
+        interp_spline = interpolate.make_interp_spline(x_bg, y_bg, k=2)
         xnew = np.linspace(self.x[0], self.x[-1], len(self.x))
         ynew = interp_spline(xnew)
         if hasattr(self, 'background_line'):
@@ -2273,12 +3351,3387 @@ class BackgroundRemover:
         x_bg = np.array(x_bg)
         y_bg = np.array(y_bg)
         self.x_bg = x_bg
-        interp_spline = make_interp_spline(x_bg, y_bg, k=2)
+        interp_spline = interpolate.make_interp_spline(x_bg, y_bg, k=2)
         xnew = np.linspace(self.x[0], self.x[-1], len(self.x))
         ynew = interp_spline(xnew)
         return xnew, ynew
 
+# ---------------------------------------------------------------------------
+# 帧读取：按扩展名注册的读取器，多帧容器中的单帧用 "文件路径::帧序号" 表示
+# ---------------------------------------------------------------------------
+
+FRAME_READERS = {}
+
+def register_frame_reader(*extensions):
+    # 类装饰器：将读取器实例注册到对应的扩展名
+    def decorator(cls):
+        reader = cls()
+        for ext in extensions:
+            FRAME_READERS[ext.lower()] = reader
+        return cls
+    return decorator
+
+def split_frame_ref(ref):
+    # "path::12" -> ("path", 12)；普通文件路径 -> (path, None)
+    path, sep, index = ref.rpartition('::')
+    if sep and index.isdigit():
+        return path, int(index)
+    return ref, None
+
+def make_frame_ref(path, index):
+    return f'{path}::{index}'
+
+def frame_stem(ref):
+    # 用于导出文件命名：多帧容器中的帧命名为 "文件名_00012"
+    path, index = split_frame_ref(ref)
+    stem = os.path.splitext(os.path.basename(path))[0]
+    if index is not None:
+        stem = f'{stem}_{index:05d}'
+    return stem
+
+@register_frame_reader('.tif', '.tiff', '.jpg', '.jpeg', '.png', '.bmp')
+class OpenCVFrameReader:
+    def frame_count(self, path):
+        return 1
+
+    def read(self, path, index=0):
+        im = cv2.imread(path, cv2.IMREAD_ANYDEPTH)
+        if im is None:
+            raise ValueError(f"无法读取图像文件: {path}")
+        return im
+
+@register_frame_reader('.edf')
+class EDFFrameReader:
+    """ESRF Data Format：ASCII 头（以 512 字节为单位）+ 原始数据，可连续存放多帧"""
+    DATA_TYPES = {
+        'unsignedbyte': 'u1', 'signedbyte': 'i1', 'unsignedshort': 'u2', 'signedshort': 'i2',
+        'unsignedinteger': 'u4', 'signedinteger': 'i4', 'unsignedlong': 'u4', 'signedlong': 'i4',
+        'unsigned64': 'u8', 'signed64': 'i8', 'floatvalue': 'f4', 'float': 'f4', 'realvalue': 'f4',
+        'doublevalue': 'f8', 'double': 'f8',
+    }
+
+    def __init__(self):
+        self._index = {}
+        self._lock = threading.Lock()
+
+    def _frames(self, path):
+        # 扫描文件中所有帧的 (数据偏移, 头信息)，按修改时间缓存
+        key = (path, os.path.getmtime(path))
+        with self._lock:
+            if key in self._index:
+                return self._index[key]
+        frames = []
+        with open(path, 'rb') as f:
+            while True:
+                start = f.tell()
+                chunk = f.read(512)
+                if not chunk:
+                    break
+                if not chunk.lstrip().startswith(b'{'):
+                    raise ValueError(f"不是有效的 EDF 文件: {path}")
+                header = chunk
+                while b'}' not in header:
+                    more = f.read(512)
+                    if not more:
+                        raise ValueError(f"EDF 头不完整: {path}")
+                    header += more
+                text = header[:header.index(b'}')].decode('latin-1')
+                items = dict((k.strip().lower(), v.strip()) for k, v in re.findall(r'([^=;{}\n]+)=([^;]*);', text))
+                data_offset = start + len(header)
+                size = int(items['size']) if 'size' in items else \
+                    int(items['dim_1']) * int(items['dim_2']) * np.dtype(self._dtype(items)).itemsize
+                frames.append((data_offset, items))
+                f.seek(data_offset + size)
+        with self._lock:
+            self._index[key] = frames
+        return frames
+
+    def _dtype(self, items):
+        dtype = np.dtype(self.DATA_TYPES.get(items.get('datatype', 'unsignedshort').lower(), 'u2'))
+        if items.get('byteorder', 'LowByteFirst').lower() == 'highbytefirst':
+            return dtype.newbyteorder('>')
+        return dtype.newbyteorder('<')
+
+    def frame_count(self, path):
+        return len(self._frames(path))
+
+    def read(self, path, index=0):
+        offset, items = self._frames(path)[index]
+        width, height = int(items['dim_1']), int(items['dim_2'])
+        dtype = self._dtype(items)
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            data = np.fromfile(f, dtype=dtype, count=width * height)
+        return data.reshape(height, width).astype(dtype.newbyteorder('='), copy=False)
+
+@register_frame_reader('.cbf')
+class CBFFrameReader:
+    """CBF 需要可选依赖 fabio 解压 byte-offset 数据"""
+    def _open(self, path):
+        try:
+            import fabio
+        except ImportError:
+            raise ValueError("读取 CBF 文件需要安装 fabio：pip install fabio")
+        return fabio.open(path)
+
+    def frame_count(self, path):
+        return self._open(path).nframes
+
+    def read(self, path, index=0):
+        image = self._open(path)
+        if index:
+            image = image.getframe(index)
+        return image.data
+
+@register_frame_reader('.h5', '.hdf5', '.nxs', '.hdf')
+class HDF5FrameReader:
+    """
+    HDF5 / NeXus 多帧容器（需要可选依赖 h5py）
+    优先使用 Eiger master 文件的 entry/data/data_xxxxxx（外部链接到数据文件），
+    其次是 NXdata 的 signal，最后是文件中第一个二维以上的数据集
+    """
+    def __init__(self):
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def _layout(self, path):
+        # 返回 (h5 文件, [(数据集, 帧数), ...])，打开的文件按路径和修改时间缓存
+        key = (path, os.path.getmtime(path))
+        with self._lock:
+            if key in self._files:
+                return self._files[key]
+            try:
+                import h5py
+            except ImportError:
+                raise ValueError("读取 HDF5/NeXus 文件需要安装 h5py：pip install h5py")
+            h5 = h5py.File(path, 'r')
+            datasets = self._find_datasets(h5, h5py)
+            if not datasets:
+                raise ValueError(f"文件中没有图像数据集: {path}")
+            layout = (h5, [(ds, ds.shape[0] if ds.ndim == 3 else 1) for ds in datasets])
+            self._files[key] = layout
+            return layout
+
+    @staticmethod
+    def _find_datasets(h5, h5py):
+        group = h5.get('entry/data')
+        if isinstance(group, h5py.Group):
+            datasets = []
+            for name in sorted(group):
+                try:
+                    ds = group[name]
+                except KeyError:
+                    # 外部链接指向的数据文件不存在
+                    continue
+                if isinstance(ds, h5py.Dataset) and ds.ndim in (2, 3):
+                    datasets.append(ds)
+            if datasets:
+                return datasets
+
+        found = []
+
+        def visit(name, obj):
+            if isinstance(obj, h5py.Group) and obj.attrs.get('NX_class') in (b'NXdata', 'NXdata'):
+                signal = obj.attrs.get('signal')
+                if isinstance(signal, bytes):
+                    signal = signal.decode()
+                if signal and signal in obj and obj[signal].ndim in (2, 3):
+                    found.insert(0, obj[signal])
+            elif isinstance(obj, h5py.Dataset) and obj.ndim in (2, 3):
+                found.append(obj)
+        h5.visititems(visit)
+        return found[:1]
+
+    def frame_count(self, path):
+        return sum(n for _, n in self._layout(path)[1])
+
+    def read(self, path, index=0):
+        _, datasets = self._layout(path)
+        for ds, n in datasets:
+            if index < n:
+                with self._lock:
+                    return ds[index] if ds.ndim == 3 else ds[()]
+            index -= n
+        raise IndexError(f"帧序号超出范围: {path}")
+
+FRAME_FILE_FILTER = ('Image Files (' + ' '.join('*' + ext for ext in FRAME_READERS) + ');;'
+                     'TIFF Files (*.tif *.tiff);;All Files (*)')
+
+def get_frame_reader(path):
+    # 未注册的扩展名交给 OpenCV 尝试
+    return FRAME_READERS.get(os.path.splitext(path)[1].lower(), FRAME_READERS['.tif'])
+
+def read_frame(ref):
+    path, index = split_frame_ref(ref)
+    return get_frame_reader(path).read(path, index or 0)
+
+def expand_frame_refs(paths):
+    # 将文件列表展开为逐帧引用，单帧文件保持原路径不变
+    refs = []
+    for path in paths:
+        reader = get_frame_reader(path)
+        count = reader.frame_count(path)
+        if count <= 1:
+            refs.append(path)
+        else:
+            refs.extend(make_frame_ref(path, i) for i in range(count))
+    return refs
+
+def frame_statistics(frame, saturation=None):
+    """
+    帧的头部统计信息：最大值、平均值和饱和像素数
+    :param saturation: 饱和阈值，为 None 时整数类型取该类型的最大值，浮点类型不统计饱和
+    """
+    if saturation is None and np.issubdtype(frame.dtype, np.integer):
+        saturation = np.iinfo(frame.dtype).max
+    saturated = int(np.count_nonzero(frame >= saturation)) if saturation is not None else 0
+    return {'max': float(frame.max()), 'mean': float(frame.mean()), 'saturated': saturated}
+
+def make_thumbnail(frame, size=128):
+    # 先用区域平均缩小，再按 1%~99.5% 分位数自动调整 Colorbar，映射为 Jet 颜色
+    height, width = frame.shape[:2]
+    scale = min(size / height, size / width, 1)
+    small = cv2.resize(frame.astype(np.float32), (max(int(width * scale), 1), max(int(height * scale), 1)),
+                       interpolation=cv2.INTER_AREA)
+    cb_min, cb_max = np.percentile(small, (1, 99.5))
+    return render_frame(small, cb_min, max(cb_max, cb_min + 1))
+
+class ThumbnailCache:
+    """
+    缩略图和头部统计信息的磁盘缓存，以 (文件路径, 修改时间, 尺寸) 为键，文件修改后自动失效
+    """
+    def __init__(self, folder=None, size=128):
+        self.folder = folder or os.path.join(os.path.expanduser('~'), '.cache', 'xray_insitu', 'thumbnails')
+        self.size = size
+
+    def _path(self, ref):
+        path, _ = split_frame_ref(ref)
+        key = f'{os.path.abspath(ref)}|{os.stat(path).st_mtime_ns}|{self.size}'
+        return os.path.join(self.folder, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.npz')
+
+    def get(self, ref):
+        # 返回 (缩略图, 统计信息)：命中缓存时直接读取，否则解码整帧后生成并写入缓存
+        cache_path = self._path(ref)
+        try:
+            with np.load(cache_path) as cached:
+                return cached['thumbnail'], json.loads(str(cached['stats']))
+        except (OSError, KeyError, ValueError):
+            pass
+        frame = read_frame(ref)
+        thumbnail, stats = make_thumbnail(frame, self.size), frame_statistics(frame)
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            # 先写临时文件再改名，避免多个线程或进程读到写了一半的文件
+            temp_path = f'{cache_path}.{threading.get_ident()}.tmp.npz'
+            np.savez(temp_path, thumbnail=thumbnail, stats=json.dumps(stats))
+            os.replace(temp_path, cache_path)
+        except OSError:
+            pass
+        return thumbnail, stats
+
+class ThumbnailLoader(QObject):
+    """
+    在线程池中生成缩略图，完成后通过 ready 信号在主线程中返回 (ref, 缩略图, 统计信息)
+    切换文件夹时调用 cancel() 取消尚未开始的任务
+    """
+    ready = pyqtSignal(str, object, dict)
+
+    def __init__(self, cache=None, workers=None, parent=None):
+        super().__init__(parent)
+        self.cache = cache or ThumbnailCache()
+        self._executor = ThreadPoolExecutor(max_workers=workers or min(4, os.cpu_count() or 1),
+                                            thread_name_prefix='thumbnail')
+        self._futures = []
+        self._generation = 0
+
+    def request(self, refs):
+        generation = self._generation
+        self._futures.extend(self._executor.submit(self._load, ref, generation) for ref in refs)
+
+    def cancel(self):
+        self._generation += 1
+        for future in self._futures:
+            future.cancel()
+        self._futures = []
+
+    def shutdown(self):
+        self.cancel()
+        self._executor.shutdown(wait=False)
+
+    def _load(self, ref, generation):
+        if generation != self._generation:
+            return
+        try:
+            thumbnail, stats = self.cache.get(ref)
+        except Exception:
+            # 无法读取的文件不显示缩略图
+            return
+        if generation == self._generation:
+            self.ready.emit(ref, thumbnail, stats)
+
+class FrameScrubber(QObject):
+    """
+    序列逐帧浏览：后台线程预读并渲染当前帧前后若干帧，渲染好的图像放入有容量上限的缓冲区，
+    拖动滑块或播放时直接显示；显示参数（Colorbar、阈值、翻转、窗口大小、校正）改变后缓冲区失效
+    仅原图模式预渲染，切图和一维模式逐帧同步计算
+    """
+    rendered = pyqtSignal(int, object, object, object)
+
+    def __init__(self, image_widget, capacity=32, ahead=12, behind=4, workers=None):
+        super().__init__(image_widget)
+        self.image_widget = image_widget
+        self.capacity = capacity
+        self.ahead = ahead
+        self.behind = behind
+        self.refs = []
+        self.index = 0
+        self.key = None
+        # 每次更换序列加一并计入 key，旧序列尚未返回的渲染结果因此被丢弃
+        self.generation = 0
+        self.buffer = OrderedDict()
+        # 当前 key 下读取或渲染失败的帧，不再重复提交，播放时直接跳过
+        self.failed = set()
+        self._pending = {}
+        self._executor = ThreadPoolExecutor(max_workers=workers or min(4, os.cpu_count() or 1),
+                                            thread_name_prefix='frame-scrubber')
+        # 每个渲染线程复用自己的显示缓冲区
+        self._local = threading.local()
+        self.rendered.connect(self._on_rendered)
+
+    def set_refs(self, refs):
+        self.refs = list(refs)
+        self.generation += 1
+        self.key = None
+        self._reset()
+
+    def ready(self, index):
+        # 已渲染或已确定无法渲染；播放时遇到失败的帧不再等待
+        return index in self.buffer or index in self.failed
+
+    def seek(self, index):
+        if not self.refs:
+            return
+        self.index = index = min(max(index, 0), len(self.refs) - 1)
+        widget = self.image_widget
+        if not widget.image_layout.rb1.isChecked():
+            # 切图模式无法预渲染，直接计算当前帧
+            self._reset()
+            widget.image_layout.set_file_name(self.refs[index])
+            widget.image_layout.update_image(self.refs[index])
+            return
+        view = widget.display_view()
+        key = (self.generation, view, widget.correction.version)
+        if key != self.key:
+            self.key = key
+            self._reset()
+        if index in self.buffer:
+            self.buffer.move_to_end(index)
+            shape, pixmap = self.buffer[index]
+            widget.show_rendered(self.refs[index], shape, pixmap)
+        self._schedule(view)
+
+    def shutdown(self):
+        self._reset()
+        self._executor.shutdown(wait=False)
+
+    def _reset(self):
+        for future in self._pending.values():
+            future.cancel()
+        self._pending = {}
+        self.buffer.clear()
+        self.failed.clear()
+
+    def _schedule(self, view):
+        # 当前帧优先，其次是后面 ahead 帧和前面 behind 帧；不在范围内的未开始任务取消
+        n = len(self.refs)
+        wanted = [self.index] + list(range(self.index + 1, min(self.index + self.ahead + 1, n))) + \
+            list(range(self.index - 1, max(self.index - self.behind - 1, -1), -1))
+        for index in list(self._pending):
+            if index not in wanted and self._pending[index].cancel():
+                del self._pending[index]
+        for index in wanted:
+            if index not in self.buffer and index not in self._pending and index not in self.failed:
+                self._pending[index] = self._executor.submit(self._render, index, self.refs[index], self.key, view)
+
+    def _render(self, index, ref, key, view):
+        try:
+            im = self.image_widget.load_frame(ref)
+            if getattr(self._local, 'display', None) is None:
+                self._local.display = DisplayBuffer()
+            # 缓冲区会被下一帧覆盖，缓存的图像需要复制一份
+            image = self.image_widget.render_display(im, view, self._local.display).copy()
+        except Exception:
+            image, im = None, None
+        self.rendered.emit(index, key, None if im is None else im.shape, image)
+
+    def _on_rendered(self, index, key, shape, image):
+        if key != self.key:
+            return
+        self._pending.pop(index, None)
+        if image is None:
+            self.failed.add(index)
+            return
+        self.buffer[index] = (shape, QPixmap.fromImage(image))
+        # 超出容量时丢弃离当前帧最远的图像
+        while len(self.buffer) > self.capacity:
+            del self.buffer[max(self.buffer, key=lambda i: abs(i - self.index))]
+        if index == self.index:
+            self.image_widget.show_rendered(self.refs[index], shape, self.buffer[index][1])
+
+class FramePrefetcher:
+    """
+    多线程预读：线程池在后台解码之后的 read_ahead 帧，按原顺序逐帧返回 (ref, frame)
+    预读队列有上限，内存占用不超过 read_ahead 帧；提前退出循环时取消未开始的读取
+    """
+    def __init__(self, refs, loader=read_frame, read_ahead=None, workers=None):
+        self.refs = list(refs)
+        self.loader = loader
+        # 读取多为 I/O 等待，线程数略多于 CPU 核数
+        self.workers = workers or min(8, (os.cpu_count() or 1) + 2)
+        self.read_ahead = read_ahead or 2 * self.workers
+        self._executor = None
+        self._pending = deque()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return len(self.refs)
+
+    def __iter__(self):
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='frame-reader')
+        refs = iter(self.refs)
+        try:
+            for ref in itertools.islice(refs, self.read_ahead):
+                self._pending.append((ref, self._executor.submit(self.loader, ref)))
+            while self._pending:
+                ref, future = self._pending.popleft()
+                frame = future.result()
+                for next_ref in itertools.islice(refs, 1):
+                    self._pending.append((next_ref, self._executor.submit(self.loader, next_ref)))
+                yield ref, frame
+        finally:
+            self.close()
+
+    def close(self):
+        for _, future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+class StageTimer:
+    """
+    分环节计时：记录每次调用的耗时（不含嵌套在其中的子环节）和计数，批量处理结束后汇总吞吐量、分位数和最耗时的环节
+    预读线程中的环节同样记录，标记为后台环节；enabled 为 False 时不记录
+    """
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.samples = {}
+        self.counters = {}
+        self.background = set()
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+        # 每个线程一个嵌套栈，子环节的耗时从外层环节中扣除
+        stack = self._local.__dict__.setdefault('stack', [])
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            nested = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            self.add(name, elapsed - nested)
+
+    def add(self, name, seconds):
+        with self._lock:
+            self.samples.setdefault(name, []).append(seconds)
+            if threading.current_thread() is not threading.main_thread():
+                self.background.add(name)
+
+    def count(self, name, n=1):
+        if self.enabled:
+            with self._lock:
+                self.counters[name] = self.counters.get(name, 0) + n
+
+    def timed(self, name, iterable):
+        # 对迭代器的每次 next() 计时，用于统计主循环等待预读帧的时间
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def summary(self):
+        wall = time.perf_counter() - self.started
+        frames = self.counters.get('frames', 0)
+        stages = {}
+        for name, samples in self.samples.items():
+            samples = np.array(samples)
+            stages[name] = {
+                'count': len(samples),
+                'total': float(samples.sum()),
+                'mean': float(samples.mean()),
+                'p50': float(np.percentile(samples, 50)),
+                'p95': float(np.percentile(samples, 95)),
+                'max': float(samples.max()),
+                'share': float(samples.sum() / wall) if wall > 0 else 0.0,
+                'background': name in self.background,
+            }
+        dominant = max(stages, key=lambda name: stages[name]['total']) if stages else None
+        return {'frames': frames, 'wall': wall, 'fps': frames / wall if wall > 0 else 0.0,
+                'dominant': dominant, 'stages': stages, 'counters': dict(self.counters)}
+
+    def report(self):
+        summary = self.summary()
+        lines = [f"{summary['frames']} 帧，用时 {summary['wall']:.2f} s，{summary['fps']:.2f} 帧/秒，"
+                 f"主要耗时：{summary['dominant']}",
+                 f"{'stage':<12}{'count':>7}{'total s':>10}{'share':>8}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}"]
+        for name, st in sorted(summary['stages'].items(), key=lambda item: -item[1]['total']):
+            label = name + ('*' if st['background'] else '')
+            lines.append(f"{label:<12}{st['count']:>7}{st['total']:>10.3f}{st['share']:>8.1%}"
+                         f"{st['mean'] * 1e3:>10.2f}{st['p50'] * 1e3:>10.2f}{st['p95'] * 1e3:>10.2f}")
+        if summary['stages'] and any(st['background'] for st in summary['stages'].values()):
+            lines.append('* 在预读线程中并行执行，占比可超过 100%')
+        return '\n'.join(lines)
+
+@contextmanager
+def profiling(path):
+    """
+    采集性能分析数据：安装了 pyinstrument 时保存 HTML 报告，否则用 cProfile 保存 .prof 文件并打印累计耗时最多的函数
+    :param path: 不含扩展名的输出路径
+    """
+    try:
+        from pyinstrument import Profiler
+    except ImportError:
+        Profiler = None
+    if Profiler is not None:
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            with open(path + '.html', 'w', encoding='utf-8') as f:
+                f.write(profiler.output_html())
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path + '.prof')
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(20)
+
+class RenderScheduler(QObject):
+    """
+    参数修改后的重绘调度：合并短时间内的多次修改，只在最后一次修改后重绘一次，
+    并按修改影响的环节决定是否需要重绘当前视图
+    COLORMAP：Colorbar、翻转、阈值掩码等只影响显示的参数；GEOMETRY：圆心、距离、像素尺寸等，影响切图；
+    INTEGRATION：扇形区域、bin 数、强度校正等，只影响一维积分
+    """
+    COLORMAP = 1
+    GEOMETRY = 2
+    INTEGRATION = 4
+    ALL = COLORMAP | GEOMETRY | INTEGRATION
+
+    def __init__(self, image_widget, delay=150):
+        super().__init__(image_widget)
+        self.image_widget = image_widget
+        self.pending = 0
+        self._rendering = False
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(delay)
+        self._timer.timeout.connect(self.flush)
+
+    def watch(self, widget, stages, callback=None):
+        """
+        把控件的修改接入调度：文本框在 editingFinished 且用户编辑过内容时（Tab 切换焦点不算），
+        复选框在切换时，先调用 callback 更新参数，再标记 stages 需要重绘
+        """
+        if isinstance(widget, QLineEdit):
+            def on_edited():
+                # 用 Qt 的 modified 标记判断：只有用户编辑会置位，程序 setText（标定、导入配方等）会清除，
+                # 不会像缓存上次文本那样在程序修改后把用户改回原值的编辑当作未改变
+                if not widget.isModified():
+                    return
+                widget.setModified(False)
+                if callback is not None:
+                    callback()
+                self.invalidate(stages)
+            widget.editingFinished.connect(on_edited)
+        else:
+            def on_toggled():
+                if callback is not None:
+                    callback()
+                self.invalidate(stages)
+            widget.toggled.connect(on_toggled)
+
+    def invalidate(self, stages, immediate=False):
+        # 重新计时：新的修改会取代尚未执行的重绘
+        self.pending |= stages
+        if immediate:
+            self.flush()
+        else:
+            self._timer.start()
+
+    def flush(self):
+        self._timer.stop()
+        if self._rendering:
+            # 重绘过程中处理事件时又有修改，等本次重绘结束后再执行
+            self._timer.start()
+            return
+        stages, self.pending = self.pending, 0
+        widget = self.image_widget
+        # 批量处理期间由批量处理流程负责重绘
+        if not stages or not widget.file_name or widget.image_layout.insitustate == 1:
+            return
+        self._rendering = True
+        try:
+            if widget.windowstate == 3:
+                if stages & (self.GEOMETRY | self.INTEGRATION):
+                    widget.calculate_integral()
+            elif widget.image_layout.rb1.isChecked():
+                if stages & self.COLORMAP:
+                    widget.update_image()
+            elif widget.image_layout.rb2.isChecked():
+                if stages & (self.COLORMAP | self.GEOMETRY):
+                    widget.Cut()
+        finally:
+            self._rendering = False
+
+# 数值类型策略：坐标图、积分查找表权重和中间帧（校正后、合并后的帧）使用 WORK_DTYPE，
+# 整数帧不校正时保持原始类型；只在累加时（积分的 bincount、多帧求和）使用 ACCUM_DTYPE
+WORK_DTYPE = np.float32
+ACCUM_DTYPE = np.float64
+
+def bin_frame(frame, binning):
+    """
+    像素合并：binning × binning 个像素求和为一个像素
+    不能整除时裁掉原图最上方的行和最右侧的列，使翻转后的积分坐标原点保持不变
+    """
+    if binning <= 1:
+        return frame
+    height, width = frame.shape[:2]
+    frame = frame[height % binning:, :width - width % binning]
+    h, w = frame.shape[0] // binning, frame.shape[1] // binning
+    # 16 位整数帧合并后用 32 位整数即可容纳，不必升到 64 位
+    dtype = np.dtype(f'{frame.dtype.kind}4') if frame.dtype.kind in 'ui' and frame.dtype.itemsize <= 2 else None
+    return frame.reshape(h, binning, w, binning).sum(axis=(1, 3), dtype=dtype)
+
+class FrameReducer:
+    """
+    流式帧合并：积分之前对 (ref, frame) 流做像素合并，以及每 N 帧求和、每 N 帧平均或 N 帧滑动平均
+    只保留一个累加数组（滑动平均额外保留窗口内的 N 帧），不需要把整个原位序列读入内存
+    """
+    MODES = ('none', 'sum', 'mean', 'sliding')
+
+    def __init__(self, mode='none', group=1, binning=1):
+        if mode not in self.MODES:
+            raise ValueError(f"未知的帧合并方式: {mode}")
+        self.mode = mode
+        self.group = max(int(group), 1) if mode != 'none' else 1
+        self.binning = max(int(binning), 1)
+
+    @property
+    def active(self):
+        return self.group > 1 or self.binning > 1
+
+    @property
+    def value_scale(self):
+        # 合并后的像素值相当于多少张原始帧同一像素之和
+        scale = self.binning ** 2
+        if self.mode == 'sum':
+            scale *= self.group
+        return scale
+
+    def output_count(self, n):
+        if self.mode == 'sliding':
+            return max(n - self.group + 1, 0)
+        if self.mode == 'sum':
+            # 求和时丢弃最后不足 N 帧的一组，见 reduce
+            return n // self.group
+        return -(-n // self.group)
+
+    def input_range(self, first, last, n):
+        # 输出第 first~last-1 帧需要读取的原始帧范围 [begin, end)，用于把序列切成互不依赖的块
+        if self.mode == 'sliding':
+            return first, min(last + self.group - 1, n)
+        return first * self.group, min(last * self.group, n)
+
+    def label(self, refs):
+        # 合并帧的名称，例如 .../f0001-f0004_sum_bin2，用于导出文件命名
+        first, last = frame_stem(refs[0]), frame_stem(refs[-1])
+        name = first if len(refs) == 1 else f'{first}-{last}'
+        if self.group > 1:
+            name += '_' + self.mode
+        if self.binning > 1:
+            name += f'_bin{self.binning}'
+        return os.path.join(os.path.dirname(split_frame_ref(refs[0])[0]), name)
+
+    def reduce(self, frames):
+        if not self.active:
+            yield from frames
+            return
+        if self.mode == 'sliding':
+            yield from self._sliding(frames)
+            return
+
+        total, refs = None, []
+        for ref, frame in frames:
+            frame = bin_frame(frame, self.binning)
+            if total is None:
+                total = frame.astype(ACCUM_DTYPE)
+            else:
+                total += frame
+            refs.append(ref)
+            if len(refs) == self.group:
+                yield self._emit(refs, total)
+                total, refs = None, []
+        if refs and self.mode == 'mean':
+            # 最后不足 N 帧的一组：求平均时按实际帧数平均；
+            # 求和时直接丢弃，按比例补足会放大噪声，不补足则强度与阈值换算（value_scale）都与其它组不一致
+            yield self._emit(refs, total)
+
+    def _emit(self, refs, total):
+        # 累加用 ACCUM_DTYPE，输出的帧转为 WORK_DTYPE
+        if self.mode == 'mean':
+            return self.label(refs), np.true_divide(total, len(refs), dtype=WORK_DTYPE)
+        return self.label(refs), total.astype(WORK_DTYPE)
+
+    def _sliding(self, frames):
+        # 滑动窗口用累加和实现：每来一帧加上新帧、减去移出窗口的帧
+        window = deque()
+        total = None
+        for ref, frame in frames:
+            frame = bin_frame(frame, self.binning)
+            window.append((ref, frame))
+            if total is None:
+                total = frame.astype(ACCUM_DTYPE)
+            else:
+                total += frame
+            if len(window) > self.group:
+                _, old = window.popleft()
+                total -= old
+            if len(window) == self.group:
+                yield self.label([r for r, _ in window]), np.true_divide(total, self.group, dtype=WORK_DTYPE)
+
+def preview_order(n, count):
+    """
+    抽样预览的帧顺序：先是均匀分布在整个序列上的 count 帧，
+    之后按步长逐级减半的顺序补全其余帧，热图分辨率随之逐级提高
+    """
+    first = np.unique(np.linspace(0, n - 1, min(count, n)).round().astype(int))
+    order = [int(i) for i in first]
+    seen = set(order)
+    stride = max(int(np.ceil(n / max(len(first), 1))), 1)
+    while stride >= 1:
+        for i in range(0, n, stride):
+            if i not in seen:
+                seen.add(i)
+                order.append(i)
+        if stride == 1:
+            break
+        stride //= 2
+    return order
+
+class PreviewHeatmap:
+    """抽样预览热图：未积分的帧用最近的已积分帧填充显示"""
+    def __init__(self, n):
+        self.n = n
+        self.x = None
+        self.rows = {}
+        self.fig = None
+        self.mesh = None
+
+    def add(self, index, x, y):
+        if self.x is None:
+            self.x = x
+        self.rows[index] = y
+
+    def add_rows(self, items):
+        for index, x, y in items:
+            self.add(index, x, y)
+        self.draw()
+
+    def draw(self):
+        if not self.rows:
+            return
+        done = np.array(sorted(self.rows))
+        # 每一帧显示为最近的已积分帧
+        nearest = np.searchsorted((done[:-1] + done[1:]) / 2, np.arange(self.n))
+        matrix = np.array([self.rows[i] for i in done])[nearest]
+        if self.fig is None or not plt.fignum_exists(self.fig.number):
+            self.fig, ax = plt.subplots()
+            self.mesh = ax.imshow(matrix, aspect='auto', cmap='jet', origin='lower',
+                                  extent=[self.x.min(), self.x.max(), 1, self.n], interpolation='nearest')
+            self.fig.colorbar(self.mesh, ax=ax)
+            ax.set_ylabel('Frame')
+            self.fig.show()
+        else:
+            self.mesh.set_data(matrix)
+            self.mesh.autoscale()
+        self.fig.axes[0].set_title(f'Preview {len(done)}/{self.n} frames')
+        self.fig.canvas.draw_idle()
+
+class PreviewRefiner(QThread):
+    """后台细化抽样预览：按给定顺序积分剩余帧，每隔一段时间把新结果批量发回界面线程"""
+    results = pyqtSignal(list)
+
+    def __init__(self, refs, settings, loader, interval=0.5):
+        super().__init__()
+        self.refs = refs
+        self.settings = settings
+        self.loader = loader
+        self.interval = interval
+
+    def run(self):
+        pending = []
+        last = time.perf_counter()
+        indices = [i for i, _ in self.refs]
+        with FramePrefetcher([ref for _, ref in self.refs], self.loader) as frames:
+            for index, (_, frame) in zip(indices, frames):
+                if self.isInterruptionRequested():
+                    break
+                if frame is None:
+                    continue
+                try:
+                    x, y = self.settings.integrate(frame, smooth=False)
+                except Exception:
+                    # QThread.run 中未捕获的异常会使程序退出，任何原因积分失败的帧都在热图中留空
+                    continue
+                pending.append((index, x, y))
+                if time.perf_counter() - last > self.interval:
+                    self.emit(pending)
+                    pending = []
+                    last = time.perf_counter()
+        if pending:
+            self.emit(pending)
+
+    def emit(self, pending):
+        # 每批结果一次性平滑后发回
+        smoothed = self.settings.smooth(np.array([y for _, _, y in pending]))
+        self.results.emit([(index, x, y) for (index, x, _), y in zip(pending, smoothed)])
+
+class ExportThread(QThread):
+    """后台导出：依次执行写文件任务（返回导出文件列表的函数），写几千个文件时界面仍可操作"""
+    exported = pyqtSignal(list)
+    failed = pyqtSignal(str)
+
+    def __init__(self, jobs):
+        super().__init__()
+        self.jobs = jobs
+
+    def run(self):
+        files = []
+        try:
+            for job in self.jobs:
+                files += job()
+        except Exception as e:
+            # QThread.run 中未捕获的异常会使程序退出，任何错误都转为 failed 信号交给界面提示
+            self.failed.emit(f'{type(e).__name__}: {e}')
+            return
+        self.exported.emit(files)
+
+class DetectorCorrection:
+    """
+    探测器校正：暗场扣除、平场归一化和静态坏点/gap 掩码
+    三者在加载时融合成 gain/offset 两个数组，逐帧只需一次 im * gain + offset
+    """
+    def __init__(self):
+        self.dark = None
+        self.flat = None
+        self.mask = None  # True 表示坏点或 gap
+        self.dark_file = None
+        self.flat_file = None
+        self.mask_file = None
+
+        # 融合后的校正数组
+        self.gain = None
+        self.offset = None
+        self.bad_pixels = None
+        self.valid_pixels = None
+        self._binned_mask = None
+        # 每次校正改变时加一，用于使积分查找表缓存失效
+        self.version = 0
+
+    @staticmethod
+    def _read(file_name):
+        try:
+            return read_frame(file_name)
+        except (OSError, ValueError) as e:
+            raise ValueError(f"无法读取校正文件: {file_name}") from e
+
+    def _install(self, **values):
+        # 替换数组后重新融合；尺寸不一致时恢复原来的数组和文件名再抛出，已加载的校正保持可用
+        previous = {key: getattr(self, key) for key in values}
+        for key, value in values.items():
+            setattr(self, key, value)
+        try:
+            self.update()
+        except ValueError:
+            for key, value in previous.items():
+                setattr(self, key, value)
+            raise
+
+    def load_dark(self, file_name):
+        self._install(dark=self._read(file_name).astype(np.float32), dark_file=file_name)
+
+    def load_flat(self, file_name):
+        self._install(flat=self._read(file_name).astype(np.float32), flat_file=file_name)
+
+    def load_mask(self, file_name):
+        # 掩码文件中非零像素视为坏点
+        self._install(mask=self._read(file_name) != 0, mask_file=file_name)
+
+    def add_mask_region(self, region):
+        # 在现有掩码上叠加一块区域（例如在图像上绘制的多边形）
+        region = np.asarray(region, dtype=bool)
+        if self.mask is not None and self.mask.shape != region.shape:
+            raise ValueError("绘制的掩码区域与现有掩码的尺寸不一致")
+        self._install(mask=region.copy() if self.mask is None else self.mask | region)
+
+    def clear(self):
+        self.dark = self.flat = self.mask = None
+        self.dark_file = self.flat_file = self.mask_file = None
+        self.update()
+
+    @property
+    def active(self):
+        return self.gain is not None
+
+    def update(self):
+        arrays = [a for a in (self.dark, self.flat, self.mask) if a is not None]
+        if not arrays:
+            self.gain = self.offset = self.bad_pixels = self.valid_pixels = self._binned_mask = None
+            self.version += 1
+            return
+        shape = arrays[0].shape
+        if any(a.shape != shape for a in arrays):
+            raise ValueError("暗场、平场和掩码的尺寸不一致")
+
+        gain = np.ones(shape, dtype=np.float32)
+        bad = np.zeros(shape, dtype=bool)
+        if self.mask is not None:
+            bad |= self.mask
+        if self.flat is not None:
+            # 平场归一化到有效像素的平均值，平场为零的像素同样视为坏点
+            bad |= ~(self.flat > 0)
+            norm = self.flat[~bad].mean() if (~bad).any() else 1.0
+            np.divide(norm, self.flat, out=gain, where=~bad)
+        gain[bad] = 0
+
+        self.gain = gain
+        self.offset = -self.dark * gain if self.dark is not None else None
+        self.bad_pixels = bad if bad.any() else None
+        self.valid_pixels = ~bad if bad.any() else None
+        self._binned_mask = None
+        self.version += 1
+
+    def mask_for(self, shape):
+        # 返回指定尺寸下的坏点掩码；像素合并后的尺寸中，只要包含一个坏点就整体掩盖
+        if self.bad_pixels is None:
+            return None
+        shape = tuple(shape[:2])
+        if shape == self.bad_pixels.shape:
+            return self.bad_pixels
+        binning = self.bad_pixels.shape[1] // shape[1]
+        if binning < 2 or self.bad_pixels.shape[0] // binning != shape[0]:
+            raise ValueError(f"图像尺寸 {shape} 与掩码尺寸 {self.bad_pixels.shape} 不一致")
+        if self._binned_mask is None or self._binned_mask.shape != shape:
+            self._binned_mask = bin_frame(self.bad_pixels, binning).astype(bool)
+        return self._binned_mask
+
+    def apply(self, im):
+        if im is None or self.gain is None:
+            return im
+        if im.shape != self.gain.shape:
+            raise ValueError(f"图像尺寸 {im.shape} 与校正文件尺寸 {self.gain.shape} 不一致")
+        out = np.multiply(im, self.gain, dtype=WORK_DTYPE)
+        if self.offset is not None:
+            out += self.offset
+        return out
+
+class DetectorGeometry:
+    """
+    探测器几何：圆心（pixel，积分所用的翻转后图像坐标，即入射光与探测器的交点）、样品到圆心的距离（mm）、
+    像素尺寸（um）、波长（埃），以及探测器倾斜角和倾斜面的方位角（度）
+    """
+    def __init__(self, x_center, y_center, distance=300, pixel_x=73.2, pixel_y=73.2, lamda=1.24, tilt=0, rotation=0):
+        self.x_center = float(x_center)
+        self.y_center = float(y_center)
+        self.distance = float(distance)
+        self.pixel_x = float(pixel_x)
+        self.pixel_y = float(pixel_y)
+        self.lamda = float(lamda)
+        self.tilt = float(tilt)
+        self.rotation = float(rotation)
+
+    @property
+    def center(self):
+        return self.x_center, self.y_center
+
+    @property
+    def radial_pixel(self):
+        # 径向坐标（等效半径）所用的像素尺寸（um）：矩形像素取几何平均
+        if self.pixel_x == self.pixel_y:
+            return self.pixel_x
+        return math.sqrt(self.pixel_x * self.pixel_y)
+
+    @property
+    def simple(self):
+        # 探测器垂直于入射光且像素为正方形时，等效半径就是像素距离
+        return not self.tilt and self.pixel_x == self.pixel_y
+
+    def copy(self, **changes):
+        params = dict(x_center=self.x_center, y_center=self.y_center, distance=self.distance,
+                      pixel_x=self.pixel_x, pixel_y=self.pixel_y, lamda=self.lamda, tilt=self.tilt,
+                      rotation=self.rotation)
+        params.update(changes)
+        return DetectorGeometry(**params)
+
+    def key(self):
+        return (self.x_center, self.y_center, self.distance, self.pixel_x, self.pixel_y, self.lamda,
+                self.tilt, self.rotation)
+
+    def map_key(self):
+        # 决定等效半径和方位角分布的参数；简单几何只与圆心有关
+        if self.simple:
+            return self.center
+        return (self.x_center, self.y_center, self.distance, self.pixel_x, self.pixel_y, self.tilt, self.rotation)
+
+    def pixel_offsets(self, shape):
+        # 各像素相对圆心的偏移（pixel），返回可广播的 (x, y)
+        height, width = shape
+        y, x = np.ogrid[:height, :width]
+        return x.astype(WORK_DTYPE) - self.x_center, y.astype(WORK_DTYPE) - self.y_center
+
+    def rotation_matrix(self):
+        # 探测器平面绕面内方位角为 rotation 的轴倾斜 tilt（Rodrigues 公式）
+        tilt, rotation = math.radians(self.tilt), math.radians(self.rotation)
+        axis_x, axis_y = math.cos(rotation), math.sin(rotation)
+        k = np.array([[0, 0, axis_y], [0, 0, -axis_x], [-axis_y, axis_x, 0]])
+        return np.eye(3) + math.sin(tilt) * k + (1 - math.cos(tilt)) * (k @ k)
+
+    def lab_positions(self, x, y):
+        # 像素偏移 -> 以样品为原点的实验室坐标（m），z 轴沿入射光
+        dx, dy = x * self.pixel_x * 1e-6, y * self.pixel_y * 1e-6
+        # 旋转矩阵转为与坐标相同的类型，float32 的坐标图不会被升为 float64
+        m = self.rotation_matrix().astype(np.result_type(dx, dy), copy=False)
+        return dx * m[0, 0] + dy * m[0, 1], dx * m[1, 0] + dy * m[1, 1], self.distance * 1e-3 + dx * m[2, 0] + dy * m[2, 1]
+
+    def two_theta(self, x, y):
+        # 由像素偏移计算散射角 2θ（弧度）
+        if not self.tilt:
+            # 探测器垂直于入射光
+            return np.arctan(np.hypot(x * self.pixel_x * 1e-6, y * self.pixel_y * 1e-6) / (self.distance * 1e-3))
+        px, py, pz = self.lab_positions(x, y)
+        return np.arctan2(np.hypot(px, py), pz)
+
+    def obliquity(self, x, y):
+        # 由像素偏移计算散射光与探测器平面法线夹角的余弦；探测器垂直于入射光时等于 cos(2θ)
+        if not self.tilt:
+            return np.cos(self.two_theta(x, y))
+        px, py, pz = self.lab_positions(x, y)
+        # 样品到探测器平面的垂直距离为 distance·m[2,2]，法线方向为旋转矩阵的第三列
+        normal = self.distance * 1e-3 * self.rotation_matrix()[2, 2]
+        return normal / np.sqrt(px ** 2 + py ** 2 + pz ** 2)
+
+    def polar_maps(self, shape):
+        """
+        各像素的等效半径和方位角 χ，构建积分查找表时计算一次
+        等效半径为同一 2θ 在垂直放置、像素尺寸为 radial_pixel 的探测器上对应的半径（pixel），
+        倾斜探测器上的椭圆衍射环因此落在同一个径向 bin 中
+        :return: (radius, chi)，chi 为弧度，可广播到 shape
+        """
+        x, y = self.pixel_offsets(shape)
+        if self.simple:
+            return np.hypot(x, y), np.arctan2(y, x)
+        px, py, pz = self.lab_positions(x, y)
+        radius = np.hypot(px, py) / pz * (self.distance * 1e3 / self.radial_pixel)
+        return radius, np.arctan2(py, px)
+
+class IntensityCorrection:
+    """
+    积分权重校正：立体角、偏振、洛伦兹以及探测器传感器的斜入射吸收
+    校正因子只依赖几何，在构建积分查找表时一次性并入每个像素的权重，逐帧没有额外开销
+    """
+    def __init__(self, solid_angle=False, polarization=None, lorentz=False, absorption=None):
+        self.solid_angle = solid_angle
+        # 偏振因子，-1~1，水平偏振的同步辐射光源一般取 0.95~0.99，None 表示不校正
+        self.polarization = polarization
+        self.lorentz = lorentz
+        # 探测器传感器的 μt（线吸收系数 × 厚度），None 表示不校正
+        self.absorption = absorption
+
+    @property
+    def active(self):
+        return bool(self.solid_angle or self.lorentz or self.polarization is not None or self.absorption is not None)
+
+    def key(self):
+        return (bool(self.solid_angle), self.polarization, bool(self.lorentz), self.absorption)
+
+    def weights(self, two_theta, chi, obliquity=None):
+        """
+        :param two_theta: 散射角 2θ（弧度）
+        :param chi: 方位角（弧度），0 为 x 轴正方向
+        :param obliquity: 散射光与探测器平面法线夹角 α 的余弦，None 时按探测器垂直于入射光取 cos(2θ)
+        :return: 与输入同形状的权重，即各校正因子的倒数之积
+        """
+        correction = np.ones(np.broadcast(two_theta, chi).shape, dtype=WORK_DTYPE)
+        cos_2theta = np.cos(two_theta)
+        cos_alpha = cos_2theta if obliquity is None else obliquity
+        if self.solid_angle:
+            # 像素所张立体角正比于 cosα / 距离²，样品到探测器平面的垂直距离固定，距离 ∝ 1/cosα，
+            # 因此正比于 cos^3(α)；探测器倾斜时 α 与 2θ 不同
+            correction *= cos_alpha ** 3
+        if self.polarization is not None:
+            sin2 = np.sin(two_theta) ** 2
+            correction *= 0.5 * (1 + cos_2theta ** 2 - self.polarization * np.cos(2 * chi) * sin2)
+        if self.lorentz:
+            # 粉末衍射的洛伦兹因子 1/(sinθ sin2θ)
+            theta = two_theta / 2
+            with np.errstate(divide='ignore'):
+                correction *= 1 / (np.sin(theta) * np.sin(two_theta))
+        if self.absorption is not None and self.absorption > 0:
+            # 斜入射时传感器内的光程变长，吸收效率相对正入射提高
+            mu_t = self.absorption
+            correction *= (1 - np.exp(-mu_t / cos_alpha)) / (1 - np.exp(-mu_t))
+        with np.errstate(divide='ignore'):
+            weights = 1 / correction
+        weights[~np.isfinite(weights)] = 0
+        return weights
+
+class IntegrationOperator:
+    """
+    扇形积分查找表 (LUT)
+    几何与扇形参数不变时只构建一次：保存扇形内有效像素的线性索引、径向和角向 bin 编号
+    以及强度校正权重，之后每帧只需一次 gather 和 bincount，被掩码的像素不进入查找表
+    """
+    def __init__(self, shape, geometry, start_angle, end_angle, inner_radius, outer_radius, num_bins, valid=None,
+                 corrections=None):
+        num_bins = int(num_bins)
+        self.shape = tuple(shape)
+        self.num_bins = num_bins
+        # 将角度转换为弧度
+        start_angle = math.radians(start_angle)
+        end_angle = math.radians(end_angle)
+
+        # 构造一个极坐标网格：倾斜探测器和矩形像素下为等效半径和实验室坐标系中的方位角
+        x, y = geometry.pixel_offsets(self.shape)
+        r, theta = geometry.polar_maps(self.shape)
+
+        # 确定扇形区域的布尔掩码；边界角度转为与方位角图相同的类型比较，
+        # 否则 float32 的 ±π 会落在 float64 的 ±π 之外
+        lower, upper = theta.dtype.type(start_angle), theta.dtype.type(end_angle)
+        mask = (r >= inner_radius) & (r <= outer_radius) & (theta >= lower) & (theta <= upper)
+        if start_angle >= end_angle:
+            mask = (r >= inner_radius) & (r <= outer_radius) & ((theta >= lower) | (theta <= upper))
+            # 跨越 ±180° 的扇形，将 -180° 一侧的方位角展开到 start_angle 之后
+            theta = np.where(theta < lower, theta + 2 * np.pi, theta)
+            end_angle = end_angle + 2 * np.pi
+        if valid is not None:
+            mask &= valid
+
+        self.pixels = np.flatnonzero(mask)
+        r = np.broadcast_to(r, self.shape).ravel()[self.pixels]
+        theta = np.broadcast_to(theta, self.shape).ravel()[self.pixels]
+
+        # 强度校正权重只在扇形内的像素上计算一次
+        self.weights = None
+        if corrections is not None and corrections.active:
+            px = np.broadcast_to(x, self.shape).ravel()[self.pixels]
+            py = np.broadcast_to(y, self.shape).ravel()[self.pixels]
+            self.weights = corrections.weights(geometry.two_theta(px, py), theta, geometry.obliquity(px, py))
+
+        # 与 np.histogram 一致：左闭右开，最后一个 bin 包含右端点
+        self.rbin_edges = np.linspace(inner_radius, outer_radius, num_bins + 1)
+        self.rbin_centers = 0.5 * (self.rbin_edges[1:] + self.rbin_edges[:-1])
+        self.rbin = np.clip(np.searchsorted(self.rbin_edges, r, side='right') - 1, 0, num_bins - 1)
+
+        self.thetabin_edges = np.linspace(start_angle, end_angle, num_bins + 1)
+        self.thetabin_centers_degrees = np.degrees(0.5 * (self.thetabin_edges[1:] + self.thetabin_edges[:-1]))
+        self.thetabin = np.clip(np.searchsorted(self.thetabin_edges, theta, side='right') - 1, 0, num_bins - 1)
+        # 各 bin 内的像素数，与帧无关
+        self.radial_counts = np.bincount(self.rbin, minlength=num_bins)
+        self.angular_counts = np.bincount(self.thetabin, minlength=num_bins)
+
+    def integrate(self, image, raw=None, threshold_min=None, threshold_max=None):
+        """
+        :param image: 参与积分的图像（与构建 LUT 时同一方向）
+        :param raw: 用于阈值判断的原始图像，为 None 时直接用 image
+        :return: (radial_profile, angular_profile)
+        """
+        # 取值和乘权重在帧本身的类型（一般为 float32）下进行，只在 bincount 累加前转为 ACCUM_DTYPE
+        values = np.take(image, self.pixels)
+        if self.weights is not None:
+            values = values * self.weights
+        if threshold_min is not None or threshold_max is not None:
+            ref = values if raw is None else np.take(raw, self.pixels)
+            keep = np.ones(len(values), dtype=bool)
+            if threshold_min is not None:
+                keep &= ref >= threshold_min
+            if threshold_max is not None:
+                keep &= ref <= threshold_max
+            values[~keep] = 0
+        values = values.astype(ACCUM_DTYPE, copy=False)
+
+        radial_profile = np.bincount(self.rbin, weights=values, minlength=self.num_bins)
+        radial_profile = radial_profile / np.diff(self.rbin_edges)
+        angular_profile = np.bincount(self.thetabin, weights=values, minlength=self.num_bins)
+        angular_profile = angular_profile / np.diff(self.thetabin_edges)
+        return radial_profile, angular_profile
+
+def flipped_valid_mask(correction, shape):
+    # 静态坏点掩码与图像同样上下翻转后交给积分查找表，被掩盖的像素不进入 LUT；返回 (有效像素或 None, 校正版本)
+    if correction is None:
+        return None, 0
+    valid = correction.mask_for(shape)
+    return (None if valid is None else ~valid[::-1]), correction.version
+
+# 2θ 横坐标默认的参考波长（埃），铜靶 Kα
+REFERENCE_WAVELENGTH = 1.54
+
+def integrate_sector(image, raw, geometry, start_angle, end_angle, inner_radius, outer_radius, num_bins,
+                     thresholds=(None, None), correction=None, intensity_correction=None, binning=1,
+                     reference_wavelength=REFERENCE_WAVELENGTH):
+    """
+    单帧扇形积分，界面和后台线程共用
+    :param image: 参与积分的图像（已上下翻转）
+    :param raw: 用于 Mask_min/Mask_max 判断的原始图像（已翻转）
+    :param geometry: DetectorGeometry，圆心为当前帧（可能经过像素合并）的像素坐标，像素尺寸为原始像素
+    :param binning: 像素合并倍数，inner_radius、outer_radius 已换算到合并后的像素
+    :param reference_wavelength: 换算 2θ 横坐标所用的波长（埃）
+    :return: IntegrationResult，径向坐标为原始像素单位
+    """
+    valid, version = flipped_valid_mask(correction, image.shape[:2])
+    # 查找表按合并后的像素尺寸构建；IntegrationResult 的径向坐标已换回原始像素，仍使用原始像素尺寸的几何，
+    # 否则 q、2θ、d 换算时合并倍数会被乘两次
+    operator_geometry = geometry
+    if binning > 1:
+        operator_geometry = geometry.copy(pixel_x=geometry.pixel_x * binning, pixel_y=geometry.pixel_y * binning)
+    operator = get_integration_operator(image.shape[:2], operator_geometry, start_angle, end_angle, inner_radius,
+                                        outer_radius, num_bins, valid, version, intensity_correction)
+    radial_profile, angular_profile = operator.integrate(image, raw, *thresholds)
+    # 径向坐标换回原始像素单位，后续 q、2θ 换算与是否合并无关；径向强度同样按原始像素宽度归一化
+    return IntegrationResult(geometry, operator.rbin_edges * binning, operator.rbin_centers * binning,
+                             radial_profile / binning, operator.radial_counts, operator.thetabin_edges,
+                             operator.thetabin_centers_degrees, angular_profile, operator.angular_counts,
+                             reference_wavelength)
+
+def render_frame(im, cb_min, cb_max, mask=None, flip=False, window_size=None):
+    """
+    原图显示：按 Colorbar 截断并规范化到 0~255，掩盖像素置零，缩放到窗口大小后映射为 Jet 颜色
+    :param window_size: (宽, 高)，为 None 时不缩放
+    :return: BGR 三通道 uint8 图像
+    """
+    img_norm = im.copy()
+    img_norm[img_norm > cb_max] = cb_max
+    img_norm[img_norm < cb_min] = cb_min
+    im_norm = cv2.normalize(img_norm, None, 0, 255, cv2.NORM_MINMAX, cv2.CV_8U)
+    if mask is not None:
+        im_norm[mask] = 0
+    if flip:
+        im_norm = cv2.flip(im_norm, 0)
+
+    if window_size is not None:
+        height, width = im_norm.shape
+        scale = min(window_size[1] / height, window_size[0] / width)
+        im_norm = cv2.resize(im_norm, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_NEAREST)
+    # 使用Jet颜色映射
+    return cv2.applyColorMap(im_norm, cv2.COLORMAP_JET)
+
+def display_size(shape, window_size):
+    # 与 render_frame 相同的缩放：保持宽高比放入窗口，返回 (宽, 高)
+    height, width = shape[:2]
+    if window_size is None:
+        return width, height
+    scale = min(window_size[1] / height, window_size[0] / width)
+    return max(int(width * scale), 1), max(int(height * scale), 1)
+
+class DisplayBuffer:
+    """
+    原图显示的持久缓冲区：numpy 数组与 Indexed8 格式的 QImage 共享内存，颜色表为 Jet
+    先按最近邻（与 cv2.INTER_NEAREST 相同的取样）从帧中取出窗口内要显示的像素，阈值、坏点和 Colorbar 映射
+    都只在这些像素上计算，结果直接写入共享缓冲区；修改参数或改变窗口大小后重绘不再分配整帧大小的数组，
+    缓冲区和中间数组只在窗口变大时重新分配
+    """
+    _colortable = None
+
+    def __init__(self):
+        # 按容量分配，行宽对齐到 4 字节（QImage 要求每行 32 位对齐）
+        self.data = np.zeros((0, 0), dtype=np.uint8)
+        self.image = None
+        self._index_key = None
+        self._index = None
+        self._scratch = {}
+        self._extrema = (None, 0, 0)
+
+    @classmethod
+    def colortable(cls):
+        # 与 cv2.COLORMAP_JET 相同的 256 色，掩盖像素（索引 0）显示为深蓝色
+        if cls._colortable is None:
+            bgr = cv2.applyColorMap(np.arange(256, dtype=np.uint8).reshape(1, 256), cv2.COLORMAP_JET)[0]
+            cls._colortable = [0xFF000000 | (int(r) << 16) | (int(g) << 8) | int(b) for b, g, r in bgr]
+        return cls._colortable
+
+    def _buffer(self, name, size, dtype):
+        # 按名称复用的一维中间数组，容量不足或类型变化时才重新分配
+        buffer = self._scratch.get(name)
+        if buffer is None or buffer.dtype != dtype or buffer.size < size:
+            buffer = np.empty(max(size, 0 if buffer is None else buffer.size), dtype=dtype)
+            self._scratch[name] = buffer
+        return buffer[:size]
+
+    def sample_index(self, shape, window_size, flip):
+        """
+        窗口中每个显示像素对应的原图线性索引，按 (帧尺寸, 窗口大小, 翻转) 缓存
+        取样与 cv2.resize 的 INTER_NEAREST 一致：源坐标为 floor(目标坐标 × 源尺寸 / 目标尺寸)
+        """
+        key = (tuple(shape[:2]), window_size, flip)
+        if key != self._index_key:
+            height, width = shape[:2]
+            out_width, out_height = display_size(shape, window_size)
+            rows = np.minimum(np.floor(np.arange(out_height) * (1. / (out_height / height))).astype(np.intp),
+                              height - 1)
+            cols = np.minimum(np.floor(np.arange(out_width) * (1. / (out_width / width))).astype(np.intp), width - 1)
+            if flip:
+                rows = height - 1 - rows
+            self._index = rows[:, None] * width + cols
+            self._index_key = key
+        return self._index
+
+    def render(self, im, cb_min, cb_max, thresholds=(None, None), bad_pixels=None, flip=False, window_size=None):
+        """
+        与 render_frame 的显示结果相同：按 Colorbar 截断并按截断后的最小、最大值映射到 0~255，
+        阈值外和坏点像素置零
+        :param thresholds: (最小值, 最大值)，小于最小值或不小于最大值的像素置零
+        :return: 共享缓冲区的 QImage，下次 render 时内容会被覆盖
+        """
+        index = self.sample_index(im.shape, window_size, flip)
+        out_height, out_width = index.shape
+        stride = (out_width + 3) // 4 * 4
+        if self.data.shape[0] < out_height or self.data.shape[1] < stride:
+            self.data = np.zeros((max(out_height, self.data.shape[0]), max(stride, self.data.shape[1])),
+                                 dtype=np.uint8)
+            self.image = None
+        target = self.data[:out_height, :out_width]
+
+        # 规范化范围：整帧截断后的最小、最大值（与 cv2.normalize 的 NORM_MINMAX 相同），同一帧只统计一次
+        if self._extrema[0] is not im:
+            self._extrema = (im, float(np.nanmin(im)), float(np.nanmax(im)))
+        lower, upper = max(self._extrema[1], cb_min), min(self._extrema[2], cb_max)
+        scale = 255 / (upper - lower) if upper - lower > np.finfo(np.float64).eps else 0.0
+
+        size = index.size
+        values = self._buffer('values', size, im.dtype).reshape(index.shape)
+        # mode='clip' 时 np.take 直接写入 out，不经过临时缓冲（索引本身不会越界）
+        np.take(im.reshape(-1), index, out=values, mode='clip')
+        scaled = self._buffer('scaled', size, np.float32).reshape(index.shape)
+        # 与 cv2 的 convertTo 相同，按 v × scale + shift 计算后四舍五入（偶数舍入）
+        np.multiply(values, np.float32(scale), out=scaled, casting='unsafe')
+        scaled += np.float32(-lower * scale)
+        np.clip(scaled, 0, 255, out=scaled)
+        np.rint(scaled, out=scaled)
+        np.copyto(target, scaled, casting='unsafe')
+
+        hidden = self._buffer('hidden', size, bool).reshape(index.shape)
+        hidden[...] = False
+        if thresholds[1] is not None:
+            np.greater_equal(values, thresholds[1], out=hidden)
+        if thresholds[0] is not None:
+            hidden |= values < thresholds[0]
+        if bad_pixels is not None:
+            hidden |= np.take(bad_pixels.reshape(-1), index, mode='clip')
+        target[hidden] = 0
+
+        if self.image is None or (self.image.width(), self.image.height()) != (out_width, out_height):
+            self.image = QImage(self.data.data, out_width, out_height, self.data.shape[1], QImage.Format_Indexed8)
+            self.image.setColorTable(self.colortable())
+        return self.image
+
+class PlotCanvas(QWidget):
+    """
+    嵌入主窗口的 matplotlib 画布（FigureCanvasQTAgg）及缩放、平移工具栏
+    一维曲线和二维倒易空间图都画在同一个 Figure 中，逐帧只用 set_data / set_array 原地更新数据，
+    不再保存 PNG 临时文件再读回；窗口大小改变时由画布自行重绘
+    """
+    # 导出图片的尺寸（英寸）和分辨率，与之前 plt.subplots 默认尺寸下 300 dpi 导出的图片相同
+    EXPORT_SIZE = (6.4, 4.8)
+    EXPORT_DPI = 300
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.figure = mfigure.Figure()
+        self.canvas = backend_qtagg.FigureCanvasQTAgg(self.figure)
+        self.canvas.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
+        self.toolbar = backend_qtagg.NavigationToolbar2QT(self.canvas, self)
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.toolbar)
+        layout.addWidget(self.canvas)
+        # 当前内容：'profile' 一维曲线，'map' 二维图
+        self.kind = None
+        self.ax = None
+        self.line = None
+        self.mesh = None
+        self.mesh_key = None
+
+    def reset(self, kind):
+        # 清空 Figure 和缩放记录，重新建立坐标轴
+        self.figure.clear()
+        self.ax = self.figure.add_subplot()
+        self.line = self.mesh = self.mesh_key = None
+        self.kind = kind
+        self.toolbar.update()
+
+    def plot_profile(self, x, y, log=False, xlabel='', ylabel='', title=''):
+        # 横坐标或纵坐标类型不变时保留用户的缩放范围，只更新曲线数据
+        if self.kind != 'profile':
+            self.reset('profile')
+        ax = self.ax
+        if self.line is None:
+            self.line, = ax.plot(x, y)
+        else:
+            self.line.set_data(x, y)
+        if ax.get_xlabel() != xlabel or (ax.get_yscale() == 'log') != log:
+            ax.set_yscale('log' if log else 'linear')
+            ax.set_autoscale_on(True)
+            self.toolbar.update()
+        ax.set_xlabel(xlabel)
+        ax.set_ylabel(ylabel)
+        ax.set_title(title)
+        ax.relim()
+        ax.autoscale_view()
+        self.canvas.draw_idle()
+
+    def plot_map(self, key, Qr, Qz, values, flip=False, limits=(None, None, None, None)):
+        """
+        二维倒易空间图
+        :param key: 决定网格坐标和显示范围的参数，不变时只用 set_array 更新颜色数据
+        :param limits: (Qr_min, Qr_max, Qz_min, Qz_max)，None 表示自动
+        """
+        if self.kind != 'map' or self.mesh_key != key:
+            self.reset('map')
+            ax = self.ax
+            self.mesh = ax.pcolormesh(Qr, Qz, values, cmap='jet', shading='auto')
+            self.figure.colorbar(self.mesh)
+            ax.set_xlabel('Qr')
+            ax.set_ylabel('Qz')
+            ax.set_aspect('equal')
+            if not flip:
+                ax.invert_yaxis()
+            ax.set_xlim(limits[0], limits[1])
+            ax.set_ylim(limits[2], limits[3])
+            self.mesh_key = key
+        else:
+            self.mesh.set_array(values)
+            self.mesh.autoscale()
+        self.canvas.draw_idle()
+
+    def export(self, path):
+        # 按固定尺寸和分辨率导出，与窗口大小无关
+        size = self.figure.get_size_inches()
+        self.figure.set_size_inches(*self.EXPORT_SIZE, forward=False)
+        try:
+            self.figure.savefig(path, dpi=self.EXPORT_DPI)
+        finally:
+            self.figure.set_size_inches(*size, forward=False)
+            self.canvas.draw_idle()
+
+def parse_frame_selection(text, count):
+    """
+    解析帧号选择，例如 "1-100, 200, 300-1000:10"（从 1 开始，可带步长），超出范围的帧忽略
+    :return: 从 0 开始的帧序号数组，升序且不重复
+    """
+    chunks = []
+    for part in re.split(r'[;；,，\s]+', text.strip()):
+        if not part:
+            continue
+        match = re.fullmatch(r'(\d+)(?:[-~](\d+))?(?::(\d+))?', part)
+        if match is None:
+            raise ValueError(f"无法解析帧号: {part}")
+        first = int(match.group(1))
+        last = int(match.group(2)) if match.group(2) else first
+        step = int(match.group(3)) if match.group(3) else 1
+        if step < 1:
+            raise ValueError(f"步长必须为正: {part}")
+        first, last = sorted((first, last))
+        chunks.append(np.arange(first - 1, last, step))
+    if not chunks:
+        return np.zeros(0, dtype=np.intp)
+    frames = np.unique(np.concatenate(chunks))
+    return frames[(frames >= 0) & (frames < count)]
+
+def decimate_curves(x, curves, columns):
+    """
+    按像素列抽稀曲线：每列只保留各曲线的最小值和最大值，画出的线与逐点绘制在像素上相同
+    点数不超过 2 × columns 时原样返回
+    :param x: 单调递增的横坐标
+    :param curves: (曲线数, 点数)，所有曲线一次处理
+    :return: (x, curves)
+    """
+    points = len(x)
+    if columns < 1 or points <= 2 * columns:
+        return x, curves
+    starts = np.unique(np.searchsorted(x, np.linspace(x[0], x[-1], columns + 1)[:-1]))
+    ends = np.append(starts[1:], points) - 1
+    lows = np.minimum.reduceat(curves, starts, axis=1)
+    highs = np.maximum.reduceat(curves, starts, axis=1)
+    return (np.column_stack([x[starts], x[ends]]).ravel(),
+            np.stack([lows, highs], axis=-1).reshape(len(curves), 2 * len(starts)))
+
+class OverlayView(QDialog):
+    """
+    批量结果的曲线叠加 / 瀑布图：从结果矩阵（第一列横坐标，之后每列一帧）中任选若干帧，
+    选中的曲线放在一个 LineCollection 中一次绘制，颜色表示帧序号；
+    长曲线按当前可见范围和画布宽度逐像素列抽稀，抽稀结果按帧缓存，添加、移除帧只处理变化的那些帧
+    """
+    MODES = ('overlay', 'waterfall')
+
+    def __init__(self, matrix, title='', parent=None):
+        super().__init__(parent)
+        self.setWindowTitle(f'曲线叠加 {title}'.strip())
+        x, curves = matrix[:, 0], matrix[:, 1:].T
+        if len(x) > 1 and x[0] > x[-1]:
+            # 抽稀要求横坐标递增（例如按 d 导出的结果）
+            x, curves = x[::-1], curves[:, ::-1]
+        self.x = np.ascontiguousarray(x)
+        self.curves = np.ascontiguousarray(curves)
+        self.selected = np.zeros(0, dtype=np.intp)
+        # 抽稀缓存：键为 (可见范围, 列数)，值为 {帧序号: 抽稀后的曲线}
+        self.cache_key = None
+        self.cache = {}
+        self.decimated_x = self.x
+        self.auto_offset = None
+        self._drawing = False
+
+        self.selection = QLineEdit()
+        self.selection.setPlaceholderText('帧号，如 1-100, 200, 300-1000:10')
+        self.add_button = QPushButton('添加')
+        self.remove_button = QPushButton('移除')
+        self.clear_button = QPushButton('清空')
+        self.mode = QComboBox()
+        self.mode.addItems(['叠加', '瀑布'])
+        self.offset = QLineEdit()
+        self.offset.setPlaceholderText('自动')
+        self.offset.setFixedWidth(80)
+        self.log_check = QCheckBox('Log')
+        self.count_label = QLabel()
+
+        self.plot = PlotCanvas(self)
+        self.plot.reset('overlay')
+        ax = self.plot.ax
+        self.collection = mcollections.LineCollection([], cmap='jet', linewidths=0.8,
+                                                      norm=mcolors.Normalize(1, max(len(self.curves), 2)))
+        ax.add_collection(self.collection)
+        self.plot.figure.colorbar(self.collection, ax=ax, label='Frame')
+        ax.set_xlabel('X')
+        ax.set_ylabel('Intensity')
+
+        controls = QHBoxLayout()
+        controls.addWidget(self.selection)
+        controls.addWidget(self.add_button)
+        controls.addWidget(self.remove_button)
+        controls.addWidget(self.clear_button)
+        controls.addWidget(self.mode)
+        controls.addWidget(QLabel('间隔:'))
+        controls.addWidget(self.offset)
+        controls.addWidget(self.log_check)
+        controls.addWidget(self.count_label)
+        layout = QVBoxLayout(self)
+        layout.addLayout(controls)
+        layout.addWidget(self.plot)
+        self.resize(900, 650)
+
+        # 缩放、平移和改变窗口大小后按新的可见范围重新抽稀，合并为一次重绘
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(30)
+        self.timer.timeout.connect(self.redraw)
+        ax.callbacks.connect('xlim_changed', lambda _: self.schedule())
+        self.plot.canvas.mpl_connect('resize_event', lambda _: self.schedule())
+        self.add_button.clicked.connect(lambda: self.change(add=True))
+        self.selection.returnPressed.connect(lambda: self.change(add=True))
+        self.remove_button.clicked.connect(lambda: self.change(add=False))
+        self.clear_button.clicked.connect(lambda: self.set_frames([]))
+        self.mode.currentIndexChanged.connect(lambda _: self.redraw(rescale=True))
+        self.offset.editingFinished.connect(lambda: self.redraw(rescale=True))
+        self.log_check.toggled.connect(lambda _: self.redraw(rescale=True))
+
+    def change(self, add):
+        try:
+            frames = parse_frame_selection(self.selection.text(), len(self.curves))
+        except ValueError as e:
+            QMessageBox.warning(self, '警告', str(e))
+            return
+        if add:
+            self.set_frames(np.union1d(self.selected, frames))
+        else:
+            self.set_frames(np.setdiff1d(self.selected, frames))
+
+    def set_frames(self, frames):
+        # frames 为从 0 开始的帧序号
+        self.selected = np.asarray(frames, dtype=np.intp)
+        for frame in set(self.cache) - set(self.selected.tolist()):
+            del self.cache[frame]
+        self.count_label.setText(f'{len(self.selected)} / {len(self.curves)} 帧')
+        self.redraw(rescale=True)
+
+    def schedule(self):
+        if not self._drawing:
+            self.timer.start()
+
+    def visible_range(self):
+        # 可见范围内的点的下标区间（两端各多取一点，保证曲线连到边界）
+        low, high = self.plot.ax.get_xlim()
+        low, high = min(low, high), max(low, high)
+        start = max(np.searchsorted(self.x, low) - 1, 0)
+        stop = min(np.searchsorted(self.x, high, side='right') + 1, len(self.x))
+        return start, stop
+
+    def decimated(self, rescale):
+        # 返回选中帧的抽稀曲线 (帧数, 点数)；可见范围和列数不变时只处理新加入的帧
+        start, stop = (0, len(self.x)) if rescale else self.visible_range()
+        columns = max(self.plot.canvas.width(), 1)
+        key = (start, stop, columns)
+        if key != self.cache_key:
+            self.cache_key, self.cache = key, {}
+        missing = [frame for frame in self.selected.tolist() if frame not in self.cache]
+        if missing:
+            x, rows = decimate_curves(self.x[start:stop], self.curves[missing, start:stop], columns)
+            self.cache.update(zip(missing, rows))
+            self.decimated_x = x
+        elif not self.cache:
+            self.decimated_x = decimate_curves(self.x[start:stop], self.curves[:0, start:stop], columns)[0]
+        return np.array([self.cache[frame] for frame in self.selected.tolist()]).reshape(
+            len(self.selected), len(self.decimated_x))
+
+    def offset_step(self):
+        # 瀑布图相邻曲线的间隔：未填写时取全部结果强度范围的 5%
+        try:
+            return float(self.offset.text())
+        except ValueError:
+            pass
+        if self.auto_offset is None:
+            low, high = np.nanmin(self.curves), np.nanmax(self.curves)
+            self.auto_offset = 0.05 * float(high - low) if np.isfinite(high - low) and high > low else 1.0
+        return self.auto_offset
+
+    def redraw(self, rescale=False):
+        """
+        :param rescale: 为 True 时在全部横坐标范围上抽稀并自动调整坐标范围（选中的帧或显示方式改变）
+        """
+        self._drawing = True
+        try:
+            ax = self.plot.ax
+            curves = self.decimated(rescale)
+            if self.MODES[self.mode.currentIndex()] == 'waterfall':
+                curves = curves + self.offset_step() * np.arange(len(curves))[:, None]
+            x = np.broadcast_to(self.decimated_x, curves.shape)
+            self.collection.set_segments(np.stack([x, curves], axis=-1))
+            self.collection.set_array(self.selected + 1.0)
+            if rescale:
+                ax.set_yscale('log' if self.log_check.isChecked() else 'linear')
+                if len(curves):
+                    finite = curves[np.isfinite(curves) & ((curves > 0) | (not self.log_check.isChecked()))]
+                    ax.set_xlim(self.x[0], self.x[-1])
+                    if finite.size:
+                        low, high = float(finite.min()), float(finite.max())
+                        margin = 0.05 * (high - low) if high > low else max(abs(high), 1.0) * 0.05
+                        ax.set_ylim(low - margin if not self.log_check.isChecked() else low / 1.2,
+                                    high + margin if not self.log_check.isChecked() else high * 1.2)
+                self.plot.toolbar.update()
+            self.plot.canvas.draw_idle()
+        finally:
+            self._drawing = False
+
+def subtract_background(x, y, x_bg):
+    # 取背景锚点 x_bg 处的曲线值做二次样条插值作为背景，返回扣除背景后的曲线
+    # y 可以是单条曲线或 (帧数, 点数) 的曲线堆栈，堆栈的全部曲线一次插值
+    # 搜索x_bg在x中对应的索引
+    idx = np.abs(x[None, :] - np.asarray(x_bg)[:, None]).argmin(axis=1)
+    # 使用样条插值
+    interp_spline = interpolate.make_interp_spline(x_bg, y[..., idx], k=2, axis=-1)
+    return y - interp_spline(x)
+
+class ProfileSmoother:
+    """
+    积分曲线的平滑，与积分分开：只对需要显示或导出为平滑曲线的结果调用，
+    输入可以是单条曲线或 (帧数, 点数) 的曲线堆栈，沿最后一维一次向量化处理
+    method：'none' 不平滑；'boxcar' 滑动平均（两端按 0 补齐，默认 5 点，与之前的固定平滑相同）；
+    'savgol' Savitzky–Golay（order 阶多项式）；'gaussian' 高斯，width 为半高宽
+    :param width: 窗口点数，boxcar 和 savgol 取不小于 width 的奇数
+    """
+    METHODS = ('none', 'boxcar', 'savgol', 'gaussian')
+    LABELS = ('不平滑', '滑动平均', 'Savitzky-Golay', '高斯')
+
+    def __init__(self, method='boxcar', width=5, order=2):
+        if method not in self.METHODS:
+            raise ValueError(f"未知的平滑方法: {method}")
+        self.method = method
+        self.width = max(float(width), 1.0)
+        self.order = int(order)
+
+    def __call__(self, profiles):
+        profiles = np.asarray(profiles)
+        points = profiles.shape[-1]
+        if self.method == 'none' or self.width < 2 or points < 2:
+            return profiles
+        if self.method == 'gaussian':
+            return ndimage.gaussian_filter1d(profiles, self.width / (2 * math.sqrt(2 * math.log(2))), axis=-1,
+                                             mode='nearest')
+        # 奇数窗口，不超过曲线长度
+        window = min(int(math.ceil(self.width)) // 2 * 2 + 1, (points - 1) // 2 * 2 + 1)
+        if self.method == 'boxcar':
+            return ndimage.convolve1d(profiles, np.full(window, 1 / window), axis=-1, mode='constant')
+        # Savitzky–Golay 的窗口必须大于多项式阶数
+        if window <= self.order:
+            return profiles
+        return signal.savgol_filter(profiles, window, self.order, axis=-1)
+
+# 径向积分横坐标下拉菜单的选项：(显示名称, 横坐标, 是否平滑)；新选项追加在末尾，配方中保存的序号不变
+PROFILE_AXES = (('q', 'q', True), ('2theta', '2theta', True), ('像素', 'pixel', True),
+                ('q(unsmoothed)', 'q', False), ('2theta(unsmoothed)', '2theta', False),
+                ('像素(unsmoothed)', 'pixel', False), ('d', 'd', True), ('d(unsmoothed)', 'd', False))
+
+class IntegrationResult:
+    """
+    一次扇形积分的结果：未平滑的径向、角向曲线，各 bin 的像素数和 bin 边界（径向为原始像素单位）
+    q、参考波长下的 2θ 和 d 只在第一次用到时计算并缓存，切换横坐标、平滑方式和纵坐标时直接取用，不需要重新积分
+    """
+    AXES = ('q', '2theta', 'pixel', 'd')
+
+    def __init__(self, geometry, rbin_edges, rbin_centers, radial_profile, radial_counts, thetabin_edges,
+                 thetabin_centers_degrees, angular_profile, angular_counts, reference_wavelength=REFERENCE_WAVELENGTH):
+        self.geometry = geometry
+        self.rbin_edges = rbin_edges
+        self.rbin_centers = rbin_centers
+        self.radial_profile = radial_profile
+        self.radial_counts = radial_counts
+        self.thetabin_edges = thetabin_edges
+        self.thetabin_centers_degrees = thetabin_centers_degrees
+        self.angular_profile = angular_profile
+        self.angular_counts = angular_counts
+        self.reference_wavelength = float(reference_wavelength)
+        self._axes = {}
+
+    def set_reference_wavelength(self, wavelength):
+        # 只有 2θ 与参考波长有关
+        if float(wavelength) != self.reference_wavelength:
+            self.reference_wavelength = float(wavelength)
+            self._axes.pop('2theta', None)
+
+    def axis(self, name):
+        """
+        径向横坐标：'q'（埃^-1）、'2theta'（参考波长下的度）、'pixel'（原始像素）、'd'（埃）
+        """
+        if name not in self._axes:
+            geometry = self.geometry
+            if name == 'pixel':
+                values = self.rbin_centers
+            elif name == 'q':
+                theta = np.arctan(self.rbin_centers * geometry.radial_pixel * 1e-6 / (geometry.distance * 1e-3)) / 2
+                values = 4 * np.pi * np.sin(theta) / geometry.lamda
+            elif name == '2theta':
+                values = np.arcsin(self.axis('q') * self.reference_wavelength / 4 / np.pi) * 180 / np.pi * 2
+            elif name == 'd':
+                with np.errstate(divide='ignore'):
+                    values = 2 * np.pi / self.axis('q')
+            else:
+                raise ValueError(f"未知的横坐标: {name}")
+            self._axes[name] = values
+        return self._axes[name]
+
+    def errors(self, radial):
+        """
+        计数统计误差：曲线是每个 bin 的强度之和除以 bin 宽度，强度之和 I × 宽度 的泊松误差为 sqrt(I × 宽度)，再除以宽度
+        误差只取决于强度之和，与 bin 内的像素数无关，因此不用 radial_counts / angular_counts
+        （按像素数归一化得到的是每个像素平均值的误差，与曲线的归一化方式不同）；
+        强度之和不足 1 个计数的 bin 按 1 个计数计，避免空 bin 的误差为 0、在拟合中权重无穷大
+        """
+        if radial:
+            profile, widths = self.radial_profile, np.diff(self.rbin_edges)
+        else:
+            profile, widths = self.angular_profile, np.diff(self.thetabin_edges)
+        return np.sqrt(np.maximum(np.abs(profile) * widths, 1.0)) / widths
+
+    def select(self, index, radial):
+        # 按横坐标下拉菜单的选项返回未平滑的 (x, y)，是否需要平滑由 smoothed_option 判断
+        if radial:
+            return self.axis(PROFILE_AXES[index][1]), self.radial_profile
+        return self.thetabin_centers_degrees, self.angular_profile
+
+def smoothed_option(index, radial):
+    # 径向积分的 unsmoothed 选项不平滑，角向积分总是平滑
+    return not radial or PROFILE_AXES[index][2]
+
+def profile_axis(index, radial):
+    # 横坐标下拉菜单选项对应的横坐标名称，角向积分为 'chi'
+    return PROFILE_AXES[index][1] if radial else 'chi'
+
+class PipelineSettings:
+    """
+    积分流程参数的快照：从界面控件读取一次，之后可以在后台线程中对任意帧积分，不再访问控件
+    """
+    def __init__(self, geometry, start_angle, end_angle, inner_radius, outer_radius, num_bins,
+                 threshold_min, threshold_max, cb_min, cb_max, radial=True, axis_index=0,
+                 correction=None, intensity_correction=None, binning=1, value_scale=1, smoother=None,
+                 reference_wavelength=REFERENCE_WAVELENGTH):
+        self.geometry = geometry
+        self.start_angle = float(start_angle)
+        self.end_angle = float(end_angle)
+        self.inner_radius = float(inner_radius)
+        self.outer_radius = float(outer_radius)
+        self.num_bins = int(num_bins)
+        self.threshold_min = float(threshold_min)
+        self.threshold_max = float(threshold_max)
+        self.cb_min = float(cb_min)
+        self.cb_max = float(cb_max)
+        self.radial = radial
+        self.axis_index = axis_index
+        self.correction = correction
+        self.intensity_correction = intensity_correction
+        self.binning = binning
+        self.value_scale = value_scale
+        self.smoother = smoother if smoother is not None else ProfileSmoother()
+        self.reference_wavelength = float(reference_wavelength)
+
+    def integrate(self, im, smooth=True, errors=False):
+        """
+        :param im: 已校正（未翻转）的帧
+        :param smooth: 为 False 时返回未平滑的曲线，之后可对整个曲线堆栈调用 smooth 一次性平滑
+        :param errors: 为 True 时另外返回与界面导出相同的计数统计误差（IntegrationResult.errors），平滑方式与 y 相同
+        :return: 与 ImageWidget.calculate_integral 相同的 (x, y)，errors 为 True 时为 (x, y, 误差)
+        """
+        scale = self.value_scale
+        # 与界面一致：参与积分的图像先按 Colorbar 范围截断
+        image = np.clip(im, self.cb_min * scale, self.cb_max * scale)[::-1]
+        raw = im[::-1]
+        geometry = self.geometry
+        inner_radius, outer_radius = self.inner_radius, self.outer_radius
+        if self.binning > 1:
+            b = self.binning
+            geometry = geometry.copy(x_center=(geometry.x_center + 0.5) / b - 0.5,
+                                     y_center=(geometry.y_center + 0.5) / b - 0.5)
+            inner_radius, outer_radius = inner_radius / b, outer_radius / b
+        result = integrate_sector(
+            image, raw, geometry, self.start_angle, self.end_angle, inner_radius, outer_radius, self.num_bins,
+            (self.threshold_min * scale, self.threshold_max * scale), self.correction, self.intensity_correction,
+            self.binning, self.reference_wavelength)
+        x, y = result.select(self.axis_index, self.radial)
+        if not errors:
+            return x, self.smooth(y) if smooth else y
+        e = result.errors(self.radial)
+        return (x, self.smooth(y), self.smooth(e)) if smooth else (x, y, e)
+
+    def smooth(self, profiles):
+        # 按横坐标选项平滑单条曲线或 (帧数, 点数) 的曲线堆栈；unsmoothed 选项原样返回
+        return self.smoother(profiles) if smoothed_option(self.axis_index, self.radial) else profiles
+
+    def azimuthal_profiles(self, im, bands, chi_bins=360):
+        """
+        多个 q 环的方位角分布，用于取向分析；与积分扇形无关，也不按 Colorbar 截断，只排除阈值外和坏点像素
+        :param im: 已校正（未翻转）的帧
+        :param bands: [(q_min, q_max), ...]，埃^-1
+        :return: (χ bin 中心（度）, 形状为 (q 环数, chi_bins) 的 I(χ))
+        """
+        scale = self.value_scale
+        raw = im[::-1]
+        geometry = self.geometry
+        if self.binning > 1:
+            b = self.binning
+            geometry = geometry.copy(x_center=(geometry.x_center + 0.5) / b - 0.5,
+                                     y_center=(geometry.y_center + 0.5) / b - 0.5,
+                                     pixel_x=geometry.pixel_x * b, pixel_y=geometry.pixel_y * b)
+        valid, version = flipped_valid_mask(self.correction, raw.shape[:2])
+        operator = get_azimuthal_operator(raw.shape[:2], geometry, bands, chi_bins, valid, version,
+                                          self.intensity_correction)
+        return operator.chi, operator.profiles(raw, self.threshold_min * scale, self.threshold_max * scale)
+
+# 积分查找表缓存，键为几何、扇形参数以及校正版本
+_integration_operator_cache = OrderedDict()
+
+def get_integration_operator(shape, geometry, start_angle, end_angle, inner_radius, outer_radius, num_bins,
+                             valid=None, valid_version=0, corrections=None):
+    # 未启用强度校正时，距离、像素尺寸等参数不影响查找表，只用圆心作为键
+    if corrections is not None and corrections.active:
+        geometry_key = geometry.key() + corrections.key()
+    else:
+        geometry_key = geometry.map_key()
+    key = (tuple(shape), geometry_key, float(start_angle), float(end_angle), float(inner_radius),
+           float(outer_radius), int(num_bins), valid is not None, valid_version)
+    return _cached_operator(_integration_operator_cache, key, lambda: IntegrationOperator(
+        shape, geometry, start_angle, end_angle, inner_radius, outer_radius, num_bins, valid, corrections))
+
+def _cached_operator(cache, key, build, capacity=16):
+    operator = cache.get(key)
+    if operator is None:
+        # 最近最少使用的查找表先淘汰：圆心漂移校正时圆心在少数几个量化位置之间来回，不必整体清空
+        while len(cache) >= capacity:
+            cache.popitem(last=False)
+        operator = build()
+        cache[key] = operator
+    else:
+        cache.move_to_end(key)
+    return operator
+
+class AzimuthalOperator:
+    """
+    多个 q 环的方位角分布查找表：各 q 环内的像素按 (环, χ bin) 编号后拼接在一起，
+    每帧一次 gather 和一次 bincount 得到所有 q 环的 I(χ)；q 环可以重叠，重叠处的像素在各环中各计一次
+    χ 覆盖 -180°~180° 整圆，I(χ) 为 bin 内像素的平均强度，探测器间隙和坏点因此不会造成方位上的假峰
+    """
+    def __init__(self, shape, geometry, bands, chi_bins=360, valid=None, corrections=None):
+        self.shape = tuple(shape)
+        self.bands = [(float(low), float(high)) for low, high in bands]
+        self.chi_bins = int(chi_bins)
+        self.size = len(self.bands) * self.chi_bins
+        x, y = geometry.pixel_offsets(self.shape)
+        radius, chi = geometry.polar_maps(self.shape)
+        # 等效半径 -> 2θ -> q（埃^-1），与 IntegrationResult 的 q 相同
+        two_theta = np.arctan(radius * (geometry.radial_pixel * 1e-6 / (geometry.distance * 1e-3)))
+        q = np.broadcast_to(4 * np.pi / geometry.lamda * np.sin(two_theta / 2), self.shape).ravel()
+        chi = np.broadcast_to(chi, self.shape).ravel()
+        chi_bin = np.clip(((chi + np.pi) * (self.chi_bins / (2 * np.pi))).astype(np.intp), 0, self.chi_bins - 1)
+
+        pixels, index = [], []
+        for k, (low, high) in enumerate(self.bands):
+            inside = (q >= low) & (q <= high)
+            if valid is not None:
+                inside &= valid.ravel()
+            selected = np.flatnonzero(inside)
+            pixels.append(selected)
+            index.append(chi_bin[selected] + k * self.chi_bins)
+        self.pixels = np.concatenate(pixels) if pixels else np.zeros(0, dtype=np.intp)
+        self.index = np.concatenate(index) if index else np.zeros(0, dtype=np.intp)
+        # 不考虑阈值时每个 bin 的像素数，逐帧复用
+        self.counts = np.bincount(self.index, minlength=self.size)
+        self.chi = (np.arange(self.chi_bins) + 0.5) * (360 / self.chi_bins) - 180
+
+        self.weights = None
+        if corrections is not None and corrections.active:
+            px = np.broadcast_to(x, self.shape).ravel()[self.pixels]
+            py = np.broadcast_to(y, self.shape).ravel()[self.pixels]
+            self.weights = corrections.weights(geometry.two_theta(px, py), chi[self.pixels],
+                                               geometry.obliquity(px, py))
+
+    def profiles(self, image, threshold_min=None, threshold_max=None):
+        """
+        :param image: 与构建查找表时同一方向的图像
+        :return: 形状为 (q 环数, chi_bins) 的平均强度，没有像素的 bin 为 NaN
+        """
+        values = np.take(image, self.pixels)
+        counts = self.counts
+        if threshold_min is not None or threshold_max is not None:
+            keep = np.ones(len(values), dtype=bool)
+            if threshold_min is not None:
+                keep &= values >= threshold_min
+            if threshold_max is not None:
+                keep &= values <= threshold_max
+            if not keep.all():
+                values = np.where(keep, values, 0)
+                counts = np.bincount(self.index, weights=keep, minlength=self.size)
+        if self.weights is not None:
+            values = values * self.weights
+        total = np.bincount(self.index, weights=values.astype(ACCUM_DTYPE, copy=False), minlength=self.size)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return (total / counts).reshape(len(self.bands), self.chi_bins)
+
+_azimuthal_operator_cache = OrderedDict()
+
+def get_azimuthal_operator(shape, geometry, bands, chi_bins=360, valid=None, valid_version=0, corrections=None):
+    geometry_key = geometry.key()
+    if corrections is not None and corrections.active:
+        geometry_key += corrections.key()
+    key = (tuple(shape), geometry_key, tuple((float(low), float(high)) for low, high in bands), int(chi_bins),
+           valid is not None, valid_version)
+    return _cached_operator(_azimuthal_operator_cache, key, lambda: AzimuthalOperator(
+        shape, geometry, bands, chi_bins, valid, corrections))
+
+def parse_q_bands(text):
+    """
+    解析 q 环范围，例如 "1.30-1.45; 1.60-1.70"（埃^-1）
+    :return: [(q_min, q_max), ...]
+    """
+    bands = []
+    for part in re.split(r'[;；,，]', text):
+        part = part.strip()
+        if not part:
+            continue
+        match = re.fullmatch(r'(\d*\.?\d+)\s*[-~]\s*(\d*\.?\d+)', part)
+        if match is None:
+            raise ValueError(f"无法解析 q 范围: {part}")
+        low, high = sorted(float(v) for v in match.groups())
+        bands.append((low, high))
+    return bands
+
+def fill_circular_gaps(profiles):
+    """
+    方位角分布中没有像素的 bin（NaN）按 χ 方向循环地用两侧最近的有效 bin 线性插值，对所有曲线同时进行
+    :param profiles: (..., n)，最后一维为 χ
+    """
+    profiles = np.asarray(profiles, dtype=np.float64)
+    valid = np.isfinite(profiles)
+    if valid.all():
+        return profiles
+    n = profiles.shape[-1]
+    values = profiles.reshape(-1, n)
+    valid = valid.reshape(-1, n)
+    # 把曲线接成两圈，用累积最大/最小值找到每个 bin 左侧和右侧最近的有效 bin
+    position = np.arange(2 * n)
+    tiled = np.concatenate([valid, valid], axis=1)
+    previous = np.maximum.accumulate(np.where(tiled, position, -1), axis=1)[:, n:]
+    following = np.minimum.accumulate(np.where(tiled, position, 2 * n)[:, ::-1], axis=1)[:, ::-1][:, :n]
+    empty = ~valid.any(axis=1)
+    previous[empty], following[empty] = 0, 0
+    d_previous = (np.arange(n) + n) - previous
+    d_following = following - np.arange(n)
+    rows = np.arange(len(values))[:, None]
+    with np.errstate(invalid='ignore'):
+        w = np.where(d_previous + d_following > 0, d_previous / np.maximum(d_previous + d_following, 1), 0)
+        filled = values[rows, previous % n] * (1 - w) + values[rows, following % n] * w
+    filled[empty] = np.nan
+    return filled.reshape(profiles.shape)
+
+def orientation_metrics(profiles, chi, reference=90.0, baseline=True, min_resultant=0.05):
+    """
+    由方位角分布计算取向参数，对最后一维以外的所有维度（帧、q 环）向量化
+    χ 近似为取向分布的极角（小角近似，忽略 Ewald 球曲率），分布按 χ 与 χ+180° 对称处理
+    :param profiles: (..., n) 的 I(χ)
+    :param chi: χ bin 中心（度）
+    :param reference: 取向参考方向的 χ（度），例如纤维轴或薄膜法向（90° 为图像竖直方向）
+    :param baseline: 先扣除各曲线的最小值，即各向同性部分，只分析取向部分
+    :param min_resultant: 二倍角合成长度 R 低于该值时分布与各向同性无法区分（只剩噪声），mosaicity 记为 NaN
+    :return: dict，各项形状为 profiles.shape[:-1]：
+        herman：Herman 取向因子 f = (3<cos²φ> - 1) / 2，<cos²φ> 按 sinφ 加权；1 为完全平行于参考方向，-0.5 为完全垂直
+        mosaicity：二倍角圆统计的标准差（度），反映取向分布的整体宽度
+        chi_width：最强峰的半高宽（度），在半高处线性插值
+        chi_peak：最强峰的位置（度），三点抛物线插值
+    """
+    profiles = fill_circular_gaps(profiles)
+    chi = np.asarray(chi, dtype=np.float64)
+    n = profiles.shape[-1]
+    step = 360 / n
+    if baseline:
+        profiles = profiles - profiles.min(axis=-1, keepdims=True)
+
+    phi = np.radians(chi - reference)
+    sin_phi = np.abs(np.sin(phi))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_cos2 = (profiles * (sin_phi * np.cos(phi) ** 2)).sum(axis=-1) / (profiles * sin_phi).sum(axis=-1)
+        herman = (3 * mean_cos2 - 1) / 2
+
+        # 取向分布关于 χ+180° 对称，用二倍角的平均合成长度 R 估计分布宽度：σ = sqrt(-2 ln R) / 2
+        total = profiles.sum(axis=-1)
+        c = (profiles * np.cos(np.radians(2 * chi))).sum(axis=-1) / total
+        s = (profiles * np.sin(np.radians(2 * chi))).sum(axis=-1) / total
+        resultant = np.hypot(c, s)
+        mosaicity = np.where(resultant >= min_resultant,
+                             np.degrees(np.sqrt(-2 * np.log(np.clip(resultant, min_resultant, 1))) / 2), np.nan)[()]
+
+    # 以最强 bin 为中心循环重排后，向两侧寻找第一个低于半高的 bin
+    flat = np.nan_to_num(profiles.reshape(-1, n), nan=-np.inf)
+    peak = np.argmax(flat, axis=1)
+    middle = n // 2
+    centered = np.take_along_axis(flat, (peak[:, None] + np.arange(n) - middle) % n, axis=1)
+    top = centered[:, middle]
+    half = top / 2
+    rows = np.arange(len(flat))
+    widths = []
+    for side in (centered[:, middle:], centered[:, middle::-1]):
+        below = side < half[:, None]
+        k = np.argmax(below, axis=1)
+        inner, outer = side[rows, np.maximum(k - 1, 0)], side[rows, k]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            fraction = np.where(inner > outer, (inner - half) / (inner - outer), 0)
+        widths.append(np.where(below.any(axis=1), k - 1 + fraction, np.nan))
+    chi_width = (widths[0] + widths[1]) * step
+    chi_width[~np.isfinite(top) | (top <= 0)] = np.nan
+
+    y0, y1, y2 = centered[:, middle - 1], centered[:, middle], centered[:, middle + 1]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        delta = np.where(y0 - 2 * y1 + y2 < 0, 0.5 * (y0 - y2) / (y0 - 2 * y1 + y2), 0)
+    chi_peak = (chi[peak] + np.clip(delta, -0.5, 0.5) * step + 180) % 360 - 180
+    chi_peak[~np.isfinite(top)] = np.nan
+
+    shape = profiles.shape[:-1]
+    return {'herman': herman, 'mosaicity': mosaicity, 'chi_width': chi_width.reshape(shape),
+            'chi_peak': chi_peak.reshape(shape)}
+
+class OrientationSeries:
+    """
+    批量处理中的取向分析：逐帧保存各 q 环的方位角分布，处理结束后对整个序列一次性计算取向参数，
+    导出为随帧变化的时间序列
+    """
+    METRICS = ('herman', 'mosaicity', 'chi_width', 'chi_peak')
+
+    def __init__(self, bands, reference=90.0, chi_bins=360, baseline=True):
+        self.bands = [(float(low), float(high)) for low, high in bands]
+        self.reference = float(reference)
+        self.chi_bins = int(chi_bins)
+        self.baseline = baseline
+        self.chi = (np.arange(self.chi_bins) + 0.5) * (360 / self.chi_bins) - 180
+        self.frames = []
+        self.profiles = []
+
+    def add(self, index, profiles):
+        self.frames.append(int(index))
+        self.profiles.append(np.asarray(profiles, dtype=np.float64))
+
+    def update(self, index, settings, frame):
+        # 对一帧计算所有 q 环的方位角分布并记录
+        _, profiles = settings.azimuthal_profiles(frame, self.bands, self.chi_bins)
+        self.add(index, profiles)
+
+    def metrics(self):
+        # 各项形状为 (帧数, q 环数)
+        profiles = np.array(self.profiles).reshape(-1, len(self.bands), self.chi_bins)
+        return orientation_metrics(profiles, self.chi, self.reference, self.baseline)
+
+    def save(self, folder):
+        """
+        orientation.txt：每帧一行，帧序号之后依次为各 q 环的 f、mosaicity、chi_width、chi_peak；
+        chi_profiles_q<k>.txt：第 k 个 q 环的方位角分布，第一列为 χ，之后每列一帧
+        :return: 导出的文件列表
+        """
+        os.makedirs(folder, exist_ok=True)
+        metrics = self.metrics()
+        columns = [np.array(self.frames, dtype=np.float64)]
+        names = ['frame']
+        for k in range(len(self.bands)):
+            for name in self.METRICS:
+                columns.append(metrics[name][:, k])
+                names.append(f'{name}_q{k + 1}')
+        bands = ', '.join(f'q{k + 1}: {low:g}-{high:g}' for k, (low, high) in enumerate(self.bands))
+        files = [os.path.join(folder, 'orientation.txt')]
+        np.savetxt(files[0], np.column_stack(columns), fmt=['%d'] + ['%.6f'] * (len(columns) - 1),
+                   header=f'{bands} (1/A), reference chi {self.reference:g} deg\n' + ' '.join(names))
+        profiles = np.array(self.profiles).reshape(-1, len(self.bands), self.chi_bins)
+        for k in range(len(self.bands)):
+            files.append(os.path.join(folder, f'chi_profiles_q{k + 1}.txt'))
+            np.savetxt(files[-1], np.column_stack([self.chi, profiles[:, k].T]), fmt='%.6f', delimiter=' ')
+        return files
+
+    def summary(self):
+        # 界面提示用：各 q 环首帧和末帧的 Herman 取向因子
+        herman = self.metrics()['herman']
+        return '，'.join(f"q{k + 1} 取向因子 {herman[0, k]:.3f} → {herman[-1, k]:.3f}" for k in range(len(self.bands)))
+
+def cubic_d_spacings(a, lattice='primitive', count=20):
+    """
+    立方晶系允许衍射的晶面间距（埃），从大到小
+    :param lattice: 'primitive' 简单立方（如 LaB6），'diamond' 金刚石结构（如 Si）
+    """
+    orders = set()
+    for h in range(8):
+        for k in range(h + 1):
+            for l in range(k + 1):
+                if h == k == l == 0:
+                    continue
+                if lattice == 'diamond':
+                    all_odd = h % 2 == k % 2 == l % 2 == 1
+                    all_even = h % 2 == k % 2 == l % 2 == 0
+                    if not (all_odd or (all_even and (h + k + l) % 4 == 0)):
+                        continue
+                orders.add(h * h + k * k + l * l)
+    return [a / math.sqrt(n) for n in sorted(orders)[:count]]
+
+# 标样的晶面间距（埃）
+CALIBRANTS = {
+    'AgBe': [58.380 / n for n in range(1, 21)],
+    'LaB6': cubic_d_spacings(4.15689, 'primitive'),
+    'Si': cubic_d_spacings(5.431194, 'diamond'),
+}
+
+def pick_ring_points(image, valid, center, sectors=72, window=15, snr=5.0):
+    """
+    在以 center 为中心的各方位扇区的径向曲线上找峰，返回峰位的像素坐标
+    所有扇区的径向曲线由一次 bincount 得到，找峰对全部扇区向量化进行，峰位用三点抛物线插值到亚像素
+    :param valid: 参与找峰的像素（排除坏点、gap 和阈值外像素）
+    :param window: 估计局部背景的滑动窗口（pixel）
+    :param snr: 峰高相对噪声的最小倍数；噪声取 bin 内像素方差估计的均值误差与局部残差离散度（MAD）中的较大者
+    :return: (x, y) 峰位坐标数组
+    """
+    height, width = image.shape
+    y, x = np.ogrid[:height, :width]
+    dx, dy = x - center[0], y - center[1]
+    r = np.hypot(dx, dy)
+    rbin = r.astype(np.int64)
+    nr = int(rbin.max()) + 1
+    sector = ((np.arctan2(dy, dx) + np.pi) / (2 * np.pi) * sectors).astype(np.int64) % sectors
+    index = (sector * nr + rbin)[valid]
+    values = image[valid].astype(np.float64)
+    total = np.bincount(index, weights=values, minlength=sectors * nr)
+    square = np.bincount(index, weights=values * values, minlength=sectors * nr)
+    count = np.bincount(index, minlength=sectors * nr)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        profiles = np.nan_to_num((total / count).reshape(sectors, nr))
+        # bin 内均值的误差：像素方差 / 像素数
+        error = np.sqrt(np.maximum(square / count - (total / count) ** 2, 0) / count)
+    # 像素太少的 bin（圆心附近、gap 边缘）方差估计不可靠，不参与找峰
+    error = np.where(count >= 5, error, np.inf).reshape(sectors, nr)
+    # 三点平滑后，局部背景取滑动窗口内的中位数：最小值在圆心附近陡峭的背景上取到窗口边缘，
+    # 背景被低估，噪声起伏会被当成峰
+    profiles = (profiles[:, :-2] + profiles[:, 1:-1] + profiles[:, 2:]) / 3
+    noise = np.sqrt(error[:, :-2] ** 2 + error[:, 1:-1] ** 2 + error[:, 2:] ** 2) / 3
+    pad = window // 2
+
+    def sliding(a):
+        return np.lib.stride_tricks.sliding_window_view(np.pad(a, ((0, 0), (pad, pad)), mode='edge'), window, axis=1)
+
+    background = np.median(sliding(profiles), axis=2)
+    # 扣除背景后的残差在窗口内的离散度（1.4826 × MAD），包含像素方差反映不出的起伏
+    residual = sliding(profiles - background)
+    spread = 1.4826 * np.median(np.abs(residual - np.median(residual, axis=2, keepdims=True)), axis=2)
+    noise = np.maximum(noise, spread)
+    left, mid, right = profiles[:, :-2], profiles[:, 1:-1], profiles[:, 2:]
+    peaks = (mid > left) & (mid >= right) & (mid - background[:, 1:-1] > snr * noise[:, 1:-1])
+    s, b = np.nonzero(peaks)
+    left, mid, right = left[s, b], mid[s, b], right[s, b]
+    denominator = left - 2 * mid + right
+    with np.errstate(invalid='ignore', divide='ignore'):
+        offset = np.where(denominator != 0, 0.5 * (left - right) / denominator, 0)
+    # 平滑后的第 b+1 个点对应原半径 b+2，bin 中心再加 0.5
+    radius = b + 2 + 0.5 + np.clip(offset, -0.5, 0.5)
+    angle = (s + 0.5) / sectors * 2 * np.pi - np.pi
+    return center[0] + radius * np.cos(angle), center[1] + radius * np.sin(angle)
+
+def assign_rings(two_theta, ring_two_theta, tolerance=0.25):
+    # 将峰位的 2θ 归属到最近的标样衍射环，偏差超过与相邻环间距的 tolerance 倍时舍弃；返回环编号，-1 表示未归属
+    ring = np.abs(two_theta[:, None] - ring_two_theta[None, :]).argmin(axis=1)
+    gaps = np.diff(ring_two_theta)
+    spacing = np.minimum(np.append(gaps, np.inf), np.insert(gaps, 0, np.inf))
+    ok = np.abs(two_theta - ring_two_theta[ring]) < tolerance * spacing[ring]
+    return np.where(ok, ring, -1)
+
+def search_distance(x, y, geometry, ring_two_theta, span=1.25, steps=101):
+    """
+    在初始距离的 1/span~span 倍之间网格搜索：归属到衍射环的峰越多、范围内没有峰的衍射环越少越好
+    只有得分严格高于初始距离时才替换，范围过宽时间距成比例的衍射环（如 AgBe）会在相邻级次间混淆
+    """
+    radius = np.hypot((x - geometry.x_center) * geometry.pixel_x, (y - geometry.y_center) * geometry.pixel_y) * 1e-6
+    r_max = radius.max() if len(radius) else 0
+
+    def score(distance):
+        two_theta = np.arctan(radius / (distance * 1e-3))
+        ring = assign_rings(two_theta, ring_two_theta)
+        matched = np.unique(ring[ring >= 0])
+        visible = np.count_nonzero(np.tan(ring_two_theta) * distance * 1e-3 < r_max)
+        return np.count_nonzero(ring >= 0) - 0.5 * (visible - len(matched)) * len(radius) / max(visible, 1)
+
+    best, best_score = geometry.distance, score(geometry.distance)
+    for distance in geometry.distance * np.geomspace(1 / span, span, steps):
+        current = score(distance)
+        if current > best_score:
+            best, best_score = distance, current
+    return best
+
+def calibrate_geometry(image, geometry, d_spacings, valid=None, fit_tilt=True, search=True, rounds=3, sectors=72,
+                       min_coverage=0.5):
+    """
+    用标样衍射环标定圆心、样品-探测器距离和探测器倾斜
+    以 geometry 为初值：各方位扇区径向曲线找峰 → 按 2θ 归属到标样衍射环 → 最小二乘拟合，迭代 rounds 轮
+    :param image: 标样图像（积分所用的翻转后方向）
+    :param geometry: 初始几何，需要大致的圆心、距离，以及准确的像素尺寸和波长
+    :param d_spacings: 标样晶面间距（埃）
+    :param search: 第一轮先在初始距离附近搜索距离，距离初值不准（偏差 10% 以上）时需要
+    :param min_coverage: 拟合倾斜所需的峰点方位覆盖率（有峰点的扇区比例）；覆盖不足、只有一个衍射环，
+        或拟合出的倾斜不超过其标准误差的 3 倍时不拟合倾斜，倾斜为 0
+    :return: (拟合后的 DetectorGeometry, 信息 dict：峰点数、衍射环数、2θ 残差 RMS（度）)
+    """
+    from scipy.optimize import least_squares
+
+    image = np.asarray(image, dtype=np.float64)
+    if valid is None:
+        valid = np.ones(image.shape, dtype=bool)
+    d = np.asarray(d_spacings, dtype=np.float64)
+    d = d[geometry.lamda / (2 * d) < 1]
+    ring_two_theta = np.sort(2 * np.arcsin(geometry.lamda / (2 * d)))
+
+    def make(p):
+        return DetectorGeometry(p[0], p[1], p[2], geometry.pixel_x, geometry.pixel_y, geometry.lamda,
+                                *(p[3:5] if len(p) > 3 else (0, 0)))
+
+    def fit(p0):
+        def residual(p):
+            g = make(p)
+            return g.two_theta(x - g.x_center, y - g.y_center) - target
+        return least_squares(residual, p0, x_scale='jac', loss='soft_l1', f_scale=np.radians(0.05))
+
+    current = geometry
+    x = y = ring = np.array([])
+    for round_index in range(rounds):
+        x, y = pick_ring_points(image, valid, current.center, sectors)
+        if round_index == 0 and search:
+            current = current.copy(distance=search_distance(x, y, current, ring_two_theta))
+        ring = assign_rings(current.two_theta(x - current.x_center, y - current.y_center), ring_two_theta)
+        x, y, ring = x[ring >= 0], y[ring >= 0], ring[ring >= 0]
+        if len(x) < 10:
+            raise ValueError('找到的衍射环峰点太少，请检查圆心、距离初值和标样类型')
+        target = ring_two_theta[ring]
+        # 峰点只覆盖一小段方位角或只有一个衍射环时，倾斜与圆心、距离高度相关，拟合出的倾斜没有意义
+        angle = np.arctan2(y - current.y_center, x - current.x_center)
+        covered = len(np.unique(((angle + np.pi) / (2 * np.pi) * sectors).astype(np.int64) % sectors))
+        tilted = fit_tilt and len(np.unique(ring)) >= 2 and covered >= min_coverage * sectors
+
+        p0 = [current.x_center, current.y_center, current.distance]
+        if tilted:
+            result = fit(p0 + [current.tilt, current.rotation])
+            # 倾斜不显著（小于标准误差的 3 倍）时按未倾斜重新拟合，避免把噪声当成倾斜
+            jac = result.jac
+            variance = np.mean(result.fun ** 2) * np.linalg.pinv(jac.T @ jac)
+            if abs(result.x[3]) <= 3 * np.sqrt(max(variance[3, 3], 0)):
+                result = fit(p0)
+        else:
+            result = fit(p0)
+        current = make(result.x)
+        if current.tilt < 0:
+            # 倾斜角取正值，方位角规范到 (-180, 180]
+            current.tilt, current.rotation = -current.tilt, current.rotation + 180
+        current.rotation = 180 - (180 - current.rotation) % 360
+
+    rms = np.degrees(np.sqrt(np.mean((current.two_theta(x - current.x_center, y - current.y_center)
+                                      - ring_two_theta[ring]) ** 2)))
+    return current, {'points': len(x), 'rings': len(np.unique(ring)), 'rms_deg': float(rms)}
+
+def strongest_ring_radius(image, valid, center, min_radius=10, max_radius=None, window=15):
+    """
+    方位平均曲线上相对两侧背景最突出的衍射环半径（pixel），用于选择跟踪圆心漂移的圆环
+    :param valid: 参与统计的像素，None 表示全部
+    :param max_radius: 搜索的最大半径，None 时取圆心到图像边缘的最近距离，使圆环尽量完整
+    :return: 半径，找不到可用的衍射环时为 None
+    """
+    height, width = image.shape
+    y, x = np.ogrid[:height, :width]
+    rbin = np.hypot(x - center[0], y - center[1]).astype(np.int64)
+    if valid is not None:
+        rbin, values = rbin[valid], image[valid]
+    else:
+        rbin, values = np.broadcast_to(rbin, image.shape).ravel(), image.ravel()
+    total = np.bincount(rbin, weights=values.astype(np.float64))
+    count = np.bincount(rbin, minlength=len(total))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        profile = np.where(count >= 5, total / count, np.nan)
+    # 突出程度：峰值减去两侧 window 处的平均
+    prominence = np.full(len(profile), np.nan)
+    prominence[window:-window] = profile[window:-window] - (profile[:-2 * window] + profile[2 * window:]) / 2
+    if max_radius is None:
+        max_radius = min(center[0], center[1], width - 1 - center[0], height - 1 - center[1]) - window
+        if max_radius < min_radius + window:
+            max_radius = len(profile)
+    prominence[:max(int(min_radius), window)] = np.nan
+    prominence[max(int(max_radius), 0):] = np.nan
+    if np.all(np.isnan(prominence)):
+        return None
+    return float(np.nanargmax(prominence))
+
+class RingCenterEstimator:
+    """
+    由衍射环的对称性估计圆心：半径 radius±width 的圆环按方位分成若干扇区，一次 bincount 得到各扇区的径向曲线，
+    各扇区峰位 r_k ≈ R + dx·cosθ_k + dy·sinθ_k，线性最小二乘解出圆心偏移 (dx, dy)
+    圆环内像素的索引只在圆心移动超过 width/4 时重建
+    """
+    def __init__(self, radius, width=15, sectors=16):
+        self.radius = float(radius)
+        # 小半径的圆环上每个扇区的像素较少，窗口相应收窄，保证内缘的 bin 也有足够像素
+        self.width = int(max(min(width, radius / 3), 3))
+        self.sectors = int(sectors)
+        self.center = None
+        self.shape = None
+
+    def _build(self, shape, center):
+        height, width = shape
+        r_min, r_max = max(self.radius - self.width, 0), self.radius + self.width
+        # 只在圆环的外接矩形内构造网格
+        x0, x1 = max(int(center[0] - r_max), 0), min(int(center[0] + r_max) + 2, width)
+        y0, y1 = max(int(center[1] - r_max), 0), min(int(center[1] + r_max) + 2, height)
+        y, x = np.ogrid[y0:y1, x0:x1]
+        dx, dy = x - center[0], y - center[1]
+        r = np.hypot(dx, dy)
+        inside = (r >= r_min) & (r < r_max)
+        rows, cols = np.nonzero(inside)
+        self.pixels = (rows + y0) * width + cols + x0
+        self.nr = int(np.ceil(r_max - r_min))
+        self.r_min = r_min
+        rbin = (r[inside] - r_min).astype(np.int64)
+        sector = ((np.arctan2(np.broadcast_to(dy, r.shape)[inside], np.broadcast_to(dx, r.shape)[inside]) + np.pi)
+                  / (2 * np.pi) * self.sectors).astype(np.int64) % self.sectors
+        self.index = sector * self.nr + rbin
+        angles = (np.arange(self.sectors) + 0.5) / self.sectors * 2 * np.pi - np.pi
+        self.design = np.column_stack([np.ones(self.sectors), np.cos(angles), np.sin(angles)])
+        self.center, self.shape = tuple(center), tuple(shape)
+
+    def estimate(self, image, center, bad_pixels=None, thresholds=(None, None)):
+        """
+        :param center: 当前圆心（image 的像素坐标）
+        :param bad_pixels: 静态坏点掩码，True 的像素不参与
+        :param thresholds: (最小值, 最大值)，范围外的像素不参与
+        :return: 估计的圆心 (x, y)，有效扇区太少时返回 None
+        """
+        if (self.center is None or self.shape != image.shape
+                or math.hypot(center[0] - self.center[0], center[1] - self.center[1]) > self.width / 4):
+            self._build(image.shape, center)
+        values = np.take(image, self.pixels).astype(np.float64)
+        keep = np.isfinite(values)
+        if bad_pixels is not None:
+            keep &= ~np.take(bad_pixels, self.pixels)
+        if thresholds[0] is not None:
+            keep &= values >= thresholds[0]
+        if thresholds[1] is not None:
+            keep &= values <= thresholds[1]
+        size = self.sectors * self.nr
+        total = np.bincount(self.index[keep], weights=values[keep], minlength=size)
+        count = np.bincount(self.index[keep], minlength=size)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            profiles = (total / count).reshape(self.sectors, self.nr)
+        # 径向曲线完整（每个 bin 至少 3 个像素）的扇区才参与拟合
+        usable = (count.reshape(self.sectors, self.nr) >= 3).all(axis=1)
+        profiles = np.nan_to_num(profiles)
+        smoothed = (profiles[:, :-2] + profiles[:, 1:-1] + profiles[:, 2:]) / 3
+        peak = np.argmax(smoothed, axis=1)
+        rows = np.arange(self.sectors)
+        # 峰在窗口边缘说明圆环没有落在窗口内
+        usable &= (peak > 0) & (peak < smoothed.shape[1] - 1)
+        peak = np.clip(peak, 1, smoothed.shape[1] - 2)
+        left, middle, right = smoothed[rows, peak - 1], smoothed[rows, peak], smoothed[rows, peak + 1]
+        curvature = left - 2 * middle + right
+        usable &= curvature < 0
+        with np.errstate(invalid='ignore', divide='ignore'):
+            delta = np.where(curvature < 0, 0.5 * (left - right) / curvature, 0)
+        if usable.sum() < 6:
+            return None
+        radius = self.r_min + peak + 1 + delta + 0.5
+        (_, dx, dy), *_ = np.linalg.lstsq(self.design[usable], radius[usable], rcond=None)
+        return self.center[0] + dx, self.center[1] + dy
+
+def beam_center(image, center, radius=20):
+    """
+    直通光斑（或半透明 beamstop 后的光斑）的质心
+    在 center 附近 (2·radius+1)² 的窗口内扣除中位数背景，取半高以上像素的强度加权质心
+    :return: (x, y)，窗口内没有光斑时返回 None
+    """
+    height, width = image.shape
+    x0, x1 = max(int(round(center[0])) - radius, 0), min(int(round(center[0])) + radius + 1, width)
+    y0, y1 = max(int(round(center[1])) - radius, 0), min(int(round(center[1])) + radius + 1, height)
+    if x1 <= x0 or y1 <= y0:
+        return None
+    window = np.nan_to_num(image[y0:y1, x0:x1].astype(np.float64))
+    window = window - np.median(window)
+    peak = window.max()
+    if peak <= 0:
+        return None
+    weights = np.where(window >= peak / 2, window, 0)
+    y, x = np.ogrid[y0:y1, x0:x1]
+    total = weights.sum()
+    return float((weights * x).sum() / total), float((weights * y).sum() / total)
+
+class DriftTracker:
+    """
+    批量处理中跟踪圆心漂移：每 every 帧由衍射环对称性或直通光斑估计一次圆心
+    相对参考圆心的偏移量化到 bucket 像素，漂移不超过半个 bucket 时圆心不变，积分查找表直接复用
+    圆心与界面参数一致（原始像素、翻转后的图像坐标），估计在未翻转、可能经过像素合并的帧上进行
+    """
+    METHODS = ('rings', 'beam')
+
+    def __init__(self, center, method='rings', every=1, bucket=0.25, max_shift=50, thresholds=(None, None),
+                 correction=None):
+        self.reference = (float(center[0]), float(center[1]))
+        self.center = self.reference
+        self.method = method
+        self.every = max(int(every), 1)
+        self.bucket = bucket
+        self.max_shift = max_shift
+        self.thresholds = thresholds
+        self.correction = correction
+        self.estimator = None
+        # 每帧使用的圆心：(帧序号, x, y)
+        self.history = []
+        self.rejected = 0
+
+    @staticmethod
+    def to_frame(center, shape, binning):
+        x = (center[0] + 0.5) / binning - 0.5
+        y = (center[1] + 0.5) / binning - 0.5
+        return x, shape[0] - 1 - y
+
+    @staticmethod
+    def from_frame(center, shape, binning):
+        return (center[0] + 0.5) * binning - 0.5, (shape[0] - 1 - center[1] + 0.5) * binning - 0.5
+
+    def update(self, index, frame, binning=1):
+        """
+        :param index: 帧序号，每 every 帧估计一次
+        :param frame: 已校正（未翻转）的帧
+        :return: 该帧积分所用的圆心 (x, y)
+        """
+        if index % self.every == 0 or not self.history:
+            # 第一帧总要估计一次（分布式处理时每块从中间的帧开始）
+            estimate = self.estimate(frame, binning)
+            if estimate is None:
+                self.rejected += 1
+            else:
+                dx, dy = estimate[0] - self.reference[0], estimate[1] - self.reference[1]
+                if math.hypot(dx, dy) > self.max_shift:
+                    # 偏移过大多半是误判（例如光斑被挡住），沿用上一次的圆心
+                    self.rejected += 1
+                else:
+                    dx, dy = (round(d / self.bucket) * self.bucket for d in (dx, dy))
+                    self.center = (self.reference[0] + dx, self.reference[1] + dy)
+        self.history.append((index,) + self.center)
+        return self.center
+
+    def estimate(self, frame, binning=1):
+        image = np.asarray(frame)
+        center = self.to_frame(self.center, image.shape, binning)
+        bad_pixels = self.correction.mask_for(image.shape) if self.correction is not None else None
+        if self.method == 'beam':
+            result = beam_center(image, center, max(int(round(20 / binning)), 3))
+        else:
+            if self.estimator is None:
+                valid = np.isfinite(image)
+                if bad_pixels is not None:
+                    valid &= ~bad_pixels
+                if self.thresholds[0] is not None:
+                    valid &= image >= self.thresholds[0]
+                if self.thresholds[1] is not None:
+                    valid &= image <= self.thresholds[1]
+                radius = strongest_ring_radius(image, valid, center)
+                if radius is None:
+                    # 这一帧找不到衍射环：本次估计失败，沿用上一圆心，下次估计时重新选环
+                    return None
+                self.estimator = RingCenterEstimator(radius)
+            result = self.estimator.estimate(image, center, bad_pixels, self.thresholds)
+        return None if result is None else self.from_frame(result, image.shape, binning)
+
+    def max_drift(self):
+        # 各帧圆心相对参考圆心的最大偏移（pixel）
+        return max((math.hypot(x - self.reference[0], y - self.reference[1]) for _, x, y in self.history),
+                   default=0.0)
+
+def match_files(folder, pattern):
+    # 与界面批量处理相同的匹配方式：文件夹下以 pattern 结尾的文件，按文件名排序
+    return sorted(glob.glob(folder + "/*" + pattern))
+
+RECIPE_VERSION = 1
+
+class Recipe:
+    """
+    处理配方：完整的积分流程参数，保存为带版本号的 JSON
+    包括几何、积分扇形、阈值与 Colorbar、探测器和强度校正、帧合并、圆心漂移校正、扣背底和导出选项；
+    界面中可以导入导出，命令行模式按同一配方无界面地处理多个文件夹
+    """
+    DEFAULTS = {
+        'geometry': {'x_center': 0.0, 'y_center': 0.0, 'distance': 300.0, 'pixel_x': 73.2, 'pixel_y': 73.2,
+                     'lamda': 1.24, 'tilt': 0.0, 'rotation': 0.0, 'incidence': 0.5},
+        'integration': {'start_angle': -180.0, 'end_angle': 180.0, 'inner_radius': 0.0, 'outer_radius': 1000.0,
+                        'num_bins': 500, 'radial': True, 'axis': 0, 'smoothing': 'boxcar', 'smoothing_width': 5.0,
+                        'reference_wavelength': REFERENCE_WAVELENGTH},
+        'mask': {'threshold_min': 0.0, 'threshold_max': 1000000.0},
+        'display': {'cb_min': 0.0, 'cb_max': 800.0, 'log': False, 'flip': False,
+                    'qr_min': -121.0, 'qr_max': -121.0, 'qz_min': -121.0, 'qz_max': -121.0},
+        'correction': {'dark': '', 'flat': '', 'mask': '', 'solid_angle': False, 'polarization': None,
+                       'lorentz': False, 'absorption': None},
+        'reduce': {'mode': 'none', 'group': 1, 'binning': 1},
+        'drift': {'enabled': False, 'method': 'rings', 'every': 1},
+        'background': {'enabled': False, 'init_image': 1, 'x_min': None, 'x_max': None, 'anchors': None},
+        'orientation': {'enabled': False, 'bands': [], 'reference': 90.0, 'chi_bins': 360},
+        'export': {'pattern': '', 'curve': True, 'image': False, 'format': 'txt'},
+    }
+
+    def __init__(self, data=None):
+        # 缺少的段落和字段取默认值，未知字段忽略，旧版本配方因此可以直接读取
+        self.data = copy.deepcopy(self.DEFAULTS)
+        for section, values in (data or {}).items():
+            if section in self.data and isinstance(values, dict):
+                self.data[section].update({k: v for k, v in values.items() if k in self.data[section]})
+
+    def __getitem__(self, section):
+        return self.data[section]
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        version = data.get('version')
+        if not isinstance(version, int) or not 1 <= version <= RECIPE_VERSION:
+            raise ValueError(f"不支持的配方版本: {version}")
+        return cls(data)
+
+    def save(self, path):
+        # 先写临时文件再替换，避免中断时留下不完整的配方
+        temp = path + '.tmp'
+        with open(temp, 'w', encoding='utf-8') as f:
+            json.dump({'version': RECIPE_VERSION, **self.data}, f, ensure_ascii=False, indent=2)
+        os.replace(temp, path)
+
+    def geometry(self):
+        return DetectorGeometry(**{k: v for k, v in self['geometry'].items() if k != 'incidence'})
+
+    def correction(self, correction=None):
+        # correction 不为 None 时清空后重新加载到该对象中，其版本号递增，积分查找表缓存随之失效
+        if correction is None:
+            correction = DetectorCorrection()
+        else:
+            correction.clear()
+        section = self['correction']
+        for key, loader in (('dark', correction.load_dark), ('flat', correction.load_flat),
+                            ('mask', correction.load_mask)):
+            if section[key]:
+                loader(section[key])
+        return correction
+
+    def intensity_correction(self):
+        section = self['correction']
+        return IntensityCorrection(section['solid_angle'], section['polarization'], section['lorentz'],
+                                   section['absorption'])
+
+    def frame_reducer(self):
+        section = self['reduce']
+        return FrameReducer(section['mode'], section['group'], section['binning'])
+
+    def pipeline_settings(self, correction=None, reducer=None):
+        integration, mask, display = self['integration'], self['mask'], self['display']
+        reducer = reducer or self.frame_reducer()
+        return PipelineSettings(self.geometry(), integration['start_angle'], integration['end_angle'],
+                                integration['inner_radius'], integration['outer_radius'], integration['num_bins'],
+                                mask['threshold_min'], mask['threshold_max'], display['cb_min'], display['cb_max'],
+                                radial=integration['radial'], axis_index=integration['axis'],
+                                correction=correction, intensity_correction=self.intensity_correction(),
+                                binning=reducer.binning, value_scale=reducer.value_scale,
+                                smoother=ProfileSmoother(integration['smoothing'], integration['smoothing_width']),
+                                reference_wavelength=integration['reference_wavelength'])
+
+    def drift_tracker(self, reducer=None, correction=None):
+        section = self['drift']
+        if not section['enabled']:
+            return None
+        reducer = reducer or self.frame_reducer()
+        scale = reducer.value_scale
+        geometry = self['geometry']
+        return DriftTracker((geometry['x_center'], geometry['y_center']), section['method'], section['every'],
+                            thresholds=(self['mask']['threshold_min'] * scale, self['mask']['threshold_max'] * scale),
+                            correction=correction)
+
+    def orientation_series(self):
+        # 未勾选取向分析或没有 q 环时返回 None
+        section = self['orientation']
+        if not section['enabled'] or not section['bands']:
+            return None
+        return OrientationSeries(section['bands'], section['reference'], section['chi_bins'])
+
+    def profile_exporter(self):
+        integration = self['integration']
+        return ProfileExporter(self['export']['format'], profile_axis(integration['axis'], integration['radial']),
+                               integration['reference_wavelength'])
+
+class RecipeRunner:
+    """
+    按配方逐帧处理：读取（失败重试后跳过）、校正、帧合并、漂移校正、积分和扣背底，不访问界面控件
+    无界面的 run_recipe 和分布式队列的 worker 共用
+    """
+    def __init__(self, recipe, retries=2):
+        self.retries = retries
+        self.correction = recipe.correction()
+        self.reducer = recipe.frame_reducer()
+        self.settings = recipe.pipeline_settings(self.correction, self.reducer)
+        self.geometry = self.settings.geometry
+        self.tracker = recipe.drift_tracker(self.reducer, self.correction)
+        self.orientation = recipe.orientation_series()
+        background = recipe['background']
+        self.anchors = np.asarray(background['anchors']) if background['enabled'] and background['anchors'] else None
+        # 重试后仍无法读取的帧：(ref, 错误信息)
+        self.skipped = []
+        # collect 之后：各帧的计数统计误差（与曲线同样平滑）和导出文件名，与界面批量处理相同
+        self.errors = []
+        self.names = []
+
+    def load(self, ref):
+        for attempt in range(self.retries + 1):
+            try:
+                return self.correction.apply(read_frame(ref))
+            except (OSError, ValueError) as e:
+                error = e
+                if attempt < self.retries:
+                    time.sleep(0.2 * (attempt + 1))
+        self.skipped.append((ref, str(error)))
+        return None
+
+    def run(self, refs, first_index=0, callback=None):
+        """
+        :param first_index: 第一帧输出的全局序号，用于漂移校正每 N 帧估计一次的节拍
+        :param callback: 每处理完一帧调用一次，例如更新进度或心跳
+        :return: 逐帧生成 (ref, x, 未平滑的 y, 未平滑的误差)
+        """
+        with FramePrefetcher(refs, self.load) as frames:
+            frames = ((ref, frame) for ref, frame in frames if frame is not None)
+            for i, (ref, frame) in enumerate(self.reducer.reduce(frames), first_index):
+                if self.tracker is not None:
+                    x_center, y_center = self.tracker.update(i, frame, self.reducer.binning)
+                    self.settings.geometry = self.geometry.copy(x_center=x_center, y_center=y_center)
+                x, y, e = self.settings.integrate(frame, smooth=False, errors=True)
+                if self.orientation is not None:
+                    self.orientation.update(i, self.settings, frame)
+                yield ref, x, y, e
+                if callback is not None:
+                    callback()
+
+    def collect(self, refs, first_index=0, callback=None):
+        """
+        处理全部帧，对整个曲线堆栈（和误差）一次性平滑后再扣背底；误差和文件名保存在 errors、names 中
+        :return: (x, 各帧的 y, 各帧扣背底后的 y)，没有可以读取的帧时 x 为 None
+        """
+        x, columns, errors, self.names = None, [], [], []
+        for ref, x, y, e in self.run(refs, first_index, callback):
+            columns.append(y)
+            errors.append(e)
+            self.names.append(frame_stem(ref))
+        if not columns:
+            self.errors = []
+            return None, [], []
+        self.errors = list(self.settings.smooth(np.array(errors)))
+        columns = list(self.settings.smooth(np.array(columns)))
+        columns_bk = [] if self.anchors is None else list(subtract_background(x, np.array(columns), self.anchors))
+        return x, columns, columns_bk
+
+# 文本表格每次格式化的数值个数：块内一次字符串格式化，块之间释放 GIL，内存只与块大小有关
+TABLE_BLOCK_VALUES = 4096
+
+def format_table(table, fmt='%.6f', delimiter=' '):
+    """
+    把 (行数, 列数) 的表格逐块格式化为文本，与 np.savetxt 的输出相同
+    每块约 TABLE_BLOCK_VALUES 个数值做一次字符串格式化，不逐行循环
+    :return: 逐块生成文本
+    """
+    row = delimiter.join([fmt] * table.shape[1]) + '\n'
+    rows = max(TABLE_BLOCK_VALUES // max(table.shape[1], 1), 1)
+    for start in range(0, len(table), rows):
+        block = table[start:start + rows]
+        yield (row * len(block)) % tuple(block.ravel().tolist())
+
+def write_table(path, columns, fmt='%.6f', delimiter=' ', header=''):
+    """
+    覆盖写入（不追加），header 原样写在表格之前
+    :param columns: 等长的一维数组，或 (行数, 列数) 的二维数组
+    :return: 导出的文件列表
+    """
+    table = columns if isinstance(columns, np.ndarray) and columns.ndim == 2 else np.column_stack(columns)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(header)
+        f.writelines(format_table(table, fmt, delimiter))
+    return [path]
+
+def counting_errors(y):
+    # 没有每个 bin 的计数信息时按计数统计估计误差 sqrt(|I|)
+    return np.sqrt(np.abs(y))
+
+class ProfileExporter:
+    """
+    一维结果导出为常用格式：
+    txt（两列，制表符分隔，10 位有效数字）、xye（横坐标、强度、误差）、Fit2D .chi、GSAS .fxye（2θ，单位百分之一度）、
+    CSV 和 NeXus/HDF5（NXentry/NXdata，需要可选依赖 h5py）
+    单条曲线写一个文件；曲线堆栈中 txt、xye、chi、fxye 每帧一个文件，CSV 和 NeXus 整个堆栈写一个文件
+    """
+    FORMATS = ('txt', 'xye', 'chi', 'fxye', 'csv', 'nexus')
+    LABELS = ['txt', 'xye（带误差）', 'Fit2D chi', 'GSAS fxye', 'CSV', 'NeXus/HDF5']
+    EXTENSIONS = {'txt': '.txt', 'xye': '.xye', 'chi': '.chi', 'fxye': '.fxye', 'csv': '.csv', 'nexus': '.nxs'}
+    STACKED = ('csv', 'nexus')
+    # 横坐标名称（PROFILE_AXES 中的径向横坐标，角向积分为 'chi'）及其说明和单位
+    AXIS_LABELS = {'q': ('Q (1/A)', '1/angstrom'), '2theta': ('2-Theta Angle (Degrees)', 'degree'),
+                   'pixel': ('Radial distance (pixels)', 'pixel'), 'd': ('D-spacing (A)', 'angstrom'),
+                   'chi': ('Azimuthal Angle (Degrees)', 'degree')}
+
+    def __init__(self, fmt='txt', axis='q', wavelength=REFERENCE_WAVELENGTH):
+        """
+        :param axis: 横坐标名称，GSAS .fxye 需要由它换算 2θ
+        :param wavelength: q、d 换算 2θ 所用的波长（埃），与界面 2θ 横坐标的参考波长一致
+        """
+        if fmt not in self.FORMATS:
+            raise ValueError(f"未知的导出格式: {fmt}")
+        if axis not in self.AXIS_LABELS:
+            raise ValueError(f"未知的横坐标: {axis}")
+        self.fmt = fmt
+        self.axis = axis
+        self.wavelength = float(wavelength)
+
+    @property
+    def extension(self):
+        return self.EXTENSIONS[self.fmt]
+
+    def two_theta(self, x):
+        # GSAS 只接受 2θ：q 和 d 按参考波长换算
+        if self.axis == '2theta':
+            return x
+        if self.axis == 'd':
+            with np.errstate(divide='ignore'):
+                x = 2 * np.pi / x
+        elif self.axis != 'q':
+            raise ValueError("GSAS fxye 导出需要 q、2theta 或 d 横坐标")
+        with np.errstate(invalid='ignore'):
+            return np.degrees(2 * np.arcsin(x * self.wavelength / 4 / np.pi))
+
+    def write(self, path, x, y, errors=None, title=''):
+        """
+        导出单条曲线，已存在的文件被覆盖
+        :param path: 不含扩展名的路径
+        :param errors: 每个点的误差，None 时按计数统计估计
+        :return: 导出的文件列表
+        """
+        path += self.extension
+        errors = counting_errors(y) if errors is None else errors
+        title = title or os.path.basename(path)
+        if self.fmt == 'txt':
+            # 与之前逐行写出的 txt 一样保留足够的有效数字，很小的强度不会变成 0
+            write_table(path, [x, y], '%.10g', '\t')
+        elif self.fmt == 'xye':
+            write_table(path, [x, y, errors], header=f'# {self.axis} intensity error\n')
+        elif self.fmt == 'chi':
+            write_table(path, [x, y], '%14.6E', ' ',
+                        f'{title}\n{self.AXIS_LABELS[self.axis][0]}\nIntensity\n{len(x):>14d}\n')
+        elif self.fmt == 'fxye':
+            self.write_fxye(path, x, y, errors, title)
+        elif self.fmt == 'csv':
+            write_table(path, [x, y, errors], '%.6f', ',', f'{self.axis},intensity,error\n')
+        else:
+            self.write_nexus(path, x, y, errors, [title])
+        return [path]
+
+    def write_fxye(self, path, x, y, errors, title):
+        # 2θ 以百分之一度为单位，按递增顺序写出；CONS 后为起始角和平均步长
+        x = self.two_theta(x) * 100
+        order = np.argsort(x)
+        x, y, errors = x[order], y[order], errors[order]
+        keep = np.isfinite(x)
+        x, y, errors = x[keep], y[keep], errors[keep]
+        step = (x[-1] - x[0]) / (len(x) - 1) if len(x) > 1 else 0.0
+        header = f'{title}\nBANK 1 {len(x)} {len(x)} CONS {x[0] if len(x) else 0.0:.4f} {step:.4f} 0 0 FXYE\n'
+        write_table(path, [x, y, errors], '%15.6f', ' ', header)
+
+    def write_stack(self, folder, x, curves, errors=None, names=None, stem='output'):
+        """
+        导出曲线堆栈
+        :param curves: (帧数, 点数)
+        :param errors: 与 curves 同形状，None 时按计数统计估计
+        :param names: 每帧的文件名（不含扩展名），None 时为 frame_00001 形式
+        :param stem: CSV、NeXus 堆栈文件的文件名
+        :return: 导出的文件列表
+        """
+        curves = np.asarray(curves)
+        errors = counting_errors(curves) if errors is None else np.asarray(errors)
+        names = names or [f'frame_{k + 1:05d}' for k in range(len(curves))]
+        os.makedirs(folder, exist_ok=True)
+        if self.fmt == 'csv':
+            path = os.path.join(folder, stem + '.csv')
+            write_table(path, [x, curves.T], '%.6f', ',', ','.join([self.axis] + list(names)) + '\n')
+            return [path]
+        if self.fmt == 'nexus':
+            path = os.path.join(folder, stem + '.nxs')
+            self.write_nexus(path, x, curves, errors, names)
+            return [path]
+        files = []
+        for name, y, e in zip(names, curves, errors):
+            files += self.write(os.path.join(folder, name), x, y, e, name)
+        return files
+
+    def write_nexus(self, path, x, data, errors, names):
+        # NXentry/NXdata：signal 为 data，坐标轴为帧序号（堆栈时）和横坐标，误差在 data_errors 中
+        try:
+            import h5py
+        except ImportError:
+            raise ValueError("导出 NeXus/HDF5 文件需要安装 h5py：pip install h5py")
+        label, units = self.AXIS_LABELS[self.axis]
+        with h5py.File(path, 'w') as h5:
+            entry = h5.create_group('entry')
+            entry.attrs['NX_class'] = 'NXentry'
+            entry.attrs['default'] = 'data'
+            group = entry.create_group('data')
+            group.attrs['NX_class'] = 'NXdata'
+            group.attrs['signal'] = 'data'
+            group.create_dataset('data', data=data, compression='gzip')
+            group.create_dataset('data_errors', data=errors, compression='gzip')
+            axis = group.create_dataset(self.axis, data=x)
+            axis.attrs['units'] = units
+            axis.attrs['long_name'] = label
+            if np.ndim(data) == 2:
+                group.create_dataset('frame', data=np.arange(1, len(data) + 1))
+                group.create_dataset('frame_name', data=np.array(names, dtype=h5py.string_dtype()))
+                group.attrs['axes'] = ['frame', self.axis]
+            else:
+                group.attrs['axes'] = [self.axis]
+            h5.attrs['default'] = 'entry'
+
+def write_results(output, x, columns, columns_bk=None, centers=None, skipped=None, orientation=None,
+                  exporter=None, errors=None, names=None):
+    """
+    按界面批量处理的格式导出：1D/output.txt（第一列横坐标，之后每列一帧），以及可选的
+    1D/output_subBk.txt、center_drift.txt、skipped.txt 和取向分析的 orientation/ 文件夹
+    :param exporter: ProfileExporter，格式不是 txt 时另外按该格式导出到 1D/<格式>/
+    :param errors: 各帧的误差，与 columns 一一对应；names 为各帧的导出文件名
+    :return: 导出的文件列表
+    """
+    os.makedirs(os.path.join(output, '1D'), exist_ok=True)
+    files = [os.path.join(output, '1D', 'output.txt')]
+    write_table(files[0], [x] + list(columns))
+    if columns_bk:
+        files.append(os.path.join(output, '1D', 'output_subBk.txt'))
+        write_table(files[-1], [x] + list(columns_bk))
+    if exporter is not None and exporter.fmt != 'txt':
+        files += exporter.write_stack(os.path.join(output, '1D', exporter.fmt), x, columns,
+                                      errors if errors is not None and len(errors) else None, names or None)
+    if centers:
+        files.append(os.path.join(output, 'center_drift.txt'))
+        np.savetxt(files[-1], np.array(centers), fmt=['%d', '%.3f', '%.3f'], header='frame x_Center y_Center')
+    if skipped:
+        files.append(os.path.join(output, 'skipped.txt'))
+        with open(files[-1], 'w', encoding='utf-8') as f:
+            f.writelines(f'{ref}\t{error}\n' for ref, error in skipped)
+    if orientation is not None and orientation.frames:
+        files += orientation.save(os.path.join(output, 'orientation'))
+    return files
+
+def run_recipe(recipe, folder, pattern=None, output=None, retries=2):
+    """
+    按配方无界面地处理一个文件夹：读取、校正、帧合并、漂移校正、积分和扣背底，与界面批量处理的结果相同
+    只导出一维数据：<output>/1D/output.txt，勾选扣背底且配方中有背景锚点时另有 output_subBk.txt；
+    配方中的导出格式不是 txt 时另外导出到 <output>/1D/<格式>/
+    读取失败的帧（例如仍在写入的文件）重试 retries 次后跳过，不中止整个文件夹，跳过的帧记录在 skipped.txt
+    :param pattern: 文件名匹配模式，None 时使用配方中的模式
+    :param output: 导出文件夹，None 时为 <folder>/processed
+    :return: 处理信息 dict：文件夹、帧数、跳过的帧、导出文件、耗时（秒）
+    """
+    start = time.perf_counter()
+    pattern = pattern if pattern is not None else recipe['export']['pattern']
+    refs = expand_frame_refs(match_files(folder, pattern))
+    if not refs:
+        raise ValueError(f"{folder} 中没有找到符合 {pattern} 的文件")
+    runner = RecipeRunner(recipe, retries)
+    x, columns, columns_bk = runner.collect(refs)
+    if not columns:
+        raise ValueError(f"{folder} 中没有可以读取的帧")
+    files = write_results(output or os.path.join(folder, 'processed'), x, columns, columns_bk,
+                          runner.tracker.history if runner.tracker is not None else None, runner.skipped,
+                          runner.orientation, recipe.profile_exporter(), runner.errors, runner.names)
+    return {'folder': folder, 'frames': len(columns), 'skipped': [ref for ref, _ in runner.skipped], 'files': files,
+            'seconds': time.perf_counter() - start}
+
+class WorkQueue:
+    """
+    基于共享文件系统的分布式工作队列，不需要消息服务
+    协调端把一个文件夹的帧按输出顺序切成若干块，写入 pending/；任意节点上的 worker 以原子重命名
+    pending/<块> -> claimed/<块>.<worker> 认领一块，积分后把结果写入 shards/，再把认领文件移到 done/；
+    所有块完成后合并为与单机批量处理相同的 output.txt
+    worker 处理过程中不断更新认领文件的修改时间，超时未更新的认领（节点掉线）可以放回 pending/ 重新处理
+    """
+    VERSION = 1
+
+    def __init__(self, root):
+        self.root = root
+        self.pending = os.path.join(root, 'pending')
+        self.claimed = os.path.join(root, 'claimed')
+        self.done = os.path.join(root, 'done')
+        self.shards = os.path.join(root, 'shards')
+
+    @staticmethod
+    def _write_json(path, data):
+        # 先写临时文件再重命名，其他节点不会读到写了一半的文件
+        temp = f'{path}.{os.getpid()}.tmp'
+        with open(temp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(temp, path)
+
+    def submit(self, recipe, folder, pattern=None, chunk_size=100):
+        """
+        协调端：列出帧、切块并写入队列
+        :param chunk_size: 每块输出的帧数；帧合并时每块按输出帧换算出需要读取的原始帧，块之间互不依赖
+        :return: 块数
+        """
+        pattern = pattern if pattern is not None else recipe['export']['pattern']
+        refs = expand_frame_refs(match_files(folder, pattern))
+        if not refs:
+            raise ValueError(f"{folder} 中没有找到符合 {pattern} 的文件")
+        reducer = recipe.frame_reducer()
+        total = reducer.output_count(len(refs))
+        if total == 0:
+            raise ValueError("文件数少于帧合并的 N！")
+        if os.path.exists(os.path.join(self.root, 'job.json')):
+            raise ValueError(f"{self.root} 中已有队列")
+        for path in (self.pending, self.claimed, self.done, self.shards):
+            os.makedirs(path, exist_ok=True)
+        recipe.save(os.path.join(self.root, 'recipe.json'))
+        chunk_size = max(int(chunk_size), 1)
+        tracker = None
+        if recipe['drift']['enabled']:
+            # 块的起点对齐到漂移估计的节拍，每块第一帧正好是单机处理时估计圆心的帧
+            every = max(int(recipe['drift']['every']), 1)
+            chunk_size = -(-chunk_size // every) * every
+            correction = recipe.correction()
+            tracker = recipe.drift_tracker(reducer, correction)
+        chunks = 0
+        for chunks, first in enumerate(range(0, total, chunk_size), 1):
+            last = min(first + chunk_size, total)
+            begin, end = reducer.input_range(first, last, len(refs))
+            chunk = {'index': chunks - 1, 'first': first, 'refs': refs[begin:end]}
+            if tracker is not None:
+                # 只读每块的第一帧，沿块的顺序估计圆心作为 worker 的起点；
+                # 整个数据集漂移较大时 worker 从参考圆心出发可能找不到衍射环
+                chunk['center'] = self._seed_center(tracker, reducer, correction, first,
+                                                    refs[begin:reducer.input_range(first, first + 1, len(refs))[1]])
+            self._write_json(os.path.join(self.pending, f'chunk_{chunks - 1:05d}.json'), chunk)
+        # job.json 最后写入，worker 看到它时队列已经完整
+        self._write_json(os.path.join(self.root, 'job.json'),
+                         {'version': self.VERSION, 'folder': folder, 'pattern': pattern, 'chunks': chunks,
+                          'frames': total})
+        return chunks
+
+    @staticmethod
+    def _seed_center(tracker, reducer, correction, index, refs):
+        try:
+            frames = ((ref, correction.apply(read_frame(ref))) for ref in refs)
+            _, frame = next(reducer.reduce(frames))
+        except (OSError, ValueError, StopIteration):
+            return list(tracker.center)
+        return list(tracker.update(index, frame, reducer.binning))
+
+    def job(self):
+        with open(os.path.join(self.root, 'job.json'), encoding='utf-8') as f:
+            return json.load(f)
+
+    def claim(self, worker):
+        # 重命名是原子操作：多个节点同时认领同一块时只有一个成功，其余换下一块
+        for name in sorted(os.listdir(self.pending)):
+            if not name.endswith('.json'):
+                continue
+            target = os.path.join(self.claimed, f'{name}.{worker}')
+            try:
+                os.rename(os.path.join(self.pending, name), target)
+            except (FileNotFoundError, PermissionError):
+                continue
+            with open(target, encoding='utf-8') as f:
+                return target, json.load(f)
+        return None, None
+
+    def requeue_stale(self, timeout):
+        """把超过 timeout 秒没有心跳的认领放回 pending/，返回放回的块数"""
+        count = 0
+        now = time.time()
+        for name in os.listdir(self.claimed):
+            path = os.path.join(self.claimed, name)
+            try:
+                if now - os.path.getmtime(path) > timeout:
+                    os.rename(path, os.path.join(self.pending, name.split('.json')[0] + '.json'))
+                    count += 1
+            except FileNotFoundError:
+                continue
+        return count
+
+    def work(self, worker=None, retries=2, stale=None):
+        """
+        worker：不断认领并处理块，直到队列中没有待处理的块
+        :param stale: 不为 None 时，没有待处理的块后把超过 stale 秒没有心跳的认领放回队列继续处理
+        :return: 本 worker 处理的块数
+        """
+        worker = worker or f'{socket.gethostname()}-{os.getpid()}'
+        recipe = Recipe.load(os.path.join(self.root, 'recipe.json'))
+        processed = 0
+        while True:
+            claim, chunk = self.claim(worker)
+            if claim is None:
+                if stale is not None and self.requeue_stale(stale):
+                    continue
+                return processed
+            runner = RecipeRunner(recipe, retries)
+            if runner.tracker is not None and chunk.get('center') is not None:
+                runner.tracker.center = tuple(chunk['center'])
+
+            def heartbeat():
+                try:
+                    os.utime(claim)
+                except FileNotFoundError:
+                    pass
+
+            x, columns, columns_bk = runner.collect(chunk['refs'], chunk['first'], heartbeat)
+            centers = runner.tracker.history if runner.tracker is not None else []
+            shard = os.path.join(self.shards, f"chunk_{chunk['index']:05d}.npz")
+            temp = f'{shard}.{worker}.tmp.npz'
+            np.savez(temp, x=np.asarray(x if x is not None else [], dtype=np.float64),
+                     y=np.asarray(columns, dtype=np.float64), y_bk=np.asarray(columns_bk, dtype=np.float64),
+                     centers=np.asarray(centers, dtype=np.float64).reshape(-1, 3),
+                     skipped=np.asarray([f'{ref}\t{error}' for ref, error in runner.skipped], dtype=str),
+                     errors=np.asarray(runner.errors, dtype=np.float64), names=np.asarray(runner.names, dtype=str),
+                     orientation_frames=np.asarray(runner.orientation.frames if runner.orientation else [], dtype=int),
+                     orientation=np.asarray(runner.orientation.profiles if runner.orientation else [],
+                                            dtype=np.float64))
+            os.replace(temp, shard)
+            try:
+                os.rename(claim, os.path.join(self.done, os.path.basename(claim)))
+            except FileNotFoundError:
+                # 认领已被判定超时放回队列，结果相同，保留已写入的分片即可
+                pass
+            processed += 1
+
+    def status(self):
+        count = lambda path: len([n for n in os.listdir(path) if '.json' in n]) if os.path.isdir(path) else 0
+        return {'pending': count(self.pending), 'claimed': count(self.claimed), 'done': count(self.done),
+                'shards': len([n for n in os.listdir(self.shards) if n.endswith('.npz') and '.tmp' not in n])
+                if os.path.isdir(self.shards) else 0}
+
+    def merge(self, output=None):
+        """
+        按块的顺序合并全部分片，导出格式与单机批量处理相同
+        :param output: 导出文件夹，None 时为 <root>/merged
+        :return: 导出的文件列表
+        """
+        job = self.job()
+        missing = [k for k in range(job['chunks'])
+                   if not os.path.exists(os.path.join(self.shards, f'chunk_{k:05d}.npz'))]
+        if missing:
+            raise ValueError(f"还有 {len(missing)} 块没有完成，例如 chunk_{missing[0]:05d}")
+        x, columns, columns_bk, centers, skipped, errors, names = None, [], [], [], [], [], []
+        recipe = Recipe.load(os.path.join(self.root, 'recipe.json'))
+        orientation = recipe.orientation_series()
+        for k in range(job['chunks']):
+            with np.load(os.path.join(self.shards, f'chunk_{k:05d}.npz')) as shard:
+                if x is None and len(shard['x']):
+                    x = shard['x']
+                columns.extend(shard['y'])
+                columns_bk.extend(shard['y_bk'])
+                errors.extend(shard['errors'])
+                names.extend(str(name) for name in shard['names'])
+                centers.extend((int(i), cx, cy) for i, cx, cy in shard['centers'])
+                skipped.extend(tuple(item.split('\t', 1)) for item in shard['skipped'])
+                if orientation is not None:
+                    for index, profiles in zip(shard['orientation_frames'], shard['orientation']):
+                        orientation.add(index, profiles)
+        if not columns:
+            raise ValueError("所有帧都无法读取")
+        return write_results(output or os.path.join(self.root, 'merged'), x, columns, columns_bk, centers, skipped,
+                             orientation, recipe.profile_exporter(), errors, names)
+
+class BatchJob:
+    """任务队列中的一个任务：(文件夹, 匹配模式, 配方)，以及运行状态、耗时和导出位置"""
+    WAITING, RUNNING, DONE, FAILED, CANCELLED = '等待', '运行中', '完成', '失败', '已取消'
+
+    def __init__(self, folder, pattern, recipe, output, recipe_name='当前参数'):
+        self.folder = folder
+        self.pattern = pattern
+        self.recipe = recipe
+        self.recipe_name = recipe_name
+        self.output = output
+        self.status = self.WAITING
+        self.error = ''
+        self.frames = 0
+        self.skipped = []
+        self.files = []
+        # 处理耗时（子进程内）和从提交到完成的总耗时，单位秒
+        self.seconds = None
+        self.wall_seconds = None
+        self.submitted = None
+
+    def record(self):
+        return {'folder': self.folder, 'pattern': self.pattern, 'recipe': self.recipe_name, 'output': self.output,
+                'status': self.status, 'error': self.error, 'frames': self.frames, 'skipped': self.skipped,
+                'files': self.files, 'seconds': self.seconds, 'wall_seconds': self.wall_seconds}
+
+class JobQueue(QObject):
+    """
+    多文件夹批量处理的任务队列：任务在进程池中以 concurrency 个并发运行，互不影响
+    某个任务失败只标记该任务，队列继续；每个任务结束后把全部任务的状态、耗时和导出位置写入 jobs.json
+    """
+    changed = pyqtSignal(int)
+    finished = pyqtSignal()
+    _done = pyqtSignal(int, object)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.jobs = []
+        self.log_path = None
+        self.retries = 2
+        self._executor = None
+        self._futures = {}
+        # 进程池的回调在后台线程中执行，通过信号转回界面线程更新任务状态
+        self._done.connect(self._on_done)
+
+    @property
+    def running(self):
+        return bool(self._futures)
+
+    def add(self, job):
+        self.jobs.append(job)
+        return len(self.jobs) - 1
+
+    def remove(self, index):
+        if self.jobs[index].status != BatchJob.RUNNING:
+            del self.jobs[index]
+
+    def start(self, concurrency=1, log_path=None):
+        if self.running:
+            return
+        self.log_path = log_path
+        pending = [i for i, job in enumerate(self.jobs) if job.status in (BatchJob.WAITING, BatchJob.FAILED,
+                                                                          BatchJob.CANCELLED)]
+        if not pending:
+            return
+        # spawn 启动的子进程不继承界面线程的状态
+        self._executor = ProcessPoolExecutor(max_workers=max(int(concurrency), 1),
+                                             mp_context=multiprocessing.get_context('spawn'))
+        for index in pending:
+            job = self.jobs[index]
+            job.status, job.error, job.submitted = BatchJob.WAITING, '', time.perf_counter()
+            future = self._executor.submit(run_recipe, job.recipe, job.folder, job.pattern, job.output,
+                                           self.retries)
+            self._futures[future] = job
+            future.add_done_callback(lambda f, index=index: self._done.emit(index, f))
+            self.changed.emit(index)
+        # 进程池没有“开始执行”的回调，提交后立即把前 concurrency 个任务标为运行中
+        for index in pending[:max(int(concurrency), 1)]:
+            self.jobs[index].status = BatchJob.RUNNING
+            self.changed.emit(index)
+
+    def cancel(self):
+        # 未开始的任务取消，正在运行的任务完成后结束
+        # future.cancel() 会在当前线程中同步调用完成回调，因此先把任务移出队列并标记，_on_done 随后直接忽略它
+        for future, job in list(self._futures.items()):
+            if future.running() or future.done():
+                continue
+            self._futures.pop(future)
+            if future.cancel():
+                job.status = BatchJob.CANCELLED
+                self.changed.emit(self.jobs.index(job))
+            else:
+                self._futures[future] = job
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            if not self._futures:
+                self._executor = None
+                self.save_log()
+                self.finished.emit()
+
+    def _on_done(self, index, future):
+        job = self._futures.pop(future, None)
+        if job is None or future.cancelled():
+            return
+        job.wall_seconds = time.perf_counter() - job.submitted
+        if not future.cancelled():
+            try:
+                info = future.result()
+            except Exception as e:
+                job.status, job.error = BatchJob.FAILED, str(e)
+            else:
+                job.status = BatchJob.DONE
+                job.frames, job.skipped, job.files, job.seconds = (info['frames'], info['skipped'], info['files'],
+                                                                   info['seconds'])
+        self.changed.emit(self.jobs.index(job))
+        # 下一个等待中的任务随即开始
+        for other in self._futures.values():
+            if other.status == BatchJob.WAITING:
+                other.status = BatchJob.RUNNING
+                self.changed.emit(self.jobs.index(other))
+                break
+        self.save_log()
+        if not self._futures:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+            self.finished.emit()
+
+    def save_log(self):
+        if not self.log_path:
+            return
+        os.makedirs(os.path.dirname(self.log_path) or '.', exist_ok=True)
+        with open(self.log_path, 'w', encoding='utf-8') as f:
+            json.dump([job.record() for job in self.jobs], f, ensure_ascii=False, indent=2)
+
+    def shutdown(self):
+        self.cancel()
+
+def main_cli(argv=None):
+    """
+    命令行模式：python WAXS.py --recipe recipe.json [--pattern .tif] [--output DIR] [--jobs N] 文件夹 ...
+    多个文件夹在 N 个进程中并行处理，--output 指定时每个文件夹导出到 DIR/<文件夹名>
+    """
+    parser = argparse.ArgumentParser(description='按处理配方无界面地批量积分')
+    parser.add_argument('--recipe', required=True, help='配方 JSON 文件')
+    parser.add_argument('--pattern', help='文件名匹配模式，默认使用配方中的模式')
+    parser.add_argument('--output', help='导出根文件夹，默认导出到各文件夹下的 processed')
+    parser.add_argument('--jobs', type=int, default=1, help='并行处理的进程数')
+    parser.add_argument('--retries', type=int, default=2, help='读取失败的帧重试次数，之后跳过该帧')
+    parser.add_argument('folders', nargs='+', help='数据文件夹')
+    args = parser.parse_args(argv)
+
+    recipe = Recipe.load(args.recipe)
+    outputs = [os.path.join(args.output, os.path.basename(os.path.normpath(folder))) if args.output else None
+               for folder in args.folders]
+    failed = 0
+    with ProcessPoolExecutor(max_workers=max(args.jobs, 1)) as executor:
+        futures = [executor.submit(run_recipe, recipe, folder, args.pattern, output, args.retries)
+                   for folder, output in zip(args.folders, outputs)]
+        for folder, future in zip(args.folders, futures):
+            try:
+                info = future.result()
+            except Exception as e:
+                failed += 1
+                print(f'{folder}: 失败 {e}', file=sys.stderr)
+                continue
+            skipped = f"，跳过 {len(info['skipped'])} 帧" if info['skipped'] else ''
+            print(f"{folder}: {info['frames']} 帧{skipped}，{info['seconds']:.1f} s -> {info['files'][0]}")
+    return 1 if failed else 0
+
+def queue_cli(argv=None):
+    """
+    分布式模式，队列文件夹需位于各节点都能访问的共享文件系统上：
+    python WAXS.py --queue 队列文件夹 submit --recipe recipe.json [--chunk 100] 数据文件夹   （协调端切块）
+    python WAXS.py --queue 队列文件夹 work [--stale 600]   （在任意节点上启动任意多个 worker）
+    python WAXS.py --queue 队列文件夹 merge [--output DIR]   （全部完成后合并）
+    python WAXS.py --queue 队列文件夹 status
+    """
+    parser = argparse.ArgumentParser(description='基于共享文件系统的分布式批量积分')
+    parser.add_argument('--queue', required=True, help='队列文件夹')
+    parser.add_argument('action', choices=['submit', 'work', 'merge', 'status'])
+    parser.add_argument('folder', nargs='?', help='数据文件夹（submit）')
+    parser.add_argument('--recipe', help='配方 JSON 文件（submit）')
+    parser.add_argument('--pattern', help='文件名匹配模式，默认使用配方中的模式（submit）')
+    parser.add_argument('--chunk', type=int, default=100, help='每块的输出帧数（submit）')
+    parser.add_argument('--retries', type=int, default=2, help='读取失败的帧重试次数（work）')
+    parser.add_argument('--stale', type=float, help='认领超过该秒数没有心跳时重新处理（work）')
+    parser.add_argument('--output', help='导出文件夹，默认为 <队列文件夹>/merged（merge）')
+    args = parser.parse_intermixed_args(argv)
+
+    queue = WorkQueue(args.queue)
+    if args.action == 'submit':
+        if not args.recipe or not args.folder:
+            parser.error('submit 需要 --recipe 和数据文件夹')
+        print(f'{queue.submit(Recipe.load(args.recipe), args.folder, args.pattern, args.chunk)} 块已写入 {args.queue}')
+    elif args.action == 'work':
+        print(f'处理了 {queue.work(retries=args.retries, stale=args.stale)} 块')
+    elif args.action == 'merge':
+        print('\n'.join(queue.merge(args.output)))
+    else:
+        print(json.dumps(queue.status(), ensure_ascii=False))
+    return 0
+
 if __name__ == '__main__':
+    if '--queue' in sys.argv[1:]:
+        sys.exit(queue_cli())
+    if '--recipe' in sys.argv[1:]:
+        # 命令行模式，不创建界面
+        sys.exit(main_cli())
 
     app = QApplication(sys.argv)
     # 创建主窗口
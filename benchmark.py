@@ -0,0 +1,543 @@
+"""
+积分、渲染和批量处理吞吐量的基准测试
+
+生成带衍射环、模块间隙和坏点的合成探测器图像（默认 1k²、2k²、4k²），
+分别测量解码、校正掩码、积分、扣背底、二维渲染、一维作图和导出各环节的帧速率与峰值内存，
+不需要图形界面，结果以 JSON 输出，便于在不同提交之间比较：
+
+    python benchmark.py --output before.json
+    python benchmark.py --output after.json --compare before.json
+
+--dtype-check 另外以 float64 为参考检查 float32 处理路径的积分结果，超出容差时返回非零退出码
+--calibration-check 另外用已知几何的合成标样检查标定结果，超出容差时返回非零退出码
+--binning-check 另外检查 1×1、2×2、4×4 像素合并后积分曲线的峰位（q、2θ）与已知衍射环一致
+--queue-check 另外用多个本地进程代替节点运行分布式队列，检查合并结果与单机处理的 output.txt 相同
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import matplotlib
+matplotlib.use('Agg')
+import numpy as np
+import cv2
+
+import WAXS
+
+SCHEMA_VERSION = 1
+
+# 在新进程中测量导入耗时和首个窗口显示耗时，避免受当前进程已导入模块的影响
+STARTUP_SCRIPT = '''
+import json, sys, time
+start = time.perf_counter()
+import WAXS
+imported = time.perf_counter()
+from PyQt5.QtWidgets import QApplication
+app = QApplication(sys.argv)
+window = WAXS.MainWindow()
+window.show()
+app.processEvents()
+shown = time.perf_counter()
+print(json.dumps({'import_s': imported - start, 'first_window_s': shown - start,
+                  'matplotlib_loaded': 'matplotlib' in sys.modules, 'scipy_loaded': 'scipy' in sys.modules}))
+'''
+
+
+def synthetic_frame(size, seed=0):
+    # 以图像中心偏下为圆心的若干衍射环 + 泊松噪声，加上水平/竖直模块间隙和随机坏点
+    rng = np.random.default_rng(seed)
+    y, x = np.ogrid[:size, :size]
+    center = (size * 0.5, size * 0.6)
+    r = np.hypot(x - center[0], y - center[1])
+    image = 20 + 200 * np.exp(-r / (0.15 * size))
+    for radius, width, height in ((0.12, 0.004, 800), (0.2, 0.006, 500), (0.31, 0.008, 300), (0.42, 0.01, 150)):
+        image = image + height * np.exp(-(r - radius * size) ** 2 / (2 * (width * size) ** 2))
+    frame = rng.poisson(image).astype(np.uint16)
+    gap = max(size // 100, 2)
+    for k in range(1, 4):
+        frame[k * size // 4: k * size // 4 + gap, :] = 0
+    frame[:, size // 2: size // 2 + gap] = 0
+    dead = rng.integers(0, size, (2, size // 10))
+    frame[dead[0], dead[1]] = 65535
+    return frame, center
+
+
+def pipeline_settings(size, center, correction=None):
+    # 积分参数与界面默认值一致：整圆扇形、500 个 bin
+    geometry = WAXS.DetectorGeometry(center[0], size - 1 - center[1], 300, 73.2, 73.2, 1.24)
+    return WAXS.PipelineSettings(geometry, -180, 180, 0, size * 0.6, 500, 0, 60000, 0, 2000,
+                                 correction=correction)
+
+
+def measure(func, repeat, items=None):
+    """
+    先不计时运行一次（延迟导入、首次调用的初始化不计入），再运行 func repeat 次，返回每帧耗时列表（秒）和峰值内存（MB）
+    :param items: 每次调用的参数，None 时不带参数调用
+    """
+    func(*(() if items is None else (items[0],)))
+    times = []
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    for i in range(repeat):
+        args = () if items is None else (items[i % len(items)],)
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return times, peak / 2 ** 20
+
+
+def summarize(size, stage, times, peak_mb):
+    times = np.array(times)
+    return {
+        'size': size,
+        'stage': stage,
+        'frames_per_s': float(1 / times.mean()),
+        'mean_ms': float(times.mean() * 1e3),
+        'p50_ms': float(np.percentile(times, 50) * 1e3),
+        'p95_ms': float(np.percentile(times, 95) * 1e3),
+        'peak_mb': float(peak_mb),
+        'repeat': int(len(times)),
+    }
+
+
+def write_edf(path, frame):
+    header = ('{\nHeaderID = EH:000001:000000:000000 ;\nByteOrder = LowByteFirst ;\nDataType = UnsignedShort ;\n'
+              f'Dim_1 = {frame.shape[1]} ;\nDim_2 = {frame.shape[0]} ;\nSize = {frame.nbytes} ;\n')
+    header = header.ljust(511 + 512 * (len(header) // 511)) + '}'
+    with open(path, 'wb') as f:
+        f.write(header.encode('latin-1'))
+        f.write(frame.astype('<u2').tobytes())
+
+
+def bench_size(size, repeat, workdir):
+    results = []
+    frame, center = synthetic_frame(size)
+    frames = [synthetic_frame(size, seed)[0] for seed in range(3)]
+
+    # 解码
+    tif_files, edf_files = [], []
+    for i, f in enumerate(frames):
+        tif_files.append(os.path.join(workdir, f'frame_{size}_{i}.tif'))
+        cv2.imwrite(tif_files[-1], f)
+        edf_files.append(os.path.join(workdir, f'frame_{size}_{i}.edf'))
+        write_edf(edf_files[-1], f)
+    results.append(summarize(size, 'decode_tif', *measure(WAXS.read_frame, repeat, tif_files)))
+    results.append(summarize(size, 'decode_edf', *measure(WAXS.read_frame, repeat, edf_files)))
+
+    # 暗场、平场和坏点掩码校正
+    correction = WAXS.DetectorCorrection()
+    correction.dark = np.full(frame.shape, 2, dtype=np.float32)
+    correction.flat = np.ones(frame.shape, dtype=np.float32)
+    correction.mask = frame == 0
+    correction.update()
+    results.append(summarize(size, 'correct', *measure(correction.apply, repeat, frames)))
+    corrected = [correction.apply(f) for f in frames]
+
+    # 积分：首次构建查找表与复用查找表分开统计
+    settings = pipeline_settings(size, center, correction)
+
+    def integrate_cold(im):
+        WAXS._integration_operator_cache.clear()
+        return settings.integrate(im)
+    results.append(summarize(size, 'integrate_cold', *measure(integrate_cold, max(repeat // 3, 1), corrected)))
+    settings.integrate(corrected[0])
+    results.append(summarize(size, 'integrate', *measure(settings.integrate, repeat, corrected)))
+
+    # 扣背底
+    x, y = settings.integrate(corrected[0])
+    x_bg = x[np.linspace(0, len(x) - 1, 8).astype(int)]
+    results.append(summarize(size, 'background', *measure(lambda: WAXS.subtract_background(x, y, x_bg), repeat)))
+
+    # 二维渲染（原图模式，缩放到 1000×800 的窗口）
+    mask = (corrected[0] >= 60000) | (corrected[0] < 0)
+    results.append(summarize(size, 'render_2d', *measure(
+        lambda im: WAXS.render_frame(im, 0, 2000, mask, False, (1000, 800)), repeat, corrected)))
+    # 界面的原图显示：只取窗口内的像素计算，写入与 QImage 共享的持久缓冲区
+    display = WAXS.DisplayBuffer()
+    results.append(summarize(size, 'render_display', *measure(
+        lambda im: display.render(im, 0, 2000, (0, 60000), correction.mask, False, (1000, 800)), repeat, corrected)))
+
+    # 一维作图：与批量处理相同，300 dpi 保存图片
+    def plot_1d():
+        fig, ax = WAXS.plt.subplots()
+        ax.plot(x, y)
+        buffer = io.BytesIO()
+        fig.savefig(buffer, dpi=300, format='jpg')
+        WAXS.plt.close(fig)
+    results.append(summarize(size, 'plot_1d', *measure(plot_1d, max(repeat // 3, 1))))
+    # 界面中的一维曲线：嵌入画布上 set_data 原地更新后重绘（Agg 渲染，不需要显示器）
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PyQt5.QtWidgets import QApplication
+    app = QApplication.instance() or QApplication(['benchmark'])
+    canvas = WAXS.PlotCanvas()
+    canvas.resize(1000, 800)
+    canvas.plot_profile(x, y, False, 'q', 'Intensity')
+
+    def plot_canvas():
+        canvas.plot_profile(x, y * 1.01, False, 'q', 'Intensity')
+        canvas.canvas.draw()
+    results.append(summarize(size, 'plot_canvas', *measure(plot_canvas, repeat)))
+    # 曲线叠加：5000 帧结果中选取 1000 帧（抽稀并更新 LineCollection，不含 Agg 渲染）
+    stack = y[None, :] * np.linspace(0.5, 1.5, 5000)[:, None]
+    overlay = WAXS.OverlayView(np.column_stack([x, stack.T]))
+    overlay.resize(1000, 800)
+    results.append(summarize(size, 'overlay_select', *measure(
+        lambda: (overlay.set_frames([]), overlay.set_frames(np.arange(0, 5000, 5))), repeat)))
+
+    # 一维数据导出：与界面单帧导出相同，按块格式化写出
+    exporter = WAXS.ProfileExporter('xye')
+    export_path = os.path.join(workdir, 'export')
+    results.append(summarize(size, 'export', *measure(lambda: exporter.write(export_path, x, y), repeat)))
+    return results
+
+
+def dtype_check(size, tolerance):
+    """
+    分别以 float64 和默认的 WAXS.WORK_DTYPE 构建查找表并积分同一帧，比较积分曲线、峰值内存和查找表大小
+    圆心取非整数、带倾斜和强度校正，使像素落在 bin 边界附近的情况都能出现
+    :param tolerance: 允许的最大偏差，相对于参考曲线的最大值
+    """
+    frame, center = synthetic_frame(size)
+    work_dtype = WAXS.WORK_DTYPE
+    geometry = WAXS.DetectorGeometry(center[0] + 0.37, size - 1 - center[1] + 0.21, 300, 73.2, 73.2, 1.24, 2, 30)
+    corrections = WAXS.IntensityCorrection(solid_angle=True, polarization=0.95)
+    rows = {}
+    try:
+        for dtype in (np.float64, work_dtype):
+            WAXS.WORK_DTYPE = dtype
+            WAXS._integration_operator_cache.clear()
+            settings = WAXS.PipelineSettings(geometry, -180, 180, 0, size * 0.6, 500, 0, 60000, 0, 2000,
+                                             intensity_correction=corrections)
+            image = frame.astype(dtype)
+            tracemalloc.start()
+            _, profile = settings.integrate(image)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            operator = next(iter(WAXS._integration_operator_cache.values()))
+            lut = sum(a.nbytes for a in (operator.pixels, operator.rbin, operator.thetabin, operator.weights)
+                      if a is not None)
+            rows[np.dtype(dtype).name] = (profile, peak / 2 ** 20, lut / 2 ** 20)
+    finally:
+        WAXS.WORK_DTYPE = work_dtype
+        WAXS._integration_operator_cache.clear()
+    reference, ref_peak, ref_lut = rows['float64']
+    profile, peak, lut = rows[np.dtype(work_dtype).name]
+    deviation = float(np.abs(profile - reference).max() / np.abs(reference).max())
+    return {'size': size, 'dtype': np.dtype(work_dtype).name, 'max_rel_deviation': deviation,
+            'tolerance': tolerance, 'passed': deviation <= tolerance, 'peak_mb': peak, 'peak_mb_float64': ref_peak,
+            'lut_mb': lut, 'lut_mb_float64': ref_lut}
+
+
+def binning_check(size, tolerance=1e-3):
+    """
+    在已知 2θ 处生成一个完整的衍射环，分别不合并和 2×2、4×4 像素合并后积分，比较 q 和 2θ 横坐标上的峰位与真值
+    不倾斜和倾斜的探测器各检查一次（两者计算等效半径的路径不同）
+    :param tolerance: 峰位允许的相对偏差
+    """
+    results = []
+    for tilt in (0, 2):
+        geometry = WAXS.DetectorGeometry(size * 0.5 + 0.3, size * 0.45 + 0.7, 300, 75, 75, 1.0, tilt, 30)
+        x, y = geometry.pixel_offsets((size, size))
+        # 衍射环半径约为边长的 0.3 倍，完整落在图像内
+        ring = np.arctan(0.3 * size * geometry.pixel_x * 1e-6 / (geometry.distance * 1e-3))
+        two_theta = geometry.two_theta(x, y)
+        # pixel_offsets 为积分所用的翻转后坐标，帧按未翻转方向保存
+        frame = (20 + 1000 * np.exp(-(two_theta - ring) ** 2 / (2 * np.radians(0.05) ** 2)))[::-1].astype(np.float32)
+        expected = {'q': 4 * np.pi * np.sin(ring / 2) / geometry.lamda, '2theta': np.degrees(ring)}
+        for binning in (1, 2, 4):
+            image = WAXS.bin_frame(frame, binning)
+            row = {'size': size, 'tilt_deg': tilt, 'binning': binning}
+            for axis_index in (3, 4):
+                axis = WAXS.PROFILE_AXES[axis_index][1]
+                settings = WAXS.PipelineSettings(geometry, -180, 180, 0, size, 1000, -np.inf, np.inf, -np.inf, np.inf,
+                                                 axis_index=axis_index, binning=binning, value_scale=binning ** 2,
+                                                 reference_wavelength=geometry.lamda)
+                values, profile = settings.integrate(image)
+                # 峰位取半高以上各 bin 的强度加权平均，不受 bin 宽度量化的影响
+                profile = np.nan_to_num(profile - np.nanmin(profile))
+                top = profile >= profile.max() / 2
+                row[f'peak_{axis}'] = float(np.sum(values[top] * profile[top]) / np.sum(profile[top]))
+                row[f'deviation_{axis}'] = float(abs(row[f'peak_{axis}'] / expected[axis] - 1))
+            row['passed'] = bool(max(row['deviation_q'], row['deviation_2theta']) <= tolerance)
+            results.append(row)
+    return results
+
+
+# 队列检查的配方：不合并，以及每 3 帧求和加 2×2 像素合并（总帧数不是 3 的倍数，最后不足一组的帧被丢弃）
+QUEUE_CASES = {
+    'none': {'mode': 'none', 'group': 1, 'binning': 1},
+    'sum3_bin2': {'mode': 'sum', 'group': 3, 'binning': 2},
+}
+
+
+def queue_worker(root, name):
+    # 子进程入口：代替一个节点处理队列直到没有待处理的块
+    WAXS.WorkQueue(root).work(worker=name)
+
+
+def queue_check(size, workdir, frames=40, workers=3, chunk_size=4):
+    """
+    分布式队列的本地检查：协调端切块后由 workers 个独立进程（代替各节点）同时认领处理，
+    合并后的 output.txt 应与单机 run_recipe 的结果逐字节相同
+    """
+    import multiprocessing
+    folder = os.path.join(workdir, f'queue_{size}')
+    os.makedirs(folder, exist_ok=True)
+    center = None
+    for k in range(frames):
+        frame, center = synthetic_frame(size, seed=k)
+        cv2.imwrite(os.path.join(folder, f'frame_{k:04d}.tif'), frame)
+    results = []
+    for name, reduce in QUEUE_CASES.items():
+        recipe = WAXS.Recipe({
+            'geometry': {'x_center': center[0], 'y_center': size - 1 - center[1], 'distance': 300.0,
+                         'pixel_x': 73.2, 'pixel_y': 73.2, 'lamda': 1.24},
+            'integration': {'outer_radius': size * 0.6},
+            'mask': {'threshold_min': 0.0, 'threshold_max': 60000.0},
+            'display': {'cb_min': 0.0, 'cb_max': 2000.0},
+            'reduce': reduce,
+            'export': {'pattern': '*.tif'},
+        })
+        single = os.path.join(workdir, f'single_{size}_{name}')
+        start = time.perf_counter()
+        WAXS.run_recipe(recipe, folder, output=single)
+        single_s = time.perf_counter() - start
+
+        root = os.path.join(workdir, f'queue_{size}_{name}')
+        queue = WAXS.WorkQueue(root)
+        start = time.perf_counter()
+        chunks = queue.submit(recipe, folder, chunk_size=chunk_size)
+        # spawn 与真实节点一样从头导入，不继承协调端的状态
+        context = multiprocessing.get_context('spawn')
+        processes = [context.Process(target=queue_worker, args=(root, f'node{k}')) for k in range(workers)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        merged = os.path.join(workdir, f'merged_{size}_{name}')
+        queue.merge(merged)
+        queue_s = time.perf_counter() - start
+
+        with open(os.path.join(single, '1D', 'output.txt'), 'rb') as f:
+            expected = f.read()
+        with open(os.path.join(merged, '1D', 'output.txt'), 'rb') as f:
+            actual = f.read()
+        a, b = np.loadtxt(io.BytesIO(expected)), np.loadtxt(io.BytesIO(actual))
+        results.append({'size': size, 'case': name, 'frames': frames, 'workers': workers, 'chunks': chunks,
+                        'worker_exit_codes': [process.exitcode for process in processes],
+                        'max_abs_diff': float(np.abs(a - b).max()) if a.shape == b.shape else None,
+                        'single_s': single_s, 'queue_s': queue_s, 'passed': expected == actual})
+    return results
+
+
+# 标定检查的合成标样：(标样, 边长, 像素尺寸 um, 距离 mm, 倾斜角, 倾斜方位角, 衍射环宽度（2θ 标准差，度）,
+# 初值相对真值的偏差 (圆心-X, 圆心-Y, 距离倍数))
+CALIBRATION_CASES = [
+    ('Si', 2048, 75, 150, 0, 0, 0.03, (0, 0, 1)),
+    ('Si', 2048, 75, 150, 0, 0, 0.03, (5, -4, 1.2)),
+    ('AgBe', 2048, 75, 1000, 0, 0, 0.03, (5, -4, 1.1)),
+    ('AgBe', 2048, 75, 1000, 3, 30, 0.03, (5, -4, 1.1)),
+    ('LaB6', 1024, 172, 200, 0, 0, 0.01, (4, -3, 0.9)),
+    ('AgBe', 1024, 172, 300, 0, 0, 0.01, (4, -3, 0.9)),
+    ('AgBe', 2048, 75, 250, 2, 30, 0.03, (12, -9, 0.85)),
+    ('LaB6', 2048, 75, 200, 5, -60, 0.03, (6, 5, 1.1)),
+]
+
+
+def synthetic_calibrant(geometry, size, d_spacings, width, seed=1):
+    # 随 2θ 衰减的背景 + 标样各衍射环处的高斯峰 + 泊松噪声，与标定输入一样为翻转后的方向
+    x, y = geometry.pixel_offsets((size, size))
+    two_theta = geometry.two_theta(x, y)
+    d = np.asarray(d_spacings, dtype=np.float64)
+    rings = 2 * np.arcsin(geometry.lamda / (2 * d[geometry.lamda / (2 * d) < 1]))
+    image = 50 * np.exp(-two_theta / 0.1)
+    for k, ring in enumerate(rings):
+        image = image + 200 / (1 + 0.2 * k) * np.exp(-(two_theta - ring) ** 2 / (2 * np.radians(width) ** 2))
+    return np.random.default_rng(seed).poisson(image).astype(np.float32)
+
+
+def calibration_check(center_tolerance=0.5, distance_tolerance=1e-3, tilt_tolerance=0.1):
+    """
+    用已知几何生成的合成标样检查标定：距离较短、衍射环很少的 Si，1000 mm 处的 AgBe（未倾斜时不应拟合出倾斜），
+    172 um 像素上很锐的衍射环，以及从偏离真值的初值出发的倾斜探测器
+    :param center_tolerance: 圆心允许偏差（pixel）
+    :param distance_tolerance: 距离允许的相对偏差
+    :param tilt_tolerance: 倾斜允许偏差（度），按倾斜角和倾斜方位角合成的倾斜矢量比较
+    """
+    results = []
+    for calibrant, size, pixel, distance, tilt, rotation, width, (dx, dy, scale) in CALIBRATION_CASES:
+        true = WAXS.DetectorGeometry(size * 0.49 + 0.3, size * 0.53 + 0.7, distance, pixel, pixel, 1.0, tilt, rotation)
+        image = synthetic_calibrant(true, size, WAXS.CALIBRANTS[calibrant], width)
+        guess = WAXS.DetectorGeometry(true.x_center + dx, true.y_center + dy, distance * scale, pixel, pixel, 1.0)
+        row = {'calibrant': calibrant, 'size': size, 'pixel_um': pixel, 'distance_mm': distance, 'tilt_deg': tilt,
+               'start_offset': [dx, dy, scale]}
+        start = time.perf_counter()
+        try:
+            fitted, info = WAXS.calibrate_geometry(image, guess, WAXS.CALIBRANTS[calibrant])
+        except ValueError as e:
+            row.update({'error': str(e), 'passed': False})
+            results.append(row)
+            continue
+        row['seconds'] = time.perf_counter() - start
+
+        def tilt_vector(g):
+            return g.tilt * np.array([np.cos(np.radians(g.rotation)), np.sin(np.radians(g.rotation))])
+
+        row.update({'center_error_px': float(np.hypot(fitted.x_center - true.x_center, fitted.y_center - true.y_center)),
+                    'distance_error': abs(fitted.distance / distance - 1),
+                    'tilt_error_deg': float(np.hypot(*(tilt_vector(fitted) - tilt_vector(true)))),
+                    'fitted_tilt_deg': fitted.tilt, **info})
+        row['passed'] = (row['center_error_px'] <= center_tolerance and row['distance_error'] <= distance_tolerance
+                         and row['tilt_error_deg'] <= tilt_tolerance)
+        results.append(row)
+    return results
+
+
+def bench_startup(repeat):
+    env = dict(os.environ)
+    if sys.platform.startswith('linux') and not env.get('DISPLAY') and not env.get('WAYLAND_DISPLAY'):
+        env.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT], capture_output=True, text=True, env=env,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    results = []
+    for key, stage in (('import_s', 'startup_import'), ('first_window_s', 'startup_window')):
+        results.append(summarize(0, stage, [run[key] for run in runs], 0))
+    # 启动阶段不应导入 matplotlib 和 scipy
+    results[-1]['heavy_modules_loaded'] = any(run['matplotlib_loaded'] or run['scipy_loaded'] for run in runs)
+    return results
+
+
+def metadata():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'schema': SCHEMA_VERSION,
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def compare(results, baseline):
+    # 按 (尺寸, 环节) 对比帧速率，>1 表示比基准更快
+    base = {(r['size'], r['stage']): r for r in baseline['results']}
+    print(f"\n{'size':>6} {'stage':<16} {'fps':>10} {'base fps':>10} {'speedup':>8}")
+    for r in results['results']:
+        b = base.get((r['size'], r['stage']))
+        if b is None:
+            continue
+        print(f"{r['size']:>6} {r['stage']:<16} {r['frames_per_s']:>10.2f} {b['frames_per_s']:>10.2f} "
+              f"{r['frames_per_s'] / b['frames_per_s']:>7.2f}x")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='X-ray 原位数据处理基准测试')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1024, 2048, 4096], help='合成图像边长（像素）')
+    parser.add_argument('--repeat', type=int, default=10, help='每个环节重复次数')
+    parser.add_argument('--output', help='结果 JSON 文件，默认输出到标准输出')
+    parser.add_argument('--compare', help='用于对比的基准结果 JSON 文件')
+    parser.add_argument('--startup', action='store_true', help='同时测量导入耗时和首个窗口显示耗时（size 记为 0）')
+    parser.add_argument('--dtype-check', action='store_true', help='检查 float32 处理路径与 float64 参考的积分偏差')
+    parser.add_argument('--tolerance', type=float, default=5e-4, help='--dtype-check 允许的相对偏差')
+    parser.add_argument('--binning-check', action='store_true',
+                        help='检查 1×1、2×2、4×4 像素合并后积分曲线的峰位（q、2θ）')
+    parser.add_argument('--queue-check', action='store_true',
+                        help='用多个本地进程代替节点运行分布式队列，检查合并结果与单机处理相同')
+    parser.add_argument('--calibration-check', action='store_true',
+                        help='用已知几何的合成 Si、LaB6、AgBe 标样检查标定的圆心、距离和倾斜')
+    args = parser.parse_args(argv)
+
+    results = {'meta': metadata(), 'results': []}
+    def record(rows):
+        for r in rows:
+            results['results'].append(r)
+            print(f"{r['size']:>6} {r['stage']:<16} {r['frames_per_s']:>10.2f} fps  "
+                  f"p95 {r['p95_ms']:>8.2f} ms  peak {r['peak_mb']:>8.1f} MB", file=sys.stderr)
+
+    if args.startup:
+        record(bench_startup(min(args.repeat, 5)))
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in args.sizes:
+            record(bench_size(size, args.repeat, workdir))
+    passed = True
+    if args.dtype_check:
+        results['dtype_check'] = []
+        for size in args.sizes:
+            r = dtype_check(size, args.tolerance)
+            results['dtype_check'].append(r)
+            passed &= r['passed']
+            print(f"{r['size']:>6} {r['dtype']:<8} deviation {r['max_rel_deviation']:.2e} "
+                  f"({'ok' if r['passed'] else 'FAILED'})  peak {r['peak_mb']:.1f}/{r['peak_mb_float64']:.1f} MB  "
+                  f"LUT {r['lut_mb']:.1f}/{r['lut_mb_float64']:.1f} MB", file=sys.stderr)
+    if args.binning_check:
+        results['binning_check'] = []
+        for size in args.sizes:
+            for r in binning_check(size):
+                results['binning_check'].append(r)
+                passed &= r['passed']
+                print(f"{r['size']:>6} tilt {r['tilt_deg']} bin {r['binning']}  q {r['peak_q']:.4f}  "
+                      f"2theta {r['peak_2theta']:.4f}  deviation {max(r['deviation_q'], r['deviation_2theta']):.1e} "
+                      f"({'ok' if r['passed'] else 'FAILED'})", file=sys.stderr)
+    if args.queue_check:
+        results['queue_check'] = []
+        with tempfile.TemporaryDirectory() as workdir:
+            for size in args.sizes:
+                for r in queue_check(size, workdir):
+                    results['queue_check'].append(r)
+                    passed &= r['passed']
+                    diff = 'shape differs' if r['max_abs_diff'] is None else f"max diff {r['max_abs_diff']:.2e}"
+                    print(f"{r['size']:>6} {r['case']:<10} {r['frames']} frames, {r['chunks']} chunks, "
+                          f"{r['workers']} workers  {diff}  single {r['single_s']:.2f} s  queue {r['queue_s']:.2f} s  "
+                          f"({'ok' if r['passed'] else 'FAILED'})", file=sys.stderr)
+    if args.calibration_check:
+        results['calibration_check'] = calibration_check()
+        for r in results['calibration_check']:
+            passed &= r['passed']
+            case = f"{r['calibrant']:<5} {r['size']:>5} {r['pixel_um']:>4} um {r['distance_mm']:>5} mm tilt {r['tilt_deg']}"
+            if 'error' in r:
+                print(f"{case}  FAILED: {r['error']}", file=sys.stderr)
+                continue
+            print(f"{case}  center {r['center_error_px']:.3f} px  distance {r['distance_error']:.1e}  "
+                  f"tilt {r['tilt_error_deg']:.3f} deg  rms {r['rms_deg']:.4f} deg  {r['seconds']:.2f} s  "
+                  f"({'ok' if r['passed'] else 'FAILED'})", file=sys.stderr)
+
+    try:
+        import resource
+        # Linux 上 ru_maxrss 单位为 KB，macOS 上为字节
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        results['meta']['max_rss_mb'] = rss / (2 ** 20 if sys.platform == 'darwin' else 2 ** 10)
+    except ImportError:
+        pass
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+    return 0 if passed else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())